@@ -0,0 +1,183 @@
+"""Bulk check that token balances match call history.
+
+Two checks, reported separately. Balances: every balance should equal the
+signup grant, minus the stored cost of the calls the user placed, plus the
+professional's share of the calls they took; these are the amounts settlement
+actually moved. Costs: each ended call's stored cost is recomputed from its
+duration and price the way settlement does, and calls where the two differ
+are counted, without affecting the balance check.
+
+The job reads ended calls in chunks into NumPy arrays and sums debits and
+credits per user with pandas. Calls from before prices were stored on the
+call fall back to the callee's profile price, as startup reconciliation does.
+Settlements in flight while the job runs can show up as small transient
+differences, so run it off-peak or re-check the users it reports:
+
+    python balance_audit.py --output discrepancies.csv
+"""
+import asyncio
+import json
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+import typer
+
+from billing import DEFAULT_PRICE_PER_MINUTE, MINIMUM_CALL_COST, PROFESSIONAL_SHARE, SIGNUP_TOKENS
+from repositories import STORAGE_ENGINE, Storage, create_storage
+
+CHUNK_SIZE = 100_000
+
+DISCREPANCY_COLUMNS = ["user_id", "balance", "expected", "difference", "debits", "credits"]
+
+
+def calls_frame(calls: List[dict], profile_prices: Optional[pd.Series] = None) -> pd.DataFrame:
+    """One row per call, built column by column; missing fields take the values settlement assumed.
+
+    A call without a stored price gets its callee's price from ``profile_prices``
+    (user id -> price), or ``DEFAULT_PRICE_PER_MINUTE`` for unknown callees."""
+    callee_ids = np.array([call.get("callee_id") for call in calls], object)
+    price = np.array([call.get("price_per_minute") or np.nan for call in calls], float)
+    missing = np.isnan(price)
+    if missing.any() and profile_prices is not None:
+        price[missing] = profile_prices.reindex(callee_ids[missing]).to_numpy()
+    cost = np.array([call.get("cost_tokens") or 0 for call in calls], float)
+    earning = np.array([call.get("professional_earning", np.nan) for call in calls], float)
+    return pd.DataFrame({
+        "caller_id": np.array([call.get("caller_id") for call in calls], object),
+        "callee_id": callee_ids,
+        "started": np.array([call.get("started_at") is not None for call in calls], bool),
+        "duration": np.array([call.get("duration_minutes") or 0 for call in calls], float),
+        "price": np.where(np.isnan(price), DEFAULT_PRICE_PER_MINUTE, price),
+        "cost": cost,
+        # What the professional was credited; end_call does not store it, so derive it from the cost
+        "earning": np.where(np.isnan(earning), np.trunc(cost * PROFESSIONAL_SHARE), earning),
+    })
+
+
+def settle(frame: pd.DataFrame) -> pd.DataFrame:
+    """Add ``expected_cost``: ``billing.call_cost`` over whole columns."""
+    cost = np.where(
+        frame["started"].to_numpy(),
+        np.maximum(MINIMUM_CALL_COST, np.trunc(frame["duration"].to_numpy() * frame["price"].to_numpy())),
+        0,
+    )
+    frame["expected_cost"] = cost.astype(np.int64)
+    return frame
+
+
+def sum_by(keys: np.ndarray, values: np.ndarray) -> pd.Series:
+    """``values`` summed per key; factorize + bincount is several times faster than groupby on strings."""
+    codes, uniques = pd.factorize(keys)
+    return pd.Series(np.bincount(codes, weights=values, minlength=len(uniques)).astype(np.int64), index=uniques)
+
+
+class Totals:
+    """Per-user sums across chunks. Partial sums are kept and merged in one pass
+    every few chunks; aligning a running Series per chunk costs O(users) each time."""
+
+    def __init__(self, merge_every: int = 8):
+        self.merge_every = merge_every
+        self._parts: List[pd.Series] = []
+
+    def add(self, keys: np.ndarray, values: np.ndarray):
+        self._parts.append(sum_by(keys, values))
+        if len(self._parts) >= self.merge_every:
+            self._parts = [self.result()]
+
+    def result(self) -> pd.Series:
+        if not self._parts:
+            return pd.Series(dtype=np.int64)
+        if len(self._parts) == 1:
+            return self._parts[0]
+        return sum_by(np.concatenate([part.index.to_numpy() for part in self._parts]),
+                      np.concatenate([part.to_numpy() for part in self._parts]))
+
+
+async def audit(storage: Storage, chunk_size: int = CHUNK_SIZE, sample_calls: int = 20) -> dict:
+    """Summary plus a DataFrame of users whose balance is off, largest difference first."""
+    # Users first: calls from before per-call prices need the callees' profile prices
+    balances = []
+    prices = []
+    async for chunk in storage.users.iter_balance_batches(chunk_size):
+        user_ids = [str(user["_id"]) for user in chunk]
+        balances.append(pd.Series(np.array([user.get("token_balance") or 0 for user in chunk], np.int64),
+                                  index=user_ids))
+        prices.append(pd.Series(np.array([user.get("price_per_minute") or np.nan for user in chunk], float),
+                                index=user_ids))
+    balance = pd.concat(balances) if balances else pd.Series(dtype=np.int64)
+    profile_prices = pd.concat(prices).dropna() if prices else pd.Series(dtype=float)
+
+    debits = Totals()
+    credits = Totals()
+    calls = 0
+    cost_mismatches = 0
+    mismatched_calls: List[str] = []
+    async for chunk in storage.calls.iter_ended_batches(chunk_size):
+        frame = settle(calls_frame(chunk, profile_prices))
+        calls += len(frame)
+        mismatched = np.flatnonzero(frame["cost"].to_numpy() != frame["expected_cost"].to_numpy())
+        cost_mismatches += len(mismatched)
+        for index in mismatched[:sample_calls - len(mismatched_calls)]:
+            mismatched_calls.append(str(chunk[index]["_id"]))
+        # Balances follow the stored amounts; a wrong cost is a cost mismatch, not two balance errors
+        debits.add(frame["caller_id"].to_numpy(), frame["cost"].to_numpy())
+        credits.add(frame["callee_id"].to_numpy(), frame["earning"].to_numpy())
+    debits = debits.result()
+    credits = credits.result()
+
+    users = pd.DataFrame({"balance": balance})
+    users["debits"] = debits.reindex(users.index).fillna(0)
+    users["credits"] = credits.reindex(users.index).fillna(0)
+    users["expected"] = SIGNUP_TOKENS - users["debits"] + users["credits"]
+    users["difference"] = users["balance"] - users["expected"]
+    users = users.astype(np.int64)
+
+    discrepancies = (users[users["difference"] != 0]
+                     .rename_axis("user_id").reset_index()
+                     .sort_values("difference", key=abs, ascending=False)[DISCREPANCY_COLUMNS])
+
+    unknown = debits.index.union(credits.index).difference(users.index)
+    return {
+        "summary": {
+            "calls": calls,
+            "users": len(users),
+            "cost_mismatches": cost_mismatches,
+            "mismatched_calls": mismatched_calls,
+            "users_with_discrepancy": len(discrepancies),
+            "net_difference": int(discrepancies["difference"].sum()),
+            "unknown_participants": len(unknown),
+        },
+        "discrepancies": discrepancies.reset_index(drop=True),
+    }
+
+
+app = typer.Typer(add_completion=False)
+
+
+@app.command()
+def main(
+    output: Optional[str] = typer.Option(None, "--output", "-o", help="CSV file for every discrepancy"),
+    chunk_size: int = typer.Option(CHUNK_SIZE, help="Calls per vectorized chunk and cursor batch"),
+    show: int = typer.Option(20, help="Discrepancies to print"),
+):
+    async def run():
+        storage = create_storage(STORAGE_ENGINE)
+        try:
+            return await audit(storage, chunk_size)
+        finally:
+            storage.close()
+
+    result = asyncio.run(run())
+    typer.echo(json.dumps(result["summary"], indent=2))
+    discrepancies = result["discrepancies"]
+    if len(discrepancies):
+        typer.echo(discrepancies.head(show).to_string(index=False))
+    if output:
+        discrepancies.to_csv(output, index=False)
+    if result["summary"]["users_with_discrepancy"] or result["summary"]["cost_mismatches"]:
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,12 @@
+MINIMUM_CALL_COST = 10  # Minimum tokens charged for a started call
+PROFESSIONAL_SHARE = 0.85  # 15% platform fee
+DEFAULT_PRICE_PER_MINUTE = 5
+SIGNUP_TOKENS = 1000  # Granted at registration, the only other source of tokens
+
+
+def call_cost(duration_minutes: float, price_per_minute: float) -> int:
+    return max(MINIMUM_CALL_COST, int(duration_minutes * price_per_minute))
+
+
+def professional_earning(cost: int) -> int:
+    return int(cost * PROFESSIONAL_SHARE)
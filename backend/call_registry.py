@@ -0,0 +1,160 @@
+"""In-process registry of open (pending and active) calls.
+
+Calls are indexed by id and by participant, so call control can validate a
+request, find the call a user is in and meter a running call without asking
+Mongo. Writes go to storage in the background, chained per call so they land
+in order; anything that needs the stored state (settlement) waits for the
+call's chain first with ``flush``.
+
+The registry mirrors the calls this process created or loaded at startup. A
+call it does not know about (placed through another worker) is handled by the
+storage path as before. Calls still pending ``ring_timeout`` seconds after
+they were placed are dropped by a background task and handed to
+``on_expire``, so unanswered calls do not pile up.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from billing import DEFAULT_PRICE_PER_MINUTE, call_cost
+
+logger = logging.getLogger(__name__)
+
+OPEN_STATUSES = ("pending", "active")
+
+
+class CallRegistry:
+    def __init__(self, ring_timeout: float = 60, interval: float = 5):
+        self._calls: Dict[str, dict] = {}
+        self._by_user: Dict[str, Set[str]] = {}
+        self._writes: Dict[str, asyncio.Task] = {}
+        self.ring_timeout = ring_timeout
+        self.interval = interval
+        self.expired_total = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def __contains__(self, call_id: str) -> bool:
+        return call_id in self._calls
+
+    def rebuild(self, calls: Iterable[dict]):
+        self._calls.clear()
+        self._by_user.clear()
+        for call in calls:
+            self.add(call)
+
+    def add(self, call: dict):
+        call_id = str(call["_id"])
+        self._calls[call_id] = dict(call)
+        for participant in (call["caller_id"], call["callee_id"]):
+            self._by_user.setdefault(participant, set()).add(call_id)
+
+    def remove(self, call_id: str) -> Optional[dict]:
+        call = self._calls.pop(call_id, None)
+        if call is not None:
+            for participant in (call["caller_id"], call["callee_id"]):
+                call_ids = self._by_user.get(participant)
+                if call_ids is not None:
+                    call_ids.discard(call_id)
+                    if not call_ids:
+                        del self._by_user[participant]
+        return call
+
+    def get(self, call_id: str) -> Optional[dict]:
+        call = self._calls.get(call_id)
+        return dict(call) if call else None
+
+    def for_user(self, user_id: str) -> List[dict]:
+        return [dict(self._calls[call_id]) for call_id in self._by_user.get(user_id, ())]
+
+    def accept(self, call_id: str, callee_id: str, started_at: datetime) -> Optional[dict]:
+        """Same contract as ``CallRepository.accept``, applied in memory."""
+        call = self._calls.get(call_id)
+        if call is None or call["callee_id"] != callee_id or call["status"] != "pending":
+            return None
+        call.update(status="active", started_at=started_at)
+        return dict(call)
+
+    def unanswered(self, placed_before: datetime) -> List[dict]:
+        """Pending calls placed before ``placed_before``."""
+        return [dict(call) for call in self._calls.values()
+                if call["status"] == "pending" and call["created_at"] < placed_before]
+
+    @staticmethod
+    def meter(call: dict, now: datetime) -> dict:
+        """Running duration and cost of an open call, as settlement would compute them now."""
+        if call["status"] != "active" or not call.get("started_at"):
+            return {"duration": 0, "cost": 0}
+        duration = (now - call["started_at"]).total_seconds() / 60
+        return {"duration": duration,
+                "cost": call_cost(duration, call.get("price_per_minute", DEFAULT_PRICE_PER_MINUTE))}
+
+    # Write-behind persistence
+
+    def persist(self, call_id: str, write: Callable[[], Awaitable]):
+        """Run ``write()`` after the call's earlier writes, without waiting for it."""
+        previous = self._writes.get(call_id)
+
+        async def run():
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            try:
+                await write()
+            except Exception:
+                logger.exception("Persisting call %s failed", call_id)
+            finally:
+                if self._writes.get(call_id) is task:
+                    del self._writes[call_id]
+
+        task = asyncio.get_running_loop().create_task(run())
+        self._writes[call_id] = task
+
+    async def flush(self, call_id: Optional[str] = None):
+        """Wait for the pending writes of one call, or of all calls."""
+        if call_id is None:
+            tasks = list(self._writes.values())
+        else:
+            tasks = [self._writes[call_id]] if call_id in self._writes else []
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def pending_writes(self) -> int:
+        return len(self._writes)
+
+    # Ring timeout
+
+    def start(self, on_expire: Callable[[dict], Awaitable[None]]):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(on_expire))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, on_expire: Callable[[dict], Awaitable[None]]):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.expire(datetime.utcnow() - timedelta(seconds=self.ring_timeout), on_expire)
+
+    async def expire(self, placed_before: datetime, on_expire: Callable[[dict], Awaitable[None]]):
+        """Drop the calls still pending that were placed before ``placed_before``."""
+        for call in self.unanswered(placed_before):
+            call_id = str(call["_id"])
+            # Accepted or ended while an earlier call's on_expire was awaited
+            current = self._calls.get(call_id)
+            if current is None or current["status"] != "pending":
+                continue
+            self.remove(call_id)
+            self.expired_total += 1
+            try:
+                await on_expire(call)
+            except Exception:
+                logger.exception("Expiring call %s failed", call_id)
@@ -0,0 +1,148 @@
+"""Response compression for JSON endpoints.
+
+Bodies at or above ``minimum_size`` are compressed with the best encoding the
+client accepts: brotli when the optional ``brotli`` package is installed, gzip
+otherwise. Streaming responses and responses that already carry a
+Content-Encoding pass through untouched.
+
+Public listings such as ``/api/professionals`` return the same bytes to every
+caller until the catalog changes, so for ``cacheable_paths`` the compressed
+output is kept in a small LRU keyed by the uncompressed body. A repeat body
+costs a dict lookup instead of another compression pass.
+"""
+import gzip
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+import metrics
+
+try:
+    import brotli
+except ImportError:  # Optional, gzip is always available
+    brotli = None
+
+compressed_bytes = metrics.registry.counter(
+    "http_compression_bytes_total", "Response body bytes before and after compression", ("encoding", "stage"))
+compression_cache = metrics.registry.counter(
+    "http_compression_cache_total", "Lookups in the precompressed response cache", ("outcome",))
+
+
+def supported_encodings() -> Tuple[str, ...]:
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def choose_encoding(accept_encoding: str, available: Iterable[str]) -> Optional[str]:
+    """Picks the first of ``available`` the client accepts with a non-zero q."""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in available:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 4) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        cacheable_paths: Iterable[str] = (),
+        cache_entries: int = 64,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.cacheable_paths = frozenset(cacheable_paths)
+        self.cache_entries = cache_entries
+        self.encodings = supported_encodings()
+        self._cache: "OrderedDict[Tuple[str, bytes], bytes]" = OrderedDict()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers: Dict[bytes, bytes] = dict(scope.get("headers", []))
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        cacheable = scope["method"] == "GET" and scope["path"] in self.cacheable_paths
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                # Held back until the body shows whether it is worth compressing
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            response_headers = start_message.get("headers", [])
+            if (
+                message.get("more_body", False)
+                or len(body) < self.minimum_size
+                or any(name.lower() == b"content-encoding" for name, _ in response_headers)
+            ):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = self._compress(body, encoding, cacheable)
+            start_message["headers"] = [
+                (name, value) for name, value in response_headers if name.lower() != b"content-length"
+            ] + [
+                (b"content-encoding", encoding.encode("latin-1")),
+                (b"content-length", str(len(compressed)).encode("latin-1")),
+                (b"vary", b"Accept-Encoding"),
+            ]
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
+
+    def _compress(self, body: bytes, encoding: str, cacheable: bool) -> bytes:
+        key = (encoding, body)
+        if cacheable:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                compression_cache.inc("hit")
+                return cached
+            compression_cache.inc("miss")
+
+        compressed = compress(body, encoding, self.gzip_level, self.brotli_quality)
+        compressed_bytes.inc(encoding, "in", amount=len(body))
+        compressed_bytes.inc(encoding, "out", amount=len(compressed))
+        if cacheable:
+            self._cache[key] = compressed
+            if len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        return compressed
@@ -0,0 +1,34 @@
+import os
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+DATABASE_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DATABASE_NAME = os.getenv("MONGO_DB_NAME", "click_online")
+
+
+def mongo_client_options(**overrides) -> dict:
+    """Motor client options from the environment.
+
+    Compressors are passed through as a comma separated list (``zstd,snappy,zlib``);
+    pymongo negotiates the first one the server also supports and skips any whose
+    Python package is not installed.
+    """
+    options = {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+        "readPreference": os.getenv("MONGO_READ_PREFERENCE", "primary"),
+    }
+    compressors = os.getenv("MONGO_COMPRESSORS", "")
+    if compressors:
+        options["compressors"] = compressors
+        if "zlib" in compressors:
+            options["zlibCompressionLevel"] = int(os.getenv("MONGO_ZLIB_LEVEL", "-1"))
+    options.update(overrides)
+    return options
+
+
+def create_client(url: str = DATABASE_URL, **overrides) -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(url, **mongo_client_options(**overrides))
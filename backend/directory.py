@@ -0,0 +1,134 @@
+"""In-process directory of professionals, pre-serialized and pre-sorted.
+
+Every professional is serialized and JSON-encoded once, when their document
+changes. The directory keeps a sorted list of keys for every (category,
+status, order) view, with ``None`` meaning "any", so listing a page is a slice
+of a prebuilt list joined into a JSON array: no database query, no
+serialization, no encoding per request.
+
+Handlers call ``upsert`` with the post-image of every write that can touch a
+professional (profile, status, balance) and ``set_status_many`` for bulk
+presence changes. Each process holds its own copy, rebuilt at startup.
+"""
+import bisect
+import json
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Sort orders exposed as ?sort=; keys end with the user id so they are unique.
+# ObjectId hex sorts by creation time, which is the order Mongo listed them in.
+ORDERS: Dict[str, Callable[["DirectoryEntry"], tuple]] = {
+    "default": lambda entry: (entry.user_id,),
+    "price_asc": lambda entry: (entry.price, entry.user_id),
+    "price_desc": lambda entry: (-entry.price, entry.user_id),
+    "name": lambda entry: (entry.name.casefold(), entry.user_id),
+}
+
+
+def encode(value) -> bytes:
+    # Same output as FastAPI's JSONResponse
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_array(payloads: Iterable[bytes]) -> bytes:
+    return b"[" + b",".join(payloads) + b"]"
+
+
+class DirectoryEntry:
+    __slots__ = ("user_id", "category", "status", "price", "name", "data", "payload")
+
+    def __init__(self, data: dict):
+        self.user_id = data["id"]
+        self.category = data.get("category")
+        self.status = data.get("status")
+        self.price = data.get("price_per_minute") or 0
+        self.name = data.get("name") or ""
+        self.data = data
+        self.payload = encode(data)
+
+    def views(self) -> List[Tuple[Optional[str], Optional[str]]]:
+        return list({(category, status) for category in (None, self.category) for status in (None, self.status)})
+
+    def same_position(self, other: "DirectoryEntry") -> bool:
+        return (self.category, self.status, self.price, self.name) == (
+            other.category, other.status, other.price, other.name)
+
+
+class ProfessionalDirectory:
+    def __init__(self, serialize: Callable[[dict], dict]):
+        self.serialize = serialize
+        self._entries: Dict[str, DirectoryEntry] = {}
+        self._lists: Dict[Tuple[Optional[str], Optional[str], str], list] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def rebuild(self, users: Iterable[dict]):
+        self._entries.clear()
+        self._lists.clear()
+        for user in users:
+            if user.get("professional_mode"):
+                entry = DirectoryEntry(self.serialize(user))
+                self._entries[entry.user_id] = entry
+        for entry in self._entries.values():
+            for category, status in entry.views():
+                for order, key in ORDERS.items():
+                    self._lists.setdefault((category, status, order), []).append(key(entry))
+        for keys in self._lists.values():
+            keys.sort()
+
+    def _link(self, entry: DirectoryEntry):
+        for category, status in entry.views():
+            for order, key in ORDERS.items():
+                bisect.insort(self._lists.setdefault((category, status, order), []), key(entry))
+
+    def _unlink(self, entry: DirectoryEntry):
+        for category, status in entry.views():
+            for order, key in ORDERS.items():
+                keys = self._lists[(category, status, order)]
+                sort_key = key(entry)
+                index = bisect.bisect_left(keys, sort_key)
+                if index < len(keys) and keys[index] == sort_key:
+                    del keys[index]
+
+    def _replace(self, entry: DirectoryEntry):
+        previous = self._entries.get(entry.user_id)
+        self._entries[entry.user_id] = entry
+        if previous is not None and previous.same_position(entry):
+            return  # Only the payload changed, e.g. a token balance
+        if previous is not None:
+            self._unlink(previous)
+        self._link(entry)
+
+    def upsert(self, user: dict):
+        """Apply the post-image of a write; non-professionals are dropped."""
+        if not user.get("professional_mode"):
+            self.remove(str(user["_id"]))
+            return
+        self._replace(DirectoryEntry(self.serialize(user)))
+
+    def remove(self, user_id: str):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._unlink(entry)
+
+    def set_status_many(self, user_ids: Iterable[str], status: str):
+        for user_id in user_ids:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry.status != status:
+                self._replace(DirectoryEntry({**entry.data, "status": status}))
+
+    def status_of(self, user_id: str) -> Optional[str]:
+        entry = self._entries.get(user_id)
+        return entry.status if entry is not None else None
+
+    def page(
+        self, category: Optional[str] = None, status: Optional[str] = None,
+        order: str = "default", offset: int = 0, limit: int = 100,
+    ) -> Tuple[int, List[bytes]]:
+        """Number of professionals in the view and the encoded entries of one page."""
+        keys = self._lists.get((category, status, order), [])
+        return len(keys), [self._entries[key[-1]].payload for key in keys[offset:offset + limit]]
+
+    def get_many(self, user_ids: Iterable[str]) -> List[bytes]:
+        entries = (self._entries.get(user_id) for user_id in user_ids)
+        return [entry.payload for entry in entries if entry is not None]
@@ -0,0 +1,54 @@
+"""Export call records for finance without going through the API.
+
+Streams the same output as ``GET /api/admin/exports/calls`` to a file or
+stdout, reading the calls collection with a batched cursor:
+
+    python export_calls.py 2024-01-01 2024-01-31 --format csv --gzip -o calls-jan.csv.gz
+"""
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from typing import Optional
+
+import typer
+
+from exports import FORMATS, stream_calls
+from repositories import STORAGE_ENGINE, create_storage
+
+app = typer.Typer(add_completion=False)
+
+
+async def export(start: datetime, end: datetime, fmt: str, compress: bool, output, batch_size: int) -> int:
+    storage = create_storage(STORAGE_ENGINE)
+    written = 0
+    try:
+        async for chunk in stream_calls(storage.calls.iter_created_between(start, end, batch_size), fmt, compress):
+            output.write(chunk)
+            written += len(chunk)
+    finally:
+        storage.close()
+    return written
+
+
+@app.command()
+def main(
+    from_date: datetime = typer.Argument(..., formats=["%Y-%m-%d"], help="First day, UTC"),
+    to_date: datetime = typer.Argument(..., formats=["%Y-%m-%d"], help="Last day, UTC, inclusive"),
+    fmt: str = typer.Option("ndjson", "--format", help=f"One of: {', '.join(FORMATS)}"),
+    gzip: bool = typer.Option(False, "--gzip", help="Gzip the output"),
+    output: Optional[str] = typer.Option(None, "--output", "-o", help="File to write; stdout if omitted"),
+    batch_size: int = typer.Option(1000, help="Documents per cursor batch"),
+):
+    if fmt not in FORMATS:
+        raise typer.BadParameter(f"must be one of: {', '.join(FORMATS)}", param_hint="--format")
+    end = to_date + timedelta(days=1)
+    if output is None:
+        written = asyncio.run(export(from_date, end, fmt, gzip, sys.stdout.buffer, batch_size))
+    else:
+        with open(output, "wb") as handle:
+            written = asyncio.run(export(from_date, end, fmt, gzip, handle, batch_size))
+    typer.echo(f"Exported {written} bytes", err=True)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,106 @@
+"""Streaming export of call records for finance.
+
+Calls are read from a cursor in batches and encoded into NDJSON or CSV chunks
+of about ``chunk_size`` bytes, optionally gzipped on the fly, so memory use is
+one cursor batch plus one chunk whatever the size of the export. Used by the
+admin endpoint in ``server.py`` and by the ``export_calls.py`` CLI.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, Iterable, List
+
+import metrics
+from billing import professional_earning
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# One column per field, in this order, for both formats
+EXPORT_FIELDS = (
+    "id", "caller_id", "callee_id", "status", "price_per_minute",
+    "created_at", "started_at", "ended_at", "duration_minutes",
+    "cost_tokens", "professional_earning", "settled_by",
+)
+
+CHUNK_SIZE = 64 * 1024
+
+exported_rows = metrics.registry.counter(
+    "call_export_rows_total", "Call records written by exports", ("format",))
+
+
+def to_record(call: dict) -> dict:
+    """Flatten a call document into export columns; datetimes become ISO 8601 (UTC)."""
+    record = {}
+    for field in EXPORT_FIELDS:
+        if field == "id":
+            value = str(call["_id"])
+        elif field == "professional_earning":
+            # Stored by reconciliation; end_call credits the same amount without storing it
+            value = call.get(field)
+            if value is None and call.get("status") == "ended":
+                value = professional_earning(call.get("cost_tokens") or 0)
+        else:
+            value = call.get(field)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        record[field] = value
+    return record
+
+
+def _encode_ndjson(records: Iterable[dict]) -> bytes:
+    return "".join(
+        json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n" for record in records
+    ).encode("utf-8")
+
+
+def _encode_csv(records: Iterable[dict]) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, EXPORT_FIELDS, lineterminator="\n")
+    writer.writerows(records)
+    return buffer.getvalue().encode("utf-8")
+
+
+async def stream_calls(
+    calls: AsyncIterator[dict],
+    fmt: str = "ndjson",
+    compress: bool = False,
+    chunk_size: int = CHUNK_SIZE,
+    gzip_level: int = 6,
+) -> AsyncIterator[bytes]:
+    """Encode ``calls`` as ``fmt`` and yield chunks of roughly ``chunk_size`` bytes."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'")
+    encode = _encode_csv if fmt == "csv" else _encode_ndjson
+    # wbits=31 writes a gzip container, so the output is a regular .gz file
+    compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31) if compress else None
+
+    def output(data: bytes) -> bytes:
+        return compressor.compress(data) if compressor else data
+
+    if fmt == "csv":
+        first = output(",".join(EXPORT_FIELDS).encode("utf-8") + b"\n")
+        if first:
+            yield first
+
+    batch: List[dict] = []
+    # Encoded size grows with the batch; estimate it from the first rows
+    batch_rows = 256
+    async for call in calls:
+        batch.append(to_record(call))
+        if len(batch) >= batch_rows:
+            data = encode(batch)
+            exported_rows.inc(fmt, amount=len(batch))
+            batch_rows = max(1, batch_rows * chunk_size // max(len(data), 1))
+            batch.clear()
+            data = output(data)
+            if data:
+                yield data
+    if batch:
+        exported_rows.inc(fmt, amount=len(batch))
+        data = output(encode(batch))
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+PING_FRAME = json.dumps({"type": "ping"})
+
+
+class HeartbeatSweeper:
+    """Single background task that pings idle sockets and reaps dead ones.
+
+    Connections are tracked by the ConnectionManager's ``last_seen`` map, which is
+    refreshed on every inbound frame. One sweep walks all connections: sockets
+    quiet for ``interval`` seconds get a ping, sockets quiet for ``idle_timeout``
+    seconds are closed and handed to ``on_reap`` for presence cleanup.
+    """
+
+    def __init__(
+        self,
+        manager,
+        on_reap: Callable[[str, str], Awaitable[None]],
+        interval: float = 20,
+        idle_timeout: float = 60,
+        send_timeout: float = 5,
+    ):
+        self.manager = manager
+        self.on_reap = on_reap
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.send_timeout = send_timeout
+        self._task: Optional[asyncio.Task] = None
+        self.sweeps = 0
+        self.pings_sent = 0
+        self.reaped_total = 0
+        self.last_sweep_seconds = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Heartbeat sweep failed")
+
+    async def sweep(self):
+        started = time.monotonic()
+        ping_before = started - self.interval
+        reap_before = started - self.idle_timeout
+
+        to_ping = []
+        to_reap = []
+        for connection_id, (user_id, last_seen) in list(self.manager.last_seen.items()):
+            if last_seen < reap_before:
+                to_reap.append((connection_id, user_id))
+            elif last_seen < ping_before:
+                to_ping.append(connection_id)
+
+        if to_ping:
+            await asyncio.gather(*(self._ping(connection_id) for connection_id in to_ping))
+        for connection_id, user_id in to_reap:
+            await self._reap(connection_id, user_id)
+
+        self.sweeps += 1
+        self.last_sweep_seconds = time.monotonic() - started
+
+    async def _ping(self, connection_id: str):
+        websocket = self.manager.active_connections.get(connection_id)
+        if websocket is None:
+            return
+        try:
+            await asyncio.wait_for(websocket.send_text(PING_FRAME), self.send_timeout)
+            self.pings_sent += 1
+        except Exception:
+            # The next sweep past idle_timeout will reap it
+            pass
+
+    async def _reap(self, connection_id: str, user_id: str):
+        websocket = self.manager.active_connections.get(connection_id)
+        if not self.manager.disconnect(connection_id, user_id):
+            return
+        self.reaped_total += 1
+        logger.info("Reaped idle connection %s for user %s", connection_id, user_id,
+                    extra={"event": "ws.reap", "user_id": user_id, "connection_id": connection_id})
+        if websocket is not None:
+            try:
+                await asyncio.wait_for(websocket.close(code=1001), self.send_timeout)
+            except Exception:
+                pass
+        await self.on_reap(connection_id, user_id)
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self.manager.active_connections),
+            "sweeps": self.sweeps,
+            "pings_sent": self.pings_sent,
+            "reaped_total": self.reaped_total,
+            "last_sweep_seconds": self.last_sweep_seconds,
+            "interval": self.interval,
+            "idle_timeout": self.idle_timeout,
+        }
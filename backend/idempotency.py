@@ -0,0 +1,124 @@
+"""Replay of responses for requests retried with the same ``Idempotency-Key``.
+
+A client that times out and retries sends the same key again; the retry gets
+the first attempt's response instead of creating another call or settling one
+twice. Responses are kept in a bounded in-memory LRU and written through to
+``IdempotencyRepository`` so they survive a restart and are shared between
+workers, until they expire.
+
+Only successful responses are stored: a request that failed can be retried
+with the same key and runs again. A retry that arrives while the first
+attempt is still running in this process waits for it. The same key sent with
+a different request body is rejected with ``KeyReused``.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import metrics
+from repositories import IdempotencyRepository
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 255
+
+idempotency_requests = metrics.registry.counter(
+    "idempotency_requests_total", "Requests carrying an Idempotency-Key, by how they were answered", ("outcome",))
+
+
+class KeyReused(Exception):
+    """The key was already used for a request with a different body."""
+
+
+def fingerprint(payload: dict) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyKeys:
+    def __init__(self, repository: Optional[IdempotencyRepository] = None,
+                 max_entries: int = 10000, ttl_seconds: float = 86400):
+        self.repository = repository
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # key -> (expires_at_monotonic, fingerprint, response)
+        self._memory: "OrderedDict[str, Tuple[float, str, dict]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+    async def run(self, key: str, payload: dict, handler: Callable[[], Awaitable[dict]]) -> Tuple[dict, bool]:
+        """The response for ``key``: the stored one if there is one, otherwise
+        ``handler()``'s, stored on success. The flag is True for a replay."""
+        request_fingerprint = fingerprint(payload)
+        while True:
+            stored = await self._lookup(key)
+            if stored is not None:
+                stored_fingerprint, response, outcome = stored
+                if stored_fingerprint != request_fingerprint:
+                    idempotency_requests.inc("conflict")
+                    raise KeyReused(key)
+                idempotency_requests.inc(outcome)
+                return response, True
+            running = self._in_flight.get(key)
+            if running is None:
+                break
+            # Look again once the first attempt is done; if it failed, this one runs
+            idempotency_requests.inc("waited")
+            await asyncio.wait([running])
+
+        running = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = running
+        try:
+            response = await handler()
+            self._remember(key, request_fingerprint, response)
+        finally:
+            del self._in_flight[key]
+            running.set_result(None)
+        idempotency_requests.inc("miss")
+        await self._save(key, request_fingerprint, response)
+        return response, False
+
+    async def _lookup(self, key: str) -> Optional[Tuple[str, dict, str]]:
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires, stored_fingerprint, response = entry
+            if expires > time.monotonic():
+                self._memory.move_to_end(key)
+                return stored_fingerprint, response, "memory_hit"
+            del self._memory[key]
+        if self.repository is None:
+            return None
+        try:
+            doc = await self.repository.get(key)
+        except Exception:
+            # Without the durable tier a retry runs again, as it did before keys existed
+            logger.exception("Could not look up idempotency key")
+            return None
+        if doc is None:
+            return None
+        remaining = (doc["expires_at"] - datetime.utcnow()).total_seconds()
+        self._remember(key, doc["fingerprint"], doc["response"], remaining)
+        return doc["fingerprint"], doc["response"], "stored_hit"
+
+    def _remember(self, key: str, request_fingerprint: str, response: dict, ttl: Optional[float] = None):
+        ttl = self.ttl_seconds if ttl is None else ttl
+        self._memory[key] = (time.monotonic() + ttl, request_fingerprint, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def _save(self, key: str, request_fingerprint: str, response: dict):
+        if self.repository is None:
+            return
+        try:
+            await self.repository.save(key, request_fingerprint, response,
+                                       datetime.utcnow() + timedelta(seconds=self.ttl_seconds))
+        except Exception:
+            # The request succeeded; only a retry through another worker or after a restart would rerun
+            logger.exception("Could not store idempotency key")
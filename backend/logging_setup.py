@@ -0,0 +1,115 @@
+"""Structured, non-blocking logging.
+
+Records are put on a bounded queue by the calling thread and written by a
+``QueueListener`` thread, so the event loop never waits on stderr. Messages use
+%-style arguments and are only formatted on the listener thread. Noisy event
+types (``extra={"event": "ws.connect"}``) can be sampled before they are queued:
+
+    LOG_SAMPLE_RATES="ws.connect=0.01,ws.disconnect=0.01"
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        event, _, rate = item.partition("=")
+        rates[event.strip()] = float(rate)
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of the records of each sampled event type."""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(getattr(record, "event", None))
+        if rate is None or rate >= 1:
+            return True
+        if random.random() >= rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that defers formatting to the listener thread and never blocks.
+
+    The stock handler formats the message in the caller; the listener lives in
+    this process, so the record can be passed on as is. When the queue is full
+    the record is dropped and counted instead of stalling the caller.
+    """
+
+    def __init__(self, log_queue: queue.SimpleQueue, max_size: int):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        # SimpleQueue is lock-free on put; the size check is approximate, which is fine
+        if self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+def configure_logging(
+    level: int = logging.INFO,
+    json_format: bool = True,
+    asynchronous: bool = True,
+    sample_rates: Optional[Dict[str, float]] = None,
+    queue_size: int = 10000,
+    stream=None,
+) -> Optional[logging.handlers.QueueListener]:
+    """Replace the root handlers. Returns the listener to stop at shutdown, if any."""
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if json_format else logging.Formatter(logging.BASIC_FORMAT))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(level)
+
+    listener = None
+    if asynchronous:
+        handler = LazyQueueHandler(queue.SimpleQueue(), queue_size)
+        listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+        listener.start()
+    else:
+        handler = output
+    if sample_rates:
+        handler.addFilter(SamplingFilter(sample_rates))
+    root.addHandler(handler)
+    return listener
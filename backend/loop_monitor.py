@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+loop_lag = metrics.registry.histogram(
+    "event_loop_lag_seconds", "Delay between when a loop tick was due and when it ran", (), LAG_BUCKETS)
+loop_blocked = metrics.registry.counter(
+    "event_loop_blocked_total", "Times the watchdog caught the event loop blocked past the threshold")
+
+
+class LoopLagMonitor:
+    """Measures event loop scheduling delay and captures the stack of blocking code.
+
+    A coroutine wakes every ``interval`` seconds and records how late it woke up.
+    A watchdog thread checks that those ticks keep coming; if none has run for
+    ``threshold`` seconds the loop is blocked, so it samples the loop thread's
+    current stack (which is the blocking code) and logs it once per episode.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25, max_stack_depth: int = 30):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_stack_depth = max_stack_depth
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        self._last_tick = time.monotonic()
+        self.max_lag = 0.0
+        self.stalls = 0
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._tick())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    async def _tick(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._last_tick = now
+            loop_lag.observe(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+    def _watch(self):
+        blocked_since: Optional[float] = None
+        poll = max(self.threshold / 4, 0.01)
+        while not self._stop.wait(poll):
+            last_tick = self._last_tick
+            overdue = time.monotonic() - last_tick - self.interval
+            if overdue < self.threshold:
+                if blocked_since is not None:
+                    logger.warning("Event loop unblocked after %.3fs", time.monotonic() - blocked_since)
+                blocked_since = None
+                continue
+            if blocked_since is not None:
+                continue  # Already reported this episode
+            blocked_since = last_tick + self.interval
+            self.stalls += 1
+            loop_blocked.inc()
+            logger.warning("Event loop blocked for %.3fs, stack of the blocking code:\n%s",
+                           overdue, self.capture_stack())
+
+    def capture_stack(self) -> str:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return "<loop thread not found>"
+        return "".join(traceback.format_stack(frame, limit=self.max_stack_depth))
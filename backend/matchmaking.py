@@ -0,0 +1,279 @@
+"""Matchmaking for "call the next available professional".
+
+Callers wait in a FIFO per category (an ordered dict: O(1) enqueue, cancel and
+pop) and are matched against the longest-idle online professional of that
+category. Available professionals sit in a min-heap per category keyed by the
+time they became available; entries are invalidated lazily, so a status change
+is O(1) and stale heap entries are skipped (and periodically compacted) on pop.
+
+Whenever a category has both a waiting caller and an available professional,
+one dispatch task per category pairs them off and hands each pair to
+``on_match``. A single ticker sends queue-position updates and expires callers
+that waited too long, so the cost per tick is one pass over the queues rather
+than one timer per caller. Callers near the front hear about every move; deeper
+in the queue only moves of at least 10% are sent, which keeps a draining queue
+of thousands from turning into thousands of frames per tick.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Positions up to here are always reported; beyond it only moves of >= 10%
+EXACT_POSITIONS = 10
+
+match_wait = metrics.registry.histogram(
+    "matchmaking_wait_seconds", "Time callers waited in the queue before being matched", (),
+    (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+match_outcomes = metrics.registry.counter(
+    "matchmaking_requests_total", "Queued call requests by how they left the queue", ("outcome",))
+
+
+class MatchFailed(Exception):
+    """Raised by ``on_match`` when the caller cannot be served; they leave the queue."""
+
+
+class WaitingCaller:
+    __slots__ = ("user", "enqueued_at", "last_position")
+
+    def __init__(self, user: dict):
+        self.user = user
+        self.enqueued_at = time.monotonic()
+        self.last_position = 0
+
+
+class Matchmaker:
+    def __init__(
+        self,
+        on_match: Callable[[WaitingCaller, str], Awaitable[Optional[str]]],
+        notify: Callable[[str, dict], Awaitable[None]],
+        position_interval: float = 2,
+        max_wait: float = 300,
+    ):
+        """``on_match(caller, professional_id)`` starts the call and returns its id, or
+        None if the professional was taken meanwhile (the caller keeps their place).
+        ``notify(user_id, message)`` delivers queue updates to a connected caller."""
+        self.on_match = on_match
+        self.notify = notify
+        self.position_interval = position_interval
+        self.max_wait = max_wait
+        self._waiting: Dict[str, "OrderedDict[str, WaitingCaller]"] = {}
+        self._caller_category: Dict[str, str] = {}
+        # professional_id -> (category, idle_since, seq); the heap entry must match to count
+        self._available: Dict[str, Tuple[str, float, int]] = {}
+        self._heaps: Dict[str, List[Tuple[float, int, str]]] = {}
+        self._seq = itertools.count()
+        self._dispatching: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    # Availability
+
+    def set_available(self, professional_id: str, category: Optional[str], available: bool):
+        """Track a professional's availability. Staying available keeps their idle time."""
+        current = self._available.get(professional_id)
+        if not available or category is None:
+            self._available.pop(professional_id, None)
+            return
+        if current is not None and current[0] == category:
+            return
+        entry = (category, time.monotonic(), next(self._seq))
+        self._available[professional_id] = entry
+        heapq.heappush(self._heaps.setdefault(category, []), (entry[1], entry[2], professional_id))
+        self._kick(category)
+
+    def update_user(self, user: dict):
+        """Apply the post-image of a user write."""
+        self.set_available(
+            str(user["_id"]),
+            user.get("category"),
+            bool(user.get("professional_mode")) and user.get("status") == "online",
+        )
+
+    def set_unavailable_many(self, user_ids: Iterable[str]):
+        for user_id in user_ids:
+            self._available.pop(user_id, None)
+
+    def rebuild(self, users: Iterable[dict]):
+        self._available.clear()
+        self._heaps.clear()
+        for user in users:
+            self.update_user(user)
+
+    def available_count(self, category: Optional[str] = None) -> int:
+        if category is None:
+            return len(self._available)
+        return sum(1 for entry in self._available.values() if entry[0] == category)
+
+    def _pop_professional(self, category: str) -> Optional[Tuple[str, Tuple[str, float, int]]]:
+        heap = self._heaps.get(category)
+        while heap:
+            idle_since, seq, professional_id = heapq.heappop(heap)
+            entry = (category, idle_since, seq)
+            if self._available.get(professional_id) == entry:
+                del self._available[professional_id]
+                return professional_id, entry
+        return None
+
+    def _restore(self, professional_id: str, entry: Tuple[str, float, int]):
+        """Put back a professional popped for a match that did not happen, keeping their turn."""
+        if professional_id not in self._available:
+            self._available[professional_id] = entry
+            heapq.heappush(self._heaps.setdefault(entry[0], []), (entry[1], entry[2], professional_id))
+
+    def _compact(self):
+        for category, heap in self._heaps.items():
+            live = [item for item in heap if self._available.get(item[2]) == (category, item[0], item[1])]
+            if len(live) < len(heap):
+                heapq.heapify(live)
+                self._heaps[category] = live
+
+    # Callers
+
+    def enqueue(self, user: dict, category: str) -> Tuple[int, int]:
+        """Queue the caller, or keep their current place. Returns (position, waiting)."""
+        user_id = str(user["_id"])
+        current = self._caller_category.get(user_id)
+        if current is not None and current != category:
+            self.cancel(user_id)
+        queue = self._waiting.setdefault(category, OrderedDict())
+        if user_id in queue:
+            return self.position(user_id)
+        caller = queue[user_id] = WaitingCaller(user)
+        self._caller_category[user_id] = category
+        caller.last_position = len(queue)
+        self._kick(category)
+        return caller.last_position, len(queue)
+
+    def cancel(self, user_id: str) -> bool:
+        category = self._caller_category.pop(user_id, None)
+        if category is None:
+            return False
+        del self._waiting[category][user_id]
+        match_outcomes.inc("cancelled")
+        return True
+
+    def position(self, user_id: str) -> Tuple[int, int]:
+        """1-based position and queue length; (0, 0) if not waiting. O(position)."""
+        category = self._caller_category.get(user_id)
+        if category is None:
+            return 0, 0
+        queue = self._waiting[category]
+        for position, waiting_id in enumerate(queue, 1):
+            if waiting_id == user_id:
+                return position, len(queue)
+        return 0, len(queue)
+
+    def waiting_count(self, category: Optional[str] = None) -> int:
+        if category is None:
+            return len(self._caller_category)
+        return len(self._waiting.get(category, ()))
+
+    # Dispatch
+
+    def _kick(self, category: str):
+        if category in self._dispatching:
+            return
+        if not self._waiting.get(category) or not self._heaps.get(category):
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(self._dispatch(category))
+        except RuntimeError:
+            return  # No loop yet (startup rebuild); the ticker dispatches later
+        self._dispatching[category] = task
+
+    async def _dispatch(self, category: str):
+        try:
+            queue = self._waiting.get(category)
+            while queue:
+                popped = self._pop_professional(category)
+                if popped is None:
+                    break
+                professional_id, entry = popped
+                caller_id, caller = queue.popitem(last=False)
+                del self._caller_category[caller_id]
+                try:
+                    call_id = await self.on_match(caller, professional_id)
+                except Exception as exc:
+                    # The caller is dropped; the professional was not used and keeps their turn
+                    self._restore(professional_id, entry)
+                    match_outcomes.inc("failed")
+                    if isinstance(exc, MatchFailed):
+                        detail = str(exc)
+                    else:
+                        logger.exception("Matching %s with %s failed", caller_id, professional_id)
+                        detail = "Internal error"
+                    await self._notify(caller_id, {"type": "call_request_failed", "detail": detail})
+                    continue
+                if call_id is None:
+                    # Professional was taken meanwhile; the caller keeps the head of the queue
+                    if caller_id not in self._caller_category:
+                        queue[caller_id] = caller
+                        queue.move_to_end(caller_id, last=False)
+                        self._caller_category[caller_id] = category
+                    continue
+                match_outcomes.inc("matched")
+                match_wait.observe(time.monotonic() - caller.enqueued_at)
+            if len(self._heaps.get(category, ())) > 2 * len(self._available) + 64:
+                self._compact()
+        finally:
+            self._dispatching.pop(category, None)
+
+    async def _notify(self, user_id: str, message: dict):
+        try:
+            await self.notify(user_id, message)
+        except Exception:
+            logger.exception("Could not notify %s", user_id)
+
+    # Position updates and expiry
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._dispatching.values()):
+            task.cancel()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.position_interval)
+            try:
+                await self.tick()
+            except Exception:
+                logger.exception("Matchmaking tick failed")
+
+    async def tick(self):
+        expire_before = time.monotonic() - self.max_wait
+        for category, queue in list(self._waiting.items()):
+            expired = [user_id for user_id, caller in queue.items() if caller.enqueued_at < expire_before]
+            for user_id in expired:
+                del queue[user_id]
+                del self._caller_category[user_id]
+                match_outcomes.inc("expired")
+                await self._notify(user_id, {"type": "call_request_expired", "category": category})
+
+            updates = []
+            for position, (user_id, caller) in enumerate(queue.items(), 1):
+                last = caller.last_position
+                if last != position and (position <= EXACT_POSITIONS or abs(last - position) * 10 >= last):
+                    caller.last_position = position
+                    updates.append((user_id, position))
+            waiting = len(queue)
+            for user_id, position in updates:
+                await self._notify(user_id, {
+                    "type": "queue_position", "category": category, "position": position, "waiting": waiting})
+            self._kick(category)
@@ -0,0 +1,270 @@
+"""Prometheus text-format metrics with lock-free collection.
+
+Writers never take a lock: every metric keeps one shard per thread (the event
+loop thread, plus Motor's executor threads for Mongo command events) and a
+shard is only ever written by its own thread. A scrape merges the shards; a
+concurrent increment may land in the next scrape, which is fine for metrics.
+"""
+import bisect
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _Sharded(_Metric):
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            self._shards.append(shard)  # list.append is atomic
+            return shard
+
+
+class Counter(_Sharded):
+    type = "counter"
+
+    def inc(self, *label_values: str, amount: float = 1):
+        shard = self._shard()
+        shard[label_values] = shard.get(label_values, 0) + amount
+
+    def values(self) -> Dict[LabelValues, float]:
+        merged: Dict[LabelValues, float] = {}
+        for shard in list(self._shards):
+            for key, value in list(shard.items()):
+                merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def render(self):
+        lines = self.header()
+        for key, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Sharded):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *label_values: str):
+        shard = self._shard()
+        counts = shard.get(label_values)
+        if counts is None:
+            # One slot per bucket plus +Inf, then sum and count
+            counts = shard[label_values] = [0] * (len(self.buckets) + 3)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def snapshot(self) -> Dict[LabelValues, list]:
+        merged: Dict[LabelValues, list] = {}
+        for shard in list(self._shards):
+            for key, counts in list(shard.items()):
+                total = merged.setdefault(key, [0] * len(counts))
+                for i, value in enumerate(list(counts)):
+                    total[i] += value
+        return merged
+
+    def render(self):
+        lines = self.header()
+        for key, counts in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="%s"' % _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(float(counts[-2]))}")
+            lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Set from the event loop only, so a plain dict is enough."""
+
+    type = "gauge"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values: str, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value: float, *label_values: str):
+        self._values[label_values] = value
+
+    def render(self):
+        lines = self.header()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Value read from the application at scrape time (connection counts, queue sizes)."""
+
+    def __init__(self, name, help, type: str, callback: Callable[[], float]):
+        super().__init__(name, help)
+        self.type = type
+        self.callback = callback
+
+    def render(self):
+        return self.header() + [f"{self.name} {_format_value(self.callback())}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, labels=()) -> Gauge:
+        return self.register(Gauge(name, help, labels))
+
+    def gauge_func(self, name, help, callback) -> CallbackMetric:
+        return self.register(CallbackMetric(name, help, "gauge", callback))
+
+    def counter_func(self, name, help, callback) -> CallbackMetric:
+        return self.register(CallbackMetric(name, help, "counter", callback))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+http_requests_in_flight = registry.gauge(
+    "http_requests_in_flight", "HTTP requests currently being served", ("method",))
+ws_messages = registry.counter(
+    "ws_messages_total", "WebSocket messages by direction and type", ("direction", "type"))
+ws_send_failures = registry.counter(
+    "ws_send_failures_total", "send_to_user calls that could not deliver immediately", ("reason",))
+mongo_command_duration = registry.histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ("collection", "command", "outcome"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware timing HTTP requests per route template."""
+
+    def __init__(self, app, exclude: Iterable[str] = ("/metrics",)):
+        self.app = app
+        self.exclude = set(exclude)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = "500"
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = str(message["status"])
+            await send(message)
+
+        http_requests_in_flight.inc(method)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec(method)
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            http_request_duration.observe(time.perf_counter() - started, method, route_path, status_code)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Records command latency per collection; runs on Motor's executor threads."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _pending(self) -> dict:
+        try:
+            return self._local.pending
+        except AttributeError:
+            pending = self._local.pending = {}
+            return pending
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ""
+        self._pending()[event.request_id] = collection
+
+    def _finish(self, event, outcome: str):
+        collection = self._pending().pop(event.request_id, "")
+        mongo_command_duration.observe(event.duration_micros / 1e6, collection, event.command_name, outcome)
+
+    def succeeded(self, event):
+        self._finish(event, "success")
+
+    def failed(self, event):
+        self._finish(event, "failure")
@@ -0,0 +1,176 @@
+import itertools
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (seq, expires_at_monotonic, size_bytes, message)
+PendingEntry = Tuple[int, float, int, dict]
+
+# Messages that still mean something on reconnect; WebRTC signaling
+# (offer/answer/ice-candidate) is stale by then
+DURABLE_TYPES = frozenset({"call_request", "call_accepted", "call_ended", "chat_message", "file_message"})
+
+
+class PendingMessageQueue:
+    """Store-and-forward queue for messages sent to users who are not connected.
+
+    Only ``durable_types`` are queued, and only up to ``max_message_bytes``
+    each (serialized size), so large file transfers are not held for offline
+    users. Each user's backlog is bounded by count and bytes, oldest dropped
+    first. When the global memory budget (messages or bytes) is exceeded, the
+    least recently touched user's backlog is spilled to a Mongo collection
+    with a TTL index, so a long-offline user cannot exhaust memory. Both tiers
+    are merged by sequence number when the user reconnects.
+    """
+
+    def __init__(
+        self,
+        collection=None,
+        max_per_user: int = 100,
+        max_age_seconds: float = 300,
+        max_memory_messages: int = 50000,
+        max_user_bytes: int = 1024 * 1024,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        max_message_bytes: int = 256 * 1024,
+        durable_types: Iterable[str] = DURABLE_TYPES,
+    ):
+        self.collection = collection
+        self.max_per_user = max_per_user
+        self.max_age_seconds = max_age_seconds
+        self.max_memory_messages = max_memory_messages
+        self.max_user_bytes = max_user_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.max_message_bytes = max_message_bytes
+        self.durable_types: FrozenSet[str] = frozenset(durable_types)
+        self._memory: "OrderedDict[str, Deque[PendingEntry]]" = OrderedDict()
+        self._user_bytes: Dict[str, int] = {}
+        self._memory_count = 0
+        self._memory_bytes = 0
+        # Seeded from the wall clock so ordering survives a restart for spilled messages
+        self._seq = itertools.count(time.time_ns())
+
+    async def ensure_indexes(self):
+        if self.collection is None:
+            return
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+        await self.collection.create_index([("user_id", 1), ("seq", 1)])
+
+    @property
+    def memory_count(self) -> int:
+        return self._memory_count
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._memory_bytes
+
+    def pending_count(self, user_id: str) -> int:
+        return len(self._memory.get(user_id, ()))
+
+    def _size(self, message: dict) -> Optional[int]:
+        """Serialized size if the message may be queued, else None."""
+        if message.get("type") not in self.durable_types:
+            return None
+        size = len(json.dumps(message))
+        return size if size <= min(self.max_message_bytes, self.max_user_bytes) else None
+
+    async def enqueue(self, user_id: str, message: dict) -> bool:
+        """Queue ``message`` for ``user_id``; False if it is not worth keeping."""
+        size = self._size(message)
+        if size is None:
+            return False
+        entries = self._memory.get(user_id)
+        if entries is None:
+            entries = self._memory[user_id] = deque()
+            self._user_bytes[user_id] = 0
+        else:
+            self._memory.move_to_end(user_id)
+
+        while entries and (len(entries) >= self.max_per_user
+                           or self._user_bytes[user_id] + size > self.max_user_bytes):
+            self._forget(user_id, entries.popleft())
+        entries.append((next(self._seq), time.monotonic() + self.max_age_seconds, size, message))
+        self._user_bytes[user_id] += size
+        self._memory_count += 1
+        self._memory_bytes += size
+
+        while ((self._memory_count > self.max_memory_messages or self._memory_bytes > self.max_memory_bytes)
+               and len(self._memory) > 1):
+            victim, victim_entries = self._pop_user(next(iter(self._memory)))
+            await self._spill(victim, victim_entries)
+        return True
+
+    def _forget(self, user_id: str, entry: PendingEntry):
+        self._user_bytes[user_id] -= entry[2]
+        self._memory_count -= 1
+        self._memory_bytes -= entry[2]
+
+    def _pop_user(self, user_id: str) -> Tuple[str, Deque[PendingEntry]]:
+        entries = self._memory.pop(user_id, None) or deque()
+        self._user_bytes.pop(user_id, None)
+        self._memory_count -= len(entries)
+        self._memory_bytes -= sum(entry[2] for entry in entries)
+        return user_id, entries
+
+    async def _spill(self, user_id: str, entries: Deque[PendingEntry]):
+        if self.collection is None:
+            logger.warning("Dropping %d pending messages for user %s", len(entries), user_id)
+            return
+        now = time.monotonic()
+        wall_now = datetime.utcnow()
+        docs = [
+            {
+                "user_id": user_id,
+                "seq": seq,
+                "message": message,
+                "expires_at": wall_now + timedelta(seconds=expires - now),
+            }
+            for seq, expires, _, message in entries
+            if expires > now
+        ]
+        if not docs:
+            return
+        try:
+            await self.collection.insert_many(docs, ordered=False)
+        except Exception:
+            logger.exception("Failed to spill pending messages for user %s", user_id)
+
+    async def flush(self):
+        """Spill the whole in-memory tier so queued messages survive a restart."""
+        while self._memory:
+            user_id, entries = self._pop_user(next(iter(self._memory)))
+            await self._spill(user_id, entries)
+
+    async def drain(self, user_id: str) -> List[dict]:
+        """Remove and return the user's pending messages, oldest first."""
+        now = time.monotonic()
+        _, entries = self._pop_user(user_id)
+        merged: List[Tuple[int, dict]] = [
+            (seq, message) for seq, expires, _, message in entries if expires > now
+        ]
+
+        stored = await self._drain_stored(user_id)
+        if stored:
+            merged.extend(stored)
+            merged.sort(key=lambda item: item[0])
+
+        return [message for _, message in merged[-self.max_per_user:]]
+
+    async def _drain_stored(self, user_id: str) -> List[Tuple[int, dict]]:
+        if self.collection is None:
+            return []
+        try:
+            docs = await self.collection.find(
+                {"user_id": user_id, "expires_at": {"$gt": datetime.utcnow()}},
+                {"seq": 1, "message": 1},
+            ).sort("seq", -1).to_list(self.max_per_user)
+            if docs:
+                await self.collection.delete_many({"user_id": user_id, "seq": {"$lte": docs[0]["seq"]}})
+        except Exception:
+            logger.exception("Failed to load pending messages for user %s", user_id)
+            return []
+        return [(doc["seq"], doc["message"]) for doc in reversed(docs)]
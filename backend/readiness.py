@@ -0,0 +1,104 @@
+"""Startup warmup and cached readiness for ``/healthz`` and ``/readyz``.
+
+The server binds its port as soon as the app object exists; index checks,
+reconciliation, cache prefill and connection pool warmup run afterwards in a
+background task, as named steps in order. A failing step is logged and the
+next one still runs, as the old blocking startup did. Until they are done,
+routes that change users or calls or read the directory answer 503 (see
+``warmed_up`` in server.py).
+
+Once warmup is over, a loop checks the database every ``interval`` seconds and
+caches the outcome, so readiness probes read a flag and never hit the
+database themselves.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Set at import, as close to process start as the app gets
+PROCESS_STARTED = time.monotonic()
+
+Step = Tuple[str, Callable[[], Awaitable[None]]]
+
+
+class Readiness:
+    def __init__(self, check: Callable[[], Awaitable[None]], interval: float = 5, timeout: float = 2):
+        self.check = check
+        self.interval = interval
+        self.timeout = timeout
+        self.warmed = False
+        self.healthy = False
+        self.ready_after: Optional[float] = None
+        self.steps: Dict[str, dict] = {}
+        self.last_error: Optional[str] = None
+        self.last_checked: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.warmed and self.healthy
+
+    async def warm_up(self, steps: List[Step]):
+        for name, step in steps:
+            started = time.monotonic()
+            try:
+                await step()
+                outcome = "ok"
+            except Exception:
+                logger.exception("Warmup step %s failed", name)
+                outcome = "failed"
+            self.steps[name] = {"status": outcome, "seconds": round(time.monotonic() - started, 3)}
+        # Ready only once a check has passed, not merely because the steps ran
+        await self.check_once()
+        self.warmed = True
+        self.ready_after = time.monotonic() - PROCESS_STARTED
+        logger.info("Ready %.2fs after start", self.ready_after,
+                    extra={"event": "startup.ready", "steps": self.steps})
+
+    async def check_once(self):
+        try:
+            await asyncio.wait_for(self.check(), self.timeout)
+            self.healthy = True
+            self.last_error = None
+        except Exception as exc:
+            if self.healthy or self.last_checked is None:
+                logger.warning("Readiness check failed: %r", exc)
+            self.healthy = False
+            self.last_error = repr(exc)
+        self.last_checked = time.monotonic()
+
+    def start(self, steps: List[Step]):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(steps))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, steps: List[Step]):
+        if not self.warmed:
+            await self.warm_up(steps)
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check_once()
+
+    def snapshot(self) -> dict:
+        return {
+            "status": "ready" if self.ready else ("unavailable" if self.warmed else "warming_up"),
+            "ready_after_s": round(self.ready_after, 3) if self.ready_after is not None else None,
+            "steps": self.steps,
+            "database": {
+                "ok": self.healthy,
+                "checked_s_ago": (round(time.monotonic() - self.last_checked, 1)
+                                  if self.last_checked is not None else None),
+                "error": self.last_error,
+            },
+        }
@@ -0,0 +1,195 @@
+import uuid
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+
+async def reconcile_state(
+    db,
+    minimum_cost: int = 10,
+    professional_share: float = 0.85,
+    default_price: float = 5,
+    max_call_minutes: float = 60,
+    settle_calls: bool = False,
+) -> dict:
+    """Repair presence and call state left behind by a crash.
+
+    Every step is a set-based operation on an indexed ``status`` field:
+
+    * users stuck ``online``/``busy`` are reset to ``offline``
+    * ``pending`` calls (and ``active`` ones that never started) are cancelled
+    * with ``settle_calls``, ``active`` calls with ``started_at`` are settled
+      like ``end_call`` would, with duration capped at ``max_call_minutes``
+      since the real end is unknown, and added to the professionals' earnings
+      rollups for the day they ended. Without it they are left for either
+      participant to end, and counted in ``calls_awaiting_settlement``
+
+    Settlement is resumable and applies each call once. The first write moves
+    the calls to ``status: "settling"`` with a run id and their computed cost,
+    so a later run never recomputes them. Balance and rollup updates carry the
+    run id in ``settlement_runs`` on the documents they change and skip
+    documents that already have it, so a run interrupted anywhere before its
+    calls are marked ``ended`` is finished by the next one without charging or
+    crediting twice. Calls still ``active`` with a ``settling`` id were claimed
+    by an older version that cannot tell whether it charged them; they are
+    left alone and counted in ``calls_unresolved`` for manual review.
+    """
+    now = datetime.utcnow()
+    report = {
+        "users_reset": 0,
+        "calls_cancelled": 0,
+        "calls_settled": 0,
+        "tokens_debited": 0,
+        "tokens_credited": 0,
+        "calls_unresolved": 0,
+        "calls_awaiting_settlement": 0,
+    }
+
+    result = await db.users.update_many(
+        {"status": {"$in": ["online", "busy"]}},
+        {"$set": {"status": "offline"}}
+    )
+    report["users_reset"] = result.modified_count
+
+    result = await db.calls.update_many(
+        {"$or": [
+            {"status": "pending"},
+            {"status": "active", "started_at": None},
+        ]},
+        {"$set": {"status": "cancelled", "ended_at": now}}
+    )
+    report["calls_cancelled"] = result.modified_count
+
+    if not settle_calls:
+        report["calls_awaiting_settlement"] = await db.calls.count_documents(
+            {"status": {"$in": ["active", "settling"]}, "started_at": {"$ne": None}})
+        return report
+
+    await _claim(db, str(uuid.uuid4()), now, minimum_cost, professional_share, default_price, max_call_minutes)
+
+    # This run's calls plus any left by an interrupted run
+    for run_id in await db.calls.distinct("settling", {"status": "settling"}):
+        settled = await _settle(db, run_id)
+        for key, value in settled.items():
+            report[key] += value
+    report["calls_unresolved"] = await db.calls.count_documents(
+        {"status": "active", "settling": {"$ne": None}})
+    return report
+
+
+async def _claim(db, run_id, now, minimum_cost, professional_share, default_price, max_call_minutes):
+    """Compute duration and cost server-side and move the calls to ``settling``, in one write per call."""
+    duration = {"$min": [
+        max_call_minutes,
+        {"$divide": [{"$subtract": [now, "$started_at"]}, 60000]},
+    ]}
+    await db.calls.aggregate([
+        {"$match": {"status": "active", "started_at": {"$ne": None}, "settling": None}},
+        {"$lookup": {
+            "from": "users",
+            "let": {"callee_id": "$callee_id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$_id", {"$toObjectId": "$$callee_id"}]}}},
+                {"$project": {"price_per_minute": 1}},
+            ],
+            "as": "callee",
+        }},
+        {"$set": {
+            "duration_minutes": duration,
+            # Calls carry the price agreed at initiation; older ones fall back to the profile
+            "price": {"$ifNull": [
+                "$price_per_minute",
+                {"$ifNull": [{"$first": "$callee.price_per_minute"}, default_price]},
+            ]},
+        }},
+        {"$set": {
+            "cost_tokens": {"$max": [
+                minimum_cost,
+                {"$trunc": {"$multiply": ["$duration_minutes", "$price"]}},
+            ]},
+        }},
+        {"$project": {
+            "duration_minutes": 1,
+            "cost_tokens": 1,
+            "professional_earning": {"$trunc": {"$multiply": ["$cost_tokens", professional_share]}},
+            "status": {"$literal": "settling"},
+            "settling": {"$literal": run_id},
+            "ended_at": now,
+        }},
+        {"$merge": {"into": "calls", "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}},
+    ]).to_list(None)
+
+
+async def _settle(db, run_id: str) -> dict:
+    """Apply one run's claimed calls to balances and rollups and mark them ended; safe to repeat."""
+    totals = await db.calls.aggregate([
+        {"$match": {"settling": run_id}},
+        {"$facet": {
+            "debits": [{"$group": {"_id": "$caller_id", "amount": {"$sum": "$cost_tokens"}}}],
+            "credits": [{"$group": {"_id": "$callee_id", "amount": {"$sum": "$professional_earning"}}}],
+        }},
+    ]).to_list(1)
+    debits = totals[0]["debits"] if totals else []
+    credits = totals[0]["credits"] if totals else []
+
+    # One update per user, so the run marker can guard it
+    net: dict = {}
+    for row in debits:
+        net[row["_id"]] = net.get(row["_id"], 0) - row["amount"]
+    for row in credits:
+        net[row["_id"]] = net.get(row["_id"], 0) + row["amount"]
+    operations = [
+        UpdateOne(
+            {"_id": _object_id(user_id), "settlement_runs": {"$ne": run_id}},
+            {"$inc": {"token_balance": amount}, "$push": {"settlement_runs": run_id}}
+        )
+        for user_id, amount in net.items()
+    ]
+    if operations:
+        await db.users.bulk_write(operations, ordered=False)
+
+    fields = ("minutes", "calls", "gross", "net")
+    already_applied = {"$in": [run_id, {"$ifNull": ["$settlement_runs", []]}]}
+    await db.calls.aggregate([
+        {"$match": {"settling": run_id}},
+        {"$group": {
+            "_id": {"professional_id": "$callee_id",
+                    "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$ended_at"}}},
+            "minutes": {"$sum": "$duration_minutes"},
+            "calls": {"$sum": 1},
+            "gross": {"$sum": "$cost_tokens"},
+            "net": {"$sum": "$professional_earning"},
+        }},
+        {"$project": {
+            "_id": 0, "professional_id": "$_id.professional_id", "day": "$_id.day",
+            "minutes": 1, "calls": 1, "gross": 1, "net": 1, "settlement_runs": {"$literal": [run_id]},
+        }},
+        {"$merge": {
+            "into": "earnings_daily",
+            "on": ["professional_id", "day"],
+            "whenMatched": [{"$set": {
+                **{field: {"$cond": [already_applied, f"${field}", {"$add": [f"${field}", f"$$new.{field}"]}]}
+                   for field in fields},
+                "settlement_runs": {"$setUnion": [{"$ifNull": ["$settlement_runs", []]}, [run_id]]},
+            }}],
+            "whenNotMatched": "insert",
+        }},
+    ]).to_list(None)
+
+    result = await db.calls.update_many(
+        {"settling": run_id},
+        {"$set": {"status": "ended", "settled_by": "reconciliation"}, "$unset": {"settling": ""}}
+    )
+    # Markers are only needed until the calls are ended
+    await db.users.update_many({"settlement_runs": run_id}, {"$pull": {"settlement_runs": run_id}})
+    await db.earnings_daily.update_many({"settlement_runs": run_id}, {"$pull": {"settlement_runs": run_id}})
+    return {
+        "calls_settled": result.modified_count,
+        "tokens_debited": int(sum(row["amount"] for row in debits)),
+        "tokens_credited": int(sum(row["amount"] for row in credits)),
+    }
+
+
+def _object_id(value):
+    return ObjectId(value) if ObjectId.is_valid(value) else value
@@ -0,0 +1,700 @@
+"""Data access for users, calls, earnings rollups and idempotency keys.
+
+Handlers talk to ``UserRepository``/``CallRepository``/``EarningsRepository``/
+``IdempotencyRepository`` instead of Motor directly.
+Two engines implement them, selected with ``STORAGE_ENGINE``:
+
+* ``mongo`` (default): Motor collections, one round-trip per operation
+* ``memory``: dicts with secondary indexes, for benchmarks and offline tests;
+  ``MEMORY_STORAGE_LATENCY_MS`` adds a simulated round trip to every operation
+  so concurrent requests interleave the way they do against a real database
+
+Documents are plain dicts shaped like the Mongo documents (``_id`` is an
+ObjectId, call participant ids are strings) so handlers work with either engine.
+Ids are accepted as strings; malformed ids behave like missing documents.
+"""
+import asyncio
+import inspect
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from billing import DEFAULT_PRICE_PER_MINUTE, MINIMUM_CALL_COST, PROFESSIONAL_SHARE, call_cost
+from database import DATABASE_NAME, create_client
+from metrics import MongoCommandMetrics
+from request_timing import RequestTimingListener
+from reconciliation import reconcile_state
+
+STORAGE_ENGINE = os.getenv("STORAGE_ENGINE", "mongo")
+MEMORY_STORAGE_LATENCY_MS = float(os.getenv("MEMORY_STORAGE_LATENCY_MS", "0"))
+
+# Everything except the password hash; used for reads and post-images
+USER_PROJECTION = {"password": 0}
+
+# What settling a call reads and writes; enough to re-check it in bulk
+SETTLEMENT_FIELDS = (
+    "caller_id", "callee_id", "started_at", "duration_minutes", "price_per_minute",
+    "cost_tokens", "professional_earning",
+)
+
+
+def _oid(value) -> Optional[ObjectId]:
+    if isinstance(value, ObjectId):
+        return value
+    return ObjectId(value) if ObjectId.is_valid(value) else None
+
+
+class UserRepository(ABC):
+    @abstractmethod
+    async def get(self, user_id: str) -> Optional[dict]:
+        """User without the password hash."""
+
+    @abstractmethod
+    async def get_by_email(self, email: str) -> Optional[dict]:
+        """User including the password hash, for login."""
+
+    @abstractmethod
+    async def email_exists(self, email: str) -> bool: ...
+
+    @abstractmethod
+    async def create(self, user: dict) -> str:
+        """Insert ``user``, setting its ``_id``, and return the id as a string."""
+
+    @abstractmethod
+    async def update_fields(self, user_id: str, fields: dict) -> Optional[dict]:
+        """``$set`` fields and return the post-image."""
+
+    async def set_status(self, user_id: str, status: str) -> Optional[dict]:
+        return await self.update_fields(user_id, {"status": status})
+
+    @abstractmethod
+    async def transition_status(self, user_id: str, from_status: str, to_status: str) -> Optional[dict]:
+        """Atomically move a user from ``from_status`` to ``to_status`` and return the
+        post-image; None if they were not in ``from_status`` (or do not exist)."""
+
+    @abstractmethod
+    async def set_status_many(self, user_ids: List[str], status: str) -> int: ...
+
+    @abstractmethod
+    async def adjust_balance(self, user_id: str, delta: int, status: Optional[str] = None) -> Optional[dict]:
+        """``$inc`` the token balance, optionally setting status, and return the post-image."""
+
+    @abstractmethod
+    def iter_professionals(self) -> AsyncIterator[dict]:
+        """Every professional, for building in-process indexes."""
+
+    @abstractmethod
+    def iter_balance_batches(self, batch_size: int = 10000) -> AsyncIterator[List[dict]]:
+        """``{"_id", "token_balance", "price_per_minute"}`` of every user in lists of
+        up to ``batch_size``, for bulk audits. Treat the documents as read-only."""
+
+
+class CallRepository(ABC):
+    @abstractmethod
+    async def create(self, call: dict) -> str: ...
+
+    @abstractmethod
+    async def get(self, call_id: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def accept(self, call_id: str, callee_id: str, started_at: datetime) -> Optional[dict]:
+        """Move a pending call addressed to ``callee_id`` to active; None if it did not match."""
+
+    @abstractmethod
+    async def end(self, call_id: str, user_id: str, ended_at: datetime,
+                  started_at: Optional[datetime] = None) -> Optional[dict]:
+        """End an open call ``user_id`` takes part in, storing duration and cost.
+
+        ``started_at`` is the accept time as the caller knows it (the call
+        registry); it fills in a stored call that has none, so billing does not
+        depend on a write-behind accept having landed.
+
+        Returns the post-image, or None if no open call matched.
+        """
+
+    @abstractmethod
+    async def cancel_pending(self, call_id: str, ended_at: datetime) -> Optional[dict]:
+        """Cancel a call that is still pending; None if it was accepted or ended meanwhile."""
+
+    @abstractmethod
+    async def list_for_user(self, user_id: str, limit: int = 20) -> List[dict]:
+        """Most recent calls first."""
+
+    @abstractmethod
+    def iter_open(self) -> AsyncIterator[dict]:
+        """Every pending or active call, for rebuilding the in-process call registry."""
+
+    @abstractmethod
+    def iter_created_between(self, start: datetime, end: datetime, batch_size: int = 1000) -> AsyncIterator[dict]:
+        """Calls created in ``[start, end)``, oldest first, read ``batch_size`` at a time."""
+
+    @abstractmethod
+    def iter_ended_batches(self, batch_size: int = 10000) -> AsyncIterator[List[dict]]:
+        """Ended calls in lists of up to ``batch_size``, with at least ``SETTLEMENT_FIELDS``.
+        Treat the documents as read-only."""
+
+
+class EarningsRepository(ABC):
+    """Per professional, per UTC day totals of settled calls.
+
+    Documents look like ``{"professional_id", "day": "YYYY-MM-DD", "minutes",
+    "calls", "gross", "net"}``; ``gross`` is what callers paid and ``net`` what
+    the professional was credited after the platform fee."""
+
+    @abstractmethod
+    async def record(self, professional_id: str, day: str, minutes: float, gross: int, net: int):
+        """Add one settled call to the professional's rollup for ``day``."""
+
+    @abstractmethod
+    async def list_range(self, professional_id: str, first_day: str, last_day: str) -> List[dict]:
+        """Rollups for days in ``[first_day, last_day]``, oldest first; days without calls are absent."""
+
+
+class IdempotencyRepository(ABC):
+    """Stored responses of requests made with an ``Idempotency-Key``.
+
+    Documents look like ``{"_id": key, "fingerprint", "response", "expires_at"}``;
+    expired documents are ignored and eventually removed."""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[dict]:
+        """The unexpired document for ``key``, or None."""
+
+    @abstractmethod
+    async def save(self, key: str, fingerprint: str, response: dict, expires_at: datetime):
+        """Store or replace the response for ``key``."""
+
+
+class Storage:
+    """The repositories of one engine plus its lifecycle hooks."""
+
+    engine = ""
+    users: UserRepository
+    calls: CallRepository
+    earnings: EarningsRepository
+    idempotency: IdempotencyRepository
+    # Motor collection backing the durable tier of the pending message queue
+    pending_messages = None
+
+    async def ensure_indexes(self):
+        pass
+
+    async def reconcile(self, max_call_minutes: float, settle_calls: bool = False) -> dict:
+        return {}
+
+    async def ping(self):
+        """Raise if the database cannot be reached."""
+
+    async def warm_pool(self, connections: int):
+        """Open up to ``connections`` pooled connections ahead of traffic."""
+
+    def close(self):
+        pass
+
+
+# MongoDB engine
+
+async def _batches(cursor, batch_size: int) -> AsyncIterator[List[dict]]:
+    # One list per server batch, without an await per document
+    while True:
+        batch = await cursor.to_list(batch_size)
+        if not batch:
+            return
+        yield batch
+
+
+class MotorUserRepository(UserRepository):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def get(self, user_id):
+        oid = _oid(user_id)
+        return await self.collection.find_one({"_id": oid}, USER_PROJECTION) if oid else None
+
+    async def get_by_email(self, email):
+        return await self.collection.find_one({"email": email})
+
+    async def email_exists(self, email):
+        return await self.collection.find_one({"email": email}, {"_id": 1}) is not None
+
+    async def create(self, user):
+        result = await self.collection.insert_one(user)
+        return str(result.inserted_id)
+
+    async def update_fields(self, user_id, fields):
+        oid = _oid(user_id)
+        if oid is None:
+            return None
+        return await self.collection.find_one_and_update(
+            {"_id": oid},
+            {"$set": fields},
+            projection=USER_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def transition_status(self, user_id, from_status, to_status):
+        oid = _oid(user_id)
+        if oid is None:
+            return None
+        return await self.collection.find_one_and_update(
+            {"_id": oid, "status": from_status},
+            {"$set": {"status": to_status}},
+            projection=USER_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def set_status_many(self, user_ids, status):
+        oids = [oid for oid in map(_oid, user_ids) if oid]
+        if not oids:
+            return 0
+        result = await self.collection.update_many({"_id": {"$in": oids}}, {"$set": {"status": status}})
+        return result.modified_count
+
+    async def adjust_balance(self, user_id, delta, status=None):
+        oid = _oid(user_id)
+        if oid is None:
+            return None
+        update = {"$inc": {"token_balance": delta}}
+        if status is not None:
+            update["$set"] = {"status": status}
+        return await self.collection.find_one_and_update(
+            {"_id": oid},
+            update,
+            projection=USER_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def iter_professionals(self):
+        async for user in self.collection.find({"professional_mode": True}, USER_PROJECTION).batch_size(1000):
+            yield user
+
+    async def iter_balance_batches(self, batch_size=10000):
+        cursor = self.collection.find({}, {"token_balance": 1, "price_per_minute": 1}, batch_size=batch_size)
+        async for batch in _batches(cursor, batch_size):
+            yield batch
+
+
+def call_settlement_pipeline(ended_at: datetime, started_at: Optional[datetime] = None) -> list:
+    """Update pipeline that ends a call and computes its duration and cost server-side,
+    so the post-image of a single find_one_and_update carries the settlement."""
+    started = {"$ifNull": ["$started_at", False]}
+    pipeline = []
+    if started_at is not None:
+        pipeline.append({"$set": {"started_at": {"$ifNull": ["$started_at", started_at]}}})
+    return pipeline + [
+        {"$set": {
+            "status": "ended",
+            "ended_at": ended_at,
+            "duration_minutes": {"$cond": [
+                started,
+                {"$divide": [{"$subtract": [ended_at, "$started_at"]}, 60000]},
+                0,
+            ]},
+        }},
+        {"$set": {
+            "cost_tokens": {"$cond": [
+                started,
+                {"$max": [
+                    MINIMUM_CALL_COST,
+                    {"$toInt": {"$trunc": {"$multiply": [
+                        "$duration_minutes",
+                        {"$ifNull": ["$price_per_minute", DEFAULT_PRICE_PER_MINUTE]},
+                    ]}}},
+                ]},
+                0,
+            ]},
+        }},
+    ]
+
+
+class MotorCallRepository(CallRepository):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def create(self, call):
+        result = await self.collection.insert_one(call)
+        return str(result.inserted_id)
+
+    async def get(self, call_id):
+        oid = _oid(call_id)
+        return await self.collection.find_one({"_id": oid}) if oid else None
+
+    async def accept(self, call_id, callee_id, started_at):
+        oid = _oid(call_id)
+        if oid is None:
+            return None
+        return await self.collection.find_one_and_update(
+            {"_id": oid, "callee_id": callee_id, "status": "pending"},
+            {"$set": {"status": "active", "started_at": started_at}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def end(self, call_id, user_id, ended_at, started_at=None):
+        oid = _oid(call_id)
+        if oid is None:
+            return None
+        return await self.collection.find_one_and_update(
+            {
+                "_id": oid,
+                "status": {"$in": ["pending", "active"]},
+                "$or": [{"caller_id": user_id}, {"callee_id": user_id}]
+            },
+            call_settlement_pipeline(ended_at, started_at),
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def cancel_pending(self, call_id, ended_at):
+        oid = _oid(call_id)
+        if oid is None:
+            return None
+        return await self.collection.find_one_and_update(
+            {"_id": oid, "status": "pending"},
+            {"$set": {"status": "cancelled", "ended_at": ended_at}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def list_for_user(self, user_id, limit=20):
+        return await self.collection.find({
+            "$or": [
+                {"caller_id": user_id},
+                {"callee_id": user_id}
+            ]
+        }).sort("created_at", -1).limit(limit).to_list(limit)
+
+    async def iter_open(self):
+        async for call in self.collection.find({"status": {"$in": ["pending", "active"]}}).batch_size(1000):
+            yield call
+
+    async def iter_created_between(self, start, end, batch_size=1000):
+        cursor = self.collection.find({"created_at": {"$gte": start, "$lt": end}})
+        async for call in cursor.sort("created_at", 1).batch_size(batch_size):
+            yield call
+
+    async def iter_ended_batches(self, batch_size=10000):
+        cursor = self.collection.find(
+            {"status": "ended"}, dict.fromkeys(SETTLEMENT_FIELDS, 1), batch_size=batch_size)
+        async for batch in _batches(cursor, batch_size):
+            yield batch
+
+
+class MotorEarningsRepository(EarningsRepository):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def record(self, professional_id, day, minutes, gross, net):
+        await self.collection.update_one(
+            {"professional_id": professional_id, "day": day},
+            {"$inc": {"minutes": minutes, "calls": 1, "gross": gross, "net": net}},
+            upsert=True
+        )
+
+    async def list_range(self, professional_id, first_day, last_day):
+        return await self.collection.find(
+            {"professional_id": professional_id, "day": {"$gte": first_day, "$lte": last_day}},
+            {"_id": 0, "settlement_runs": 0}
+        ).sort("day", 1).to_list(None)
+
+
+class MotorIdempotencyRepository(IdempotencyRepository):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def get(self, key):
+        # The TTL monitor only runs once a minute
+        return await self.collection.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+
+    async def save(self, key, fingerprint, response, expires_at):
+        await self.collection.replace_one(
+            {"_id": key},
+            {"fingerprint": fingerprint, "response": response, "expires_at": expires_at},
+            upsert=True
+        )
+
+
+class MotorStorage(Storage):
+    engine = "mongo"
+
+    def __init__(self):
+        self.client = create_client(event_listeners=[MongoCommandMetrics(), RequestTimingListener()])
+        self.db = self.client[DATABASE_NAME]
+        self.users = MotorUserRepository(self.db.users)
+        self.calls = MotorCallRepository(self.db.calls)
+        self.earnings = MotorEarningsRepository(self.db.earnings_daily)
+        self.idempotency = MotorIdempotencyRepository(self.db.idempotency_keys)
+        self.pending_messages = self.db.pending_messages
+
+    async def ensure_indexes(self):
+        await self.db.users.create_index("email")
+        await self.db.users.create_index("status")
+        await self.db.users.create_index([("professional_mode", 1), ("category", 1)])
+        await self.db.users.create_index("settlement_runs", sparse=True)
+        await self.db.calls.create_index("status")
+        await self.db.calls.create_index("settling", sparse=True)
+        await self.db.calls.create_index([("caller_id", 1), ("created_at", -1)])
+        await self.db.calls.create_index([("callee_id", 1), ("created_at", -1)])
+        await self.db.calls.create_index("created_at")
+        # Unique so upserts never split a day and reconciliation can $merge on it
+        await self.db.earnings_daily.create_index([("professional_id", 1), ("day", 1)], unique=True)
+        await self.db.earnings_daily.create_index("settlement_runs", sparse=True)
+        await self.db.idempotency_keys.create_index("expires_at", expireAfterSeconds=0)
+
+    async def reconcile(self, max_call_minutes, settle_calls=False):
+        return await reconcile_state(
+            self.db,
+            minimum_cost=MINIMUM_CALL_COST,
+            professional_share=PROFESSIONAL_SHARE,
+            default_price=DEFAULT_PRICE_PER_MINUTE,
+            max_call_minutes=max_call_minutes,
+            settle_calls=settle_calls,
+        )
+
+    async def ping(self):
+        await self.client.admin.command("ping")
+
+    async def warm_pool(self, connections):
+        # Concurrent commands make the pool open one connection each
+        await asyncio.gather(*(self.client.admin.command("ping") for _ in range(connections)))
+
+    def close(self):
+        self.client.close()
+
+
+# In-memory engine
+
+class InMemoryUserRepository(UserRepository):
+    def __init__(self):
+        self._users: Dict[ObjectId, dict] = {}
+        self._by_email: Dict[str, ObjectId] = {}
+        # Users with professional_mode, in insertion order (dict used as an ordered set)
+        self._professionals: Dict[ObjectId, None] = {}
+
+    def _reindex(self, user: dict):
+        if user.get("professional_mode") is True:
+            self._professionals[user["_id"]] = None
+        else:
+            self._professionals.pop(user["_id"], None)
+
+    @staticmethod
+    def _public(user: dict) -> dict:
+        return {key: value for key, value in user.items() if key != "password"}
+
+    async def get(self, user_id):
+        user = self._users.get(_oid(user_id))
+        return self._public(user) if user else None
+
+    async def get_by_email(self, email):
+        oid = self._by_email.get(email)
+        return dict(self._users[oid]) if oid else None
+
+    async def email_exists(self, email):
+        return email in self._by_email
+
+    async def create(self, user):
+        user.setdefault("_id", ObjectId())
+        self._users[user["_id"]] = dict(user)
+        # Like a non-unique index: the first registration wins lookups by email
+        self._by_email.setdefault(user["email"], user["_id"])
+        self._reindex(user)
+        return str(user["_id"])
+
+    async def update_fields(self, user_id, fields):
+        user = self._users.get(_oid(user_id))
+        if user is None:
+            return None
+        user.update(fields)
+        if "professional_mode" in fields:
+            self._reindex(user)
+        return self._public(user)
+
+    async def transition_status(self, user_id, from_status, to_status):
+        user = self._users.get(_oid(user_id))
+        if user is None or user.get("status") != from_status:
+            return None
+        user["status"] = to_status
+        return self._public(user)
+
+    async def set_status_many(self, user_ids, status):
+        modified = 0
+        for oid in map(_oid, user_ids):
+            user = self._users.get(oid)
+            if user is not None and user.get("status") != status:
+                user["status"] = status
+                modified += 1
+        return modified
+
+    async def adjust_balance(self, user_id, delta, status=None):
+        user = self._users.get(_oid(user_id))
+        if user is None:
+            return None
+        user["token_balance"] = user.get("token_balance", 0) + delta
+        if status is not None:
+            user["status"] = status
+        return self._public(user)
+
+    async def iter_professionals(self):
+        for oid in list(self._professionals):
+            yield self._public(self._users[oid])
+
+    async def iter_balance_batches(self, batch_size=10000):
+        users = list(self._users.values())
+        for start in range(0, len(users), batch_size):
+            # The stored documents themselves; copying dominates a bulk read
+            yield users[start:start + batch_size]
+
+
+class InMemoryCallRepository(CallRepository):
+    def __init__(self):
+        self._calls: Dict[ObjectId, dict] = {}
+        # participant id -> call ids in insertion (created_at) order
+        self._by_user: Dict[str, List[ObjectId]] = {}
+
+    async def create(self, call):
+        call.setdefault("_id", ObjectId())
+        self._calls[call["_id"]] = dict(call)
+        for participant in {call["caller_id"], call["callee_id"]}:
+            self._by_user.setdefault(participant, []).append(call["_id"])
+        return str(call["_id"])
+
+    async def get(self, call_id):
+        call = self._calls.get(_oid(call_id))
+        return dict(call) if call else None
+
+    async def accept(self, call_id, callee_id, started_at):
+        call = self._calls.get(_oid(call_id))
+        if call is None or call["callee_id"] != callee_id or call["status"] != "pending":
+            return None
+        call.update(status="active", started_at=started_at)
+        return dict(call)
+
+    async def end(self, call_id, user_id, ended_at, started_at=None):
+        call = self._calls.get(_oid(call_id))
+        if (
+            call is None
+            or call["status"] not in ("pending", "active")
+            or user_id not in (call["caller_id"], call["callee_id"])
+        ):
+            return None
+        if started_at is not None and not call.get("started_at"):
+            call["started_at"] = started_at
+        duration = 0
+        cost = 0
+        if call.get("started_at"):
+            duration = (ended_at - call["started_at"]).total_seconds() / 60
+            cost = call_cost(duration, call.get("price_per_minute", DEFAULT_PRICE_PER_MINUTE))
+        call.update(status="ended", ended_at=ended_at, duration_minutes=duration, cost_tokens=cost)
+        return dict(call)
+
+    async def cancel_pending(self, call_id, ended_at):
+        call = self._calls.get(_oid(call_id))
+        if call is None or call["status"] != "pending":
+            return None
+        call.update(status="cancelled", ended_at=ended_at)
+        return dict(call)
+
+    async def list_for_user(self, user_id, limit=20):
+        call_ids = self._by_user.get(user_id, [])
+        return [dict(self._calls[oid]) for oid in reversed(call_ids[-limit:])]
+
+    async def iter_open(self):
+        for call in list(self._calls.values()):
+            if call["status"] in ("pending", "active"):
+                yield dict(call)
+
+    async def iter_created_between(self, start, end, batch_size=1000):
+        calls = sorted((call for call in self._calls.values() if start <= call["created_at"] < end),
+                       key=lambda call: call["created_at"])
+        for call in calls:
+            yield dict(call)
+
+    async def iter_ended_batches(self, batch_size=10000):
+        calls = [call for call in self._calls.values() if call["status"] == "ended"]
+        for start in range(0, len(calls), batch_size):
+            # The stored documents themselves; copying dominates a bulk read
+            yield calls[start:start + batch_size]
+
+
+class InMemoryEarningsRepository(EarningsRepository):
+    def __init__(self):
+        # professional id -> day -> rollup
+        self._days: Dict[str, Dict[str, dict]] = {}
+
+    async def record(self, professional_id, day, minutes, gross, net):
+        days = self._days.setdefault(professional_id, {})
+        rollup = days.get(day)
+        if rollup is None:
+            rollup = days[day] = {"professional_id": professional_id, "day": day,
+                                  "minutes": 0, "calls": 0, "gross": 0, "net": 0}
+        rollup["minutes"] += minutes
+        rollup["calls"] += 1
+        rollup["gross"] += gross
+        rollup["net"] += net
+
+    async def list_range(self, professional_id, first_day, last_day):
+        days = self._days.get(professional_id, {})
+        return [dict(days[day]) for day in sorted(days) if first_day <= day <= last_day]
+
+
+class InMemoryIdempotencyRepository(IdempotencyRepository):
+    def __init__(self):
+        self._keys: Dict[str, dict] = {}
+
+    async def get(self, key):
+        doc = self._keys.get(key)
+        if doc is None or doc["expires_at"] <= datetime.utcnow():
+            return None
+        return dict(doc)
+
+    async def save(self, key, fingerprint, response, expires_at):
+        # No TTL monitor here; drop expired keys as new ones come in
+        if len(self._keys) % 1024 == 0:
+            now = datetime.utcnow()
+            self._keys = {k: doc for k, doc in self._keys.items() if doc["expires_at"] > now}
+        self._keys[key] = {"_id": key, "fingerprint": fingerprint, "response": response, "expires_at": expires_at}
+
+
+class SimulatedLatency:
+    """Repository proxy that sleeps before every operation, like a network round trip.
+
+    The wrapped operation itself still runs without yielding, so it stays as
+    atomic as the equivalent single Mongo command."""
+
+    def __init__(self, repository, latency: float):
+        self._repository = repository
+        self._latency = latency
+
+    def __getattr__(self, name):
+        attribute = getattr(self._repository, name)
+        if not inspect.iscoroutinefunction(attribute):
+            return attribute
+
+        async def delayed(*args, **kwargs):
+            await asyncio.sleep(self._latency)
+            return await attribute(*args, **kwargs)
+        return delayed
+
+
+class InMemoryStorage(Storage):
+    engine = "memory"
+
+    def __init__(self, latency_ms: float = MEMORY_STORAGE_LATENCY_MS):
+        self.users = InMemoryUserRepository()
+        self.calls = InMemoryCallRepository()
+        self.earnings = InMemoryEarningsRepository()
+        self.idempotency = InMemoryIdempotencyRepository()
+        if latency_ms > 0:
+            self.users = SimulatedLatency(self.users, latency_ms / 1000)
+            self.calls = SimulatedLatency(self.calls, latency_ms / 1000)
+            self.earnings = SimulatedLatency(self.earnings, latency_ms / 1000)
+            self.idempotency = SimulatedLatency(self.idempotency, latency_ms / 1000)
+
+
+def create_storage(engine: str = STORAGE_ENGINE) -> Storage:
+    if engine == "memory":
+        return InMemoryStorage()
+    if engine == "mongo":
+        return MotorStorage()
+    raise ValueError(f"Unknown STORAGE_ENGINE '{engine}'")
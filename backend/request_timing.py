@@ -0,0 +1,100 @@
+"""Per-request breakdown of database and WebSocket time, reported as Server-Timing.
+
+The middleware puts a ``RequestTiming`` in a context variable for the duration of
+each HTTP request. Motor copies the context into its executor threads, so the
+command listener sees the same object and can attribute every Mongo command to
+the request that issued it.
+"""
+import logging
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTiming:
+    __slots__ = ("started", "db_count", "db_seconds", "ws_count", "ws_seconds")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_count = 0
+        self.db_seconds = 0.0
+        self.ws_count = 0
+        self.ws_seconds = 0.0
+
+    def header(self) -> str:
+        total = (time.perf_counter() - self.started) * 1000
+        return (
+            f'db;dur={self.db_seconds * 1000:.2f};desc="{self.db_count} ops", '
+            f'ws;dur={self.ws_seconds * 1000:.2f};desc="{self.ws_count} sends", '
+            f"total;dur={total:.2f}"
+        )
+
+
+current_timing: ContextVar[Optional[RequestTiming]] = ContextVar("current_timing", default=None)
+
+
+def record_ws_send(seconds: float):
+    timing = current_timing.get()
+    if timing is not None:
+        timing.ws_count += 1
+        timing.ws_seconds += seconds
+
+
+class RequestTimingListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def _record(self, event):
+        timing = current_timing.get()
+        if timing is not None:
+            timing.db_count += 1
+            timing.db_seconds += event.duration_micros / 1e6
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+
+class ServerTimingMiddleware:
+    """Adds a Server-Timing header and logs requests slower than ``slow_request_ms``."""
+
+    def __init__(self, app, slow_request_ms: float = 0):
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+        token = current_timing.set(timing)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", timing.header().encode("latin-1")),
+                    # Lets the cross-origin frontend read the breakdown in devtools
+                    (b"timing-allow-origin", b"*"),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_timing.reset(token)
+            if self.slow_request_ms:
+                elapsed_ms = (time.perf_counter() - timing.started) * 1000
+                if elapsed_ms >= self.slow_request_ms:
+                    logger.warning(
+                        "Slow request %s %s: %.1fms total, %d db ops %.1fms, %d ws sends %.1fms",
+                        scope["method"], scope["path"], elapsed_ms,
+                        timing.db_count, timing.db_seconds * 1000,
+                        timing.ws_count, timing.ws_seconds * 1000,
+                    )
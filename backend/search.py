@@ -0,0 +1,290 @@
+"""In-process full-text search over professionals' names and descriptions.
+
+Every indexed professional gets a small integer doc number. Each token maps to
+the doc numbers that contain it, split into tiers by category and field weight
+(a name match counts more than a description match, both counts most). A query
+term scores ``weight * idf``, so every tier has a single score and ranking never
+touches individual documents: a category filter picks tiers, terms are ANDed by
+intersecting same-category tiers, and a page is a slice across the tiers in
+score order. Tiers holding more than 1/``BITMAP_DENSITY`` of all documents
+are also kept as bitmaps (Python ints), where an AND over 100k documents is a
+microsecond instead of a hash probe per document; small tiers stay sets. The
+last query term also matches as a prefix, so partial input like "psic" finds
+"psicologa". Results of multi-term queries are cached until the index next
+changes, so typeahead repeats and later pages skip the intersections.
+
+The index is rebuilt from storage at startup and kept current by calling
+``upsert`` whenever a profile changes. Each process holds its own copy.
+"""
+import bisect
+import itertools
+import math
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+FIELD_WEIGHTS = {"name": 3.0, "description": 1.0}
+MAX_PREFIX_EXPANSION = 64
+RESULT_CACHE_ENTRIES = 64
+# A bitmap costs one bit per indexed document, a set entry about 32 bytes
+BITMAP_DENSITY = 256
+
+_TOKEN_RE = re.compile(r"\w+")
+_NONZERO_RE = re.compile(rb"[^\x00]")
+
+# Doc numbers as a set, or as a bitmap with bit n set for doc number n
+Docs = Union[Set[int], int]
+Tiers = List[Tuple[float, Optional[str], Docs]]  # (score, category, docs)
+TierKey = Tuple[float, Optional[str]]  # (field weight, category)
+ResultKey = Tuple[Tuple[str, ...], Optional[str]]  # (terms, category)
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercase, accent-free word tokens ("Psicóloga" -> "psicologa")."""
+    if not text:
+        return []
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return _TOKEN_RE.findall(stripped)
+
+
+def to_bitmap(docs: Iterable[int], capacity: int) -> int:
+    bits = bytearray((capacity + 7) // 8)
+    for number in docs:
+        bits[number >> 3] |= 1 << (number & 7)
+    return int.from_bytes(bits, "little")
+
+
+def size(docs: Docs) -> int:
+    return docs.bit_count() if isinstance(docs, int) else len(docs)
+
+
+def intersect(docs: Docs, other: Docs) -> Docs:
+    if isinstance(docs, int) == isinstance(other, int):
+        return docs & other
+    bitmap, small = (docs, other) if isinstance(docs, int) else (other, docs)
+    raw = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+    return {number for number in small
+            if number >> 3 < len(raw) and raw[number >> 3] >> (number & 7) & 1}
+
+
+def iterate(docs: Docs) -> Iterator[int]:
+    if not isinstance(docs, int):
+        yield from docs
+        return
+    # Zero bytes are skipped by the regex engine, so sparse bitmaps page quickly
+    raw = docs.to_bytes((docs.bit_length() + 7) // 8, "little")
+    for match in _NONZERO_RE.finditer(raw):
+        base = match.start()
+        byte = raw[base]
+        base <<= 3
+        for bit in range(8):
+            if byte >> bit & 1:
+                yield base + bit
+
+
+class ProfessionalSearchIndex:
+    def __init__(self):
+        self._user_ids: List[Optional[str]] = []
+        self._numbers: Dict[str, int] = {}
+        # token -> (field weight, category) -> doc numbers
+        self._postings: Dict[str, Dict[TierKey, Set[int]]] = {}
+        # The same for large tiers as bitmaps, kept in step with _postings
+        self._bitmaps: Dict[str, Dict[TierKey, int]] = {}
+        # doc number -> ({token: weight}, category), to unindex on update
+        self._documents: Dict[int, Tuple[Dict[str, float], Optional[str]]] = {}
+        # Sorted vocabulary for prefix lookups; rebuilt lazily after it changes
+        self._vocabulary: List[str] = []
+        self._vocabulary_stale = False
+        # (terms, category) -> (ranked tiers, their sizes); cleared on every index change
+        self._results: "OrderedDict[ResultKey, Tuple[Tiers, List[int]]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def rebuild(self, users: Iterable[dict]):
+        self.__init__()
+        for user in users:
+            self.upsert(user)
+        for token, tiers in self._postings.items():
+            for key, docs in tiers.items():
+                self._docs(token, key, docs)
+
+    def upsert(self, user: dict):
+        """Index ``user`` if it is a professional, otherwise drop it from the index."""
+        user_id = str(user.get("_id") or user.get("id"))
+        self.remove(user_id)
+        if not user.get("professional_mode"):
+            return
+        self._results.clear()
+
+        weights: Dict[str, float] = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in set(tokenize(user.get(field))):
+                weights[token] = weights.get(token, 0.0) + weight
+
+        number = self._numbers.get(user_id)
+        if number is None:
+            number = self._numbers[user_id] = len(self._user_ids)
+            self._user_ids.append(user_id)
+        category = user.get("category")
+        for token, weight in weights.items():
+            tiers = self._postings.get(token)
+            if tiers is None:
+                tiers = self._postings[token] = {}
+                self._vocabulary_stale = True
+            tiers.setdefault((weight, category), set()).add(number)
+            bitmaps = self._bitmaps.get(token)
+            if bitmaps is not None and (weight, category) in bitmaps:
+                bitmaps[weight, category] |= 1 << number
+        self._documents[number] = (weights, category)
+
+    def remove(self, user_id: str):
+        number = self._numbers.get(user_id)
+        document = self._documents.pop(number, None) if number is not None else None
+        if document is None:
+            return
+        self._results.clear()
+        weights, category = document
+        for token, weight in weights.items():
+            tiers = self._postings[token]
+            key = (weight, category)
+            tiers[key].discard(number)
+            bitmaps = self._bitmaps.get(token)
+            if bitmaps is not None and key in bitmaps:
+                bitmaps[key] &= ~(1 << number)
+            if not tiers[key]:
+                del tiers[key]
+                if bitmaps is not None:
+                    bitmaps.pop(key, None)
+                if not tiers:
+                    del self._postings[token]
+                    self._bitmaps.pop(token, None)
+                    self._vocabulary_stale = True
+
+    def _docs(self, token: str, key: TierKey, docs: Set[int]) -> Docs:
+        """The tier as a bitmap if it is large enough to have one, else its set."""
+        bitmaps = self._bitmaps.get(token)
+        bitmap = bitmaps.get(key) if bitmaps is not None else None
+        if bitmap is None and len(docs) * BITMAP_DENSITY >= len(self._user_ids):
+            bitmap = self._bitmaps.setdefault(token, {})[key] = to_bitmap(docs, len(self._user_ids))
+        return docs if bitmap is None else bitmap
+
+    def _expand_prefix(self, prefix: str) -> List[str]:
+        if self._vocabulary_stale:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_stale = False
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        matches = []
+        for token in self._vocabulary[start:start + MAX_PREFIX_EXPANSION]:
+            if not token.startswith(prefix):
+                break
+            matches.append(token)
+        return matches
+
+    def _term_tiers(
+        self, tokens: List[str], category: Optional[str], bitmaps: bool = True
+    ) -> Tiers:
+        """Disjoint tiers, best first, for a term matching any of ``tokens``.
+
+        Without ``bitmaps`` every tier is a set, which pages faster when
+        there is nothing to intersect."""
+        total = len(self._documents)
+        matched = [(token, self._postings.get(token)) for token in tokens]
+        matched = [(token, tiers) for token, tiers in matched if tiers]
+        entries = []
+        for token, tiers in matched:
+            idf = math.log(1 + total / sum(map(len, tiers.values())))
+            entries.extend(
+                (weight * idf, tier_category,
+                 self._docs(token, (weight, tier_category), docs) if bitmaps else docs)
+                for (weight, tier_category), docs in tiers.items()
+                if category is None or tier_category == category
+            )
+        entries.sort(key=lambda entry: entry[0], reverse=True)
+        if len(matched) <= 1:
+            return entries  # Tiers of one token are already disjoint
+
+        # A document matching several alternatives keeps its best score
+        disjoint = []
+        if any(isinstance(docs, int) for _, _, docs in entries):
+            capacity = len(self._user_ids)
+            seen = 0
+            for score, tier_category, docs in entries:
+                fresh = (docs if isinstance(docs, int) else to_bitmap(docs, capacity)) & ~seen
+                if fresh:
+                    disjoint.append((score, tier_category, fresh))
+                    seen |= fresh
+            return disjoint
+        seen_docs: Set[int] = set()
+        for score, tier_category, docs in entries:
+            fresh_docs = docs - seen_docs
+            if fresh_docs:
+                disjoint.append((score, tier_category, fresh_docs))
+                seen_docs |= fresh_docs
+        return disjoint
+
+    def _match(self, terms: List[str], category: Optional[str]) -> Tiers:
+        *exact, last = terms
+        groups = [self._term_tiers([term], category) for term in exact]
+        groups.append(self._term_tiers(
+            list(dict.fromkeys([last, *self._expand_prefix(last)])), category, bitmaps=bool(exact)))
+        groups.sort(key=lambda tiers: sum(size(docs) for _, _, docs in tiers))
+
+        combined = groups[0]
+        for tiers in groups[1:]:
+            if not combined:
+                break
+            combined = [
+                (score + other_score, tier_category, matched)
+                for score, tier_category, docs in combined
+                for other_score, other_category, other_docs in tiers
+                if other_category == tier_category
+                for matched in (intersect(docs, other_docs),)
+                if matched
+            ]
+        combined.sort(key=lambda entry: entry[0], reverse=True)
+        return combined
+
+    def search(
+        self, query: str, category: Optional[str] = None, offset: int = 0, limit: int = 20,
+        where: Optional[Callable[[str], bool]] = None,
+    ) -> Tuple[int, List[str]]:
+        """Returns the number of matches and one page of user ids, best first.
+
+        ``where(user_id)`` keeps only some matches, e.g. by presence, which
+        changes too often to index; counting them walks every match."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return 0, []
+
+        key = (tuple(terms), category)
+        cached = self._results.get(key)
+        if cached is None:
+            combined = self._match(terms, category)
+            sizes = [size(docs) for _, _, docs in combined]
+            if len(terms) > 1:
+                self._results[key] = (combined, sizes)
+                if len(self._results) > RESULT_CACHE_ENTRIES:
+                    self._results.popitem(last=False)
+        else:
+            combined, sizes = cached
+            self._results.move_to_end(key)
+
+        if where is not None:
+            kept = [user_id for _, _, docs in combined
+                    for user_id in map(self._user_ids.__getitem__, iterate(docs)) if where(user_id)]
+            return len(kept), kept[offset:offset + limit]
+
+        page: List[int] = []
+        for (_, _, docs), tier_size in zip(combined, sizes):
+            # Whole tiers before the page are skipped by size, without walking them
+            if offset >= tier_size:
+                offset -= tier_size
+                continue
+            page.extend(itertools.islice(iterate(docs), offset, offset + limit - len(page)))
+            offset = 0
+            if len(page) >= limit:
+                break
+        return sum(sizes), [self._user_ids[number] for number in page]
@@ -0,0 +1,170 @@
+"""Production launcher: ``python serve.py``.
+
+``RUNTIME_PROFILE=tuned`` (the default) runs on uvloop with the httptools
+parser when they are installed, with keep-alive and the listen backlog sized
+for a load balancer in front and uvicorn's per-request access log off (the
+app logs and times requests itself). ``RUNTIME_PROFILE=default`` is stock
+uvicorn (asyncio, h11), kept for comparison.
+
+``WEB_CONCURRENCY`` sets the number of worker processes, or ``auto`` for one
+per CPU available to the container. It defaults to 1: connections, the
+professional directory, search, matchmaking, the call registry and queued
+messages live in each process, so users on different workers cannot reach
+each other until that state is shared. With several workers, startup
+reconciliation runs once here before they start instead of in each of them.
+"""
+import asyncio
+import importlib.util
+import logging
+import math
+import os
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+
+WS_PER_MESSAGE_DEFLATE = os.getenv("WS_PER_MESSAGE_DEFLATE", "true").lower() == "true"
+WS_DEFLATE_LEVEL = int(os.getenv("WS_DEFLATE_LEVEL", "6"))
+WS_DEFLATE_WINDOW_BITS = int(os.getenv("WS_DEFLATE_WINDOW_BITS", "12"))
+WS_DEFLATE_MEM_LEVEL = int(os.getenv("WS_DEFLATE_MEM_LEVEL", "5"))
+RUNTIME_PROFILE = os.getenv("RUNTIME_PROFILE", "tuned")
+WEB_CONCURRENCY = os.getenv("WEB_CONCURRENCY", "1")
+# Above the idle timeout of common load balancers (60s), so they close first
+KEEP_ALIVE_TIMEOUT = int(os.getenv("KEEP_ALIVE_TIMEOUT", "65"))
+LISTEN_BACKLOG = int(os.getenv("LISTEN_BACKLOG", "4096"))
+RECONCILE_ON_STARTUP = os.getenv("RECONCILE_ON_STARTUP", "true").lower() == "true"
+RECONCILE_MAX_CALL_MINUTES = float(os.getenv("RECONCILE_MAX_CALL_MINUTES", "60"))
+RECONCILE_SETTLE_CALLS = os.getenv("RECONCILE_SETTLE_CALLS", "false").lower() == "true"
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def available_cpus() -> int:
+    """CPUs this process may use: affinity mask, capped by a cgroup CPU quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # Not on Linux
+        cpus = os.cpu_count() or 1
+    quota = None
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:  # cgroup v2: "<quota> <period>" or "max <period>"
+            limit, period = f.read().split()
+            if limit != "max":
+                quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                limit = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+    if quota is not None:
+        cpus = min(cpus, math.ceil(quota))
+    return max(1, cpus)
+
+
+def worker_count(setting: str = WEB_CONCURRENCY) -> int:
+    return available_cpus() if setting == "auto" else max(1, int(setting))
+
+
+def runtime_options(profile: str = RUNTIME_PROFILE) -> dict:
+    if profile == "default":
+        return {"loop": "asyncio", "http": "h11"}
+    if profile != "tuned":
+        raise ValueError(f"Unknown RUNTIME_PROFILE '{profile}'")
+    return {
+        # Fall back quietly where the optional accelerators are not installed (e.g. Windows)
+        "loop": "uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        "http": "httptools" if importlib.util.find_spec("httptools") else "h11",
+        "timeout_keep_alive": KEEP_ALIVE_TIMEOUT,
+        "backlog": LISTEN_BACKLOG,
+        "access_log": False,
+    }
+
+
+async def reconcile_once():
+    """Startup reconciliation for all workers, run before any of them starts.
+
+    Reconciliation resets presence and settles open calls; a worker running it
+    while another already serves users would end their calls under them.
+    """
+    from repositories import create_storage
+
+    storage = create_storage()
+    try:
+        report = await storage.reconcile(max_call_minutes=RECONCILE_MAX_CALL_MINUTES,
+                                         settle_calls=RECONCILE_SETTLE_CALLS)
+    finally:
+        storage.close()
+    logger.info("Startup reconciliation before starting workers: %s", report)
+
+
+class DeflateWebSocketProtocol(WebSocketProtocol):
+    """uvicorn's websockets protocol with a tunable permessage-deflate offer.
+
+    uvicorn negotiates permessage-deflate with zlib defaults, which keep a 32 KiB
+    window and about 256 KiB of compressor state per connection. Signaling and
+    chat frames are small, so a 4 KiB window compresses them about as well while
+    keeping memory per socket low enough for thousands of connections.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.config.ws_per_message_deflate:
+            self.available_extensions = [
+                ServerPerMessageDeflateFactory(
+                    server_max_window_bits=WS_DEFLATE_WINDOW_BITS,
+                    client_max_window_bits=WS_DEFLATE_WINDOW_BITS,
+                    compress_settings={"level": WS_DEFLATE_LEVEL, "memLevel": WS_DEFLATE_MEM_LEVEL},
+                )
+            ]
+
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that drains application sockets before closing them.
+
+    uvicorn closes every WebSocket with code 1012 before the lifespan shutdown
+    runs, so the app gets no chance to say goodbye. Draining first lets clients
+    receive a ``server_restarting`` frame and lets presence be cleared in bulk.
+    """
+
+    async def shutdown(self, sockets=None):
+        from server import drain_connections
+
+        await drain_connections()
+        await super().shutdown(sockets=sockets)
+
+
+def main():
+    config = uvicorn.Config(
+        "server:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        ws=DeflateWebSocketProtocol,
+        ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE,
+        workers=worker_count(),
+        **runtime_options(),
+    )
+    server = DrainingServer(config)
+    logger.info("Runtime profile %s: loop=%s http=%s workers=%d",
+                RUNTIME_PROFILE, config.loop, config.http, config.workers)
+    if config.workers > 1:
+        logger.warning("Running %d workers: WebSocket routing, matchmaking and the call registry "
+                       "are per process, so only users on the same worker can reach each other; "
+                       "startup reconciliation runs once before they start, not per worker",
+                       config.workers)
+        if RECONCILE_ON_STARTUP:
+            asyncio.run(reconcile_once())
+        # Workers are spawned with this environment
+        os.environ["RECONCILE_ON_STARTUP"] = "false"
+        Multiprocess(config, target=server.run, sockets=[config.bind_socket()]).run()
+    else:
+        server.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,148 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, Header, HTTPException, Query, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Set, Tuple
 import jwt
 import bcrypt
 import asyncio
 import json
-from datetime import datetime, timedelta
-from motor.motor_asyncio import AsyncIOMotorClient
-from bson import ObjectId
+from datetime import date, datetime, timedelta
 import os
 from enum import Enum
+from contextlib import asynccontextmanager
 import uuid
+import time
 import logging
 
+from pending_messages import PendingMessageQueue
+from heartbeat import HeartbeatSweeper
+from billing import DEFAULT_PRICE_PER_MINUTE, SIGNUP_TOKENS, professional_earning
+from repositories import STORAGE_ENGINE, Storage, create_storage
+import metrics
+from loop_monitor import LoopLagMonitor
+from request_timing import ServerTimingMiddleware, record_ws_send
+from logging_setup import configure_logging, parse_sample_rates
+from compression import CompressionMiddleware
+from search import ProfessionalSearchIndex
+from directory import ORDERS, ProfessionalDirectory, json_array
+from matchmaking import MatchFailed, Matchmaker, WaitingCaller
+from call_registry import CallRegistry
+from readiness import Readiness
+from idempotency import MAX_KEY_LENGTH, IdempotencyKeys, KeyReused
+from exports import FORMATS, stream_calls
+
 # Configuration
-DATABASE_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
 JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key")
 JWT_ALGORITHM = "HS256"
+PENDING_MAX_PER_USER = int(os.getenv("PENDING_MAX_PER_USER", "100"))
+PENDING_MAX_AGE_SECONDS = float(os.getenv("PENDING_MAX_AGE_SECONDS", "300"))
+PENDING_MAX_MEMORY_MESSAGES = int(os.getenv("PENDING_MAX_MEMORY_MESSAGES", "50000"))
+PENDING_MAX_USER_BYTES = int(os.getenv("PENDING_MAX_USER_BYTES", str(1024 * 1024)))
+PENDING_MAX_MEMORY_BYTES = int(os.getenv("PENDING_MAX_MEMORY_BYTES", str(64 * 1024 * 1024)))
+PENDING_MAX_MESSAGE_BYTES = int(os.getenv("PENDING_MAX_MESSAGE_BYTES", str(256 * 1024)))
+IDEMPOTENCY_CACHE_ENTRIES = int(os.getenv("IDEMPOTENCY_CACHE_ENTRIES", "10000"))
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "20"))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "60"))
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "10"))
+RECONCILE_ON_STARTUP = os.getenv("RECONCILE_ON_STARTUP", "true").lower() == "true"
+RECONCILE_MAX_CALL_MINUTES = float(os.getenv("RECONCILE_MAX_CALL_MINUTES", "60"))
+# Settling interrupted calls moves balances; off until enabled per deployment
+RECONCILE_SETTLE_CALLS = os.getenv("RECONCILE_SETTLE_CALLS", "false").lower() == "true"
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", "0.25"))
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))  # 0 disables slow request logging
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json or text
+LOG_ASYNC = os.getenv("LOG_ASYNC", "true").lower() == "true"
+LOG_SAMPLE_RATES = parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", ""))
+EARNINGS_MAX_DAYS = int(os.getenv("EARNINGS_MAX_DAYS", "366"))
+MATCH_POSITION_INTERVAL = float(os.getenv("MATCH_POSITION_INTERVAL", "2"))
+MATCH_MAX_WAIT_SECONDS = float(os.getenv("MATCH_MAX_WAIT_SECONDS", "300"))
+CALL_RING_TIMEOUT = float(os.getenv("CALL_RING_TIMEOUT", "60"))
+WARMUP_IN_BACKGROUND = os.getenv("WARMUP_IN_BACKGROUND", "true").lower() == "true"
+WARM_POOL_CONNECTIONS = int(os.getenv("WARM_POOL_CONNECTIONS", "10"))
+READINESS_CHECK_INTERVAL = float(os.getenv("READINESS_CHECK_INTERVAL", "5"))
+READINESS_CHECK_TIMEOUT = float(os.getenv("READINESS_CHECK_TIMEOUT", "2"))
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global storage
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+    
+    storage = create_storage(STORAGE_ENGINE)
+    pending_messages.collection = storage.pending_messages
+    idempotency_keys.repository = storage.idempotency
+    
+    # The port is bound once this returns; with WARMUP_IN_BACKGROUND the
+    # steps run after that and /readyz reports when they are done
+    if WARMUP_IN_BACKGROUND:
+        readiness.start(WARMUP_STEPS)
+    else:
+        await readiness.warm_up(WARMUP_STEPS)
+        readiness.start(WARMUP_STEPS)
+    heartbeat.start()
+    matchmaker.start()
+    call_registry.start(expire_unanswered_call)
+    yield
+    await readiness.stop()
+    await call_registry.stop()
+    await matchmaker.stop()
+    await heartbeat.stop()
+    # No-op if the launcher already drained before uvicorn closed the sockets
+    await drain_connections()
+    await call_registry.flush()
+    storage.close()
+    await loop_monitor.stop()
+    if log_listener is not None:
+        log_listener.stop()  # Flushes queued records
+
+async def ensure_indexes():
+    await storage.ensure_indexes()
+    await pending_messages.ensure_indexes()
+
+async def reconcile():
+    # Single-instance deployments own all presence; disable when running several
+    if RECONCILE_ON_STARTUP:
+        report = await storage.reconcile(max_call_minutes=RECONCILE_MAX_CALL_MINUTES,
+                                         settle_calls=RECONCILE_SETTLE_CALLS)
+        logger.info("Startup reconciliation: %s", report, extra={"event": "reconciliation", **report})
+
+async def build_directory():
+    # After reconciliation so the directory starts from settled presence
+    professionals = [user async for user in storage.users.iter_professionals()]
+    search_index.rebuild(professionals)
+    directory.rebuild(professionals)
+    matchmaker.rebuild(professionals)
+    logger.info("Directory and search index built with %d professionals", len(directory))
+
+async def load_open_calls():
+    call_registry.rebuild([call async for call in storage.calls.iter_open()])
+    logger.info("Call registry loaded with %d open calls", len(call_registry))
 
-app = FastAPI(title="Click Online API", version="1.0.0")
+async def warm_pool():
+    await storage.warm_pool(WARM_POOL_CONNECTIONS)
+
+WARMUP_STEPS = [
+    ("indexes", ensure_indexes),
+    ("reconciliation", reconcile),
+    ("directory", build_directory),
+    ("call_registry", load_open_calls),
+    ("connection_pool", warm_pool),
+]
+
+readiness = Readiness(lambda: storage.ping(), interval=READINESS_CHECK_INTERVAL, timeout=READINESS_CHECK_TIMEOUT)
+metrics.registry.gauge_func("app_ready", "1 once warmup is done and the database answers",
+                            lambda: int(readiness.ready))
+
+app = FastAPI(title="Click Online API", version="1.0.0", lifespan=lifespan)
 
 # CORS Configuration
 app.add_middleware(
@@ -29,56 +151,251 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count"],
+)
+# Inside the metrics and timing middlewares so their durations include compression
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=COMPRESSION_MIN_SIZE,
+    gzip_level=COMPRESSION_GZIP_LEVEL,
+    brotli_quality=COMPRESSION_BROTLI_QUALITY,
+    cacheable_paths=["/api/professionals"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(ServerTimingMiddleware, slow_request_ms=SLOW_REQUEST_MS)
+
+# Storage (created and closed in lifespan, see repositories.py for the engines)
+storage: Optional[Storage] = None
 
-# Database
-client = AsyncIOMotorClient(DATABASE_URL)
-db = client.click_online
+# Full-text search over professionals, rebuilt in lifespan and updated on profile changes
+search_index = ProfessionalSearchIndex()
+
+# Pending and active calls of this process, loaded in lifespan; call control reads these
+call_registry = CallRegistry(ring_timeout=CALL_RING_TIMEOUT)
+metrics.registry.gauge_func("calls_open", "Pending and active calls in the call registry",
+                            lambda: len(call_registry))
+metrics.registry.gauge_func("call_registry_pending_writes", "Calls with registry writes not yet persisted",
+                            lambda: call_registry.pending_writes())
 
 # Security
 security = HTTPBearer()
 
+# Watches for synchronous work (bcrypt, large json.dumps) stalling the event loop
+loop_monitor = LoopLagMonitor(interval=LOOP_LAG_INTERVAL, threshold=LOOP_LAG_THRESHOLD)
+
 # Logging
-logging.basicConfig(level=logging.INFO)
+log_listener = configure_logging(
+    level=getattr(logging, LOG_LEVEL, logging.INFO),
+    json_format=LOG_FORMAT == "json",
+    asynchronous=LOG_ASYNC,
+    sample_rates=LOG_SAMPLE_RATES,
+)
 logger = logging.getLogger(__name__)
 
 # WebSocket Manager for signaling
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, pending: Optional[PendingMessageQueue] = None):
         self.active_connections: Dict[str, WebSocket] = {}
         self.user_connections: Dict[str, str] = {}  # user_id -> connection_id
+        self.last_seen: Dict[str, tuple] = {}  # connection_id -> (user_id, monotonic time)
+        self.pending = pending
+        self.accepting = True
+        # user_id -> live messages held back while the user's backlog is replayed
+        self.replaying: Dict[str, List[dict]] = {}
+        # Connections dropped after a failed send; their handler still owes presence cleanup
+        self.send_failed: Set[str] = set()
     
     async def connect(self, websocket: WebSocket, user_id: str):
+        if not self.accepting:
+            await websocket.close(code=1012)  # Service restart
+            return None
         await websocket.accept()
         connection_id = str(uuid.uuid4())
         self.active_connections[connection_id] = websocket
         self.user_connections[user_id] = connection_id
-        logger.info(f"User {user_id} connected with connection {connection_id}")
+        self.last_seen[connection_id] = (user_id, time.monotonic())
+        logger.info("User %s connected with connection %s", user_id, connection_id,
+                    extra={"event": "ws.connect", "user_id": user_id, "connection_id": connection_id})
+        
+        # Deliver anything that was sent while the user was away, in order;
+        # live messages sent meanwhile are held until the backlog is out
+        if self.pending is not None:
+            held = self.replaying[user_id] = []
+            try:
+                for message in await self.pending.drain(user_id):
+                    await self._deliver(user_id, message)
+                while held:
+                    await self._deliver(user_id, held.pop(0))
+            finally:
+                if self.replaying.get(user_id) is held:
+                    del self.replaying[user_id]
         return connection_id
     
-    def disconnect(self, connection_id: str, user_id: str):
-        if connection_id in self.active_connections:
-            del self.active_connections[connection_id]
-        if user_id in self.user_connections:
+    def disconnect(self, connection_id: str, user_id: str) -> bool:
+        """Forget a connection. Returns False if it was already removed."""
+        if connection_id not in self.active_connections:
+            return False
+        del self.active_connections[connection_id]
+        self.last_seen.pop(connection_id, None)
+        # A reconnect may already have replaced this connection
+        if self.user_connections.get(user_id) == connection_id:
             del self.user_connections[user_id]
-        logger.info(f"User {user_id} disconnected")
+        logger.info("User %s disconnected", user_id,
+                    extra={"event": "ws.disconnect", "user_id": user_id, "connection_id": connection_id})
+        return True
+    
+    def release(self, connection_id: str, user_id: str) -> bool:
+        """Forget a connection whose handler is exiting. Returns True if presence
+        still needs cleaning up, i.e. the heartbeat reaper has not done it."""
+        send_failed = connection_id in self.send_failed
+        self.send_failed.discard(connection_id)
+        return self.disconnect(connection_id, user_id) or send_failed
+    
+    def touch(self, connection_id: str, user_id: str):
+        self.last_seen[connection_id] = (user_id, time.monotonic())
+    
+    def is_connected(self, user_id: str) -> bool:
+        return user_id in self.user_connections
     
     async def send_to_user(self, user_id: str, message: dict):
-        if user_id in self.user_connections:
-            connection_id = self.user_connections[user_id]
-            if connection_id in self.active_connections:
-                websocket = self.active_connections[connection_id]
-                try:
-                    await websocket.send_text(json.dumps(message))
-                except:
-                    self.disconnect(connection_id, user_id)
+        held = self.replaying.get(user_id)
+        if held is not None:
+            held.append(message)
+            return
+        await self._deliver(user_id, message)
+    
+    async def _deliver(self, user_id: str, message: dict):
+        connection_id = self.user_connections.get(user_id)
+        websocket = self.active_connections.get(connection_id) if connection_id else None
+        if websocket is not None:
+            started = time.perf_counter()
+            try:
+                await websocket.send_text(json.dumps(message))
+                metrics.ws_messages.inc("out", message_type_label(message))
+                return
+            except Exception:
+                metrics.ws_send_failures.inc("send_error")
+                if self.disconnect(connection_id, user_id):
+                    self.send_failed.add(connection_id)
+            finally:
+                record_ws_send(time.perf_counter() - started)
+        else:
+            metrics.ws_send_failures.inc("not_connected")
+        
+        if self.pending is not None:
+            await self.pending.enqueue(user_id, message)
+
+    async def close_all(self, message: dict) -> List[str]:
+        """Stop accepting sockets, send a final frame to every client and close them.
+        
+        Returns the ids of the users that were connected.
+        """
+        self.accepting = False
+        connections = [
+            (user_id, self.active_connections.get(connection_id))
+            for user_id, connection_id in self.user_connections.items()
+        ]
+        self.active_connections.clear()
+        self.user_connections.clear()
+        self.last_seen.clear()
+        
+        frame = json.dumps(message)
+        
+        async def notify_and_close(websocket: WebSocket):
+            try:
+                await websocket.send_text(frame)
+                await websocket.close(code=1012)
+            except Exception:
+                pass
+        
+        await asyncio.gather(*(notify_and_close(ws) for _, ws in connections if ws is not None))
+        return [user_id for user_id, _ in connections]
+
+# Client-supplied types are folded into "other" to keep metric labels bounded
+KNOWN_MESSAGE_TYPES = {
+    "ping", "pong", "offer", "answer", "ice-candidate", "chat_message", "file_message",
+    "call_request", "call_accepted", "call_ended", "server_restarting", "peer_disconnected",
+}
+
+def message_type_label(message: dict) -> str:
+    message_type = message.get("type")
+    return message_type if message_type in KNOWN_MESSAGE_TYPES else "other"
 
-manager = ConnectionManager()
+pending_messages = PendingMessageQueue(
+    None,
+    max_per_user=PENDING_MAX_PER_USER,
+    max_age_seconds=PENDING_MAX_AGE_SECONDS,
+    max_memory_messages=PENDING_MAX_MEMORY_MESSAGES,
+    max_user_bytes=PENDING_MAX_USER_BYTES,
+    max_memory_bytes=PENDING_MAX_MEMORY_BYTES,
+    max_message_bytes=PENDING_MAX_MESSAGE_BYTES,
+)
+manager = ConnectionManager(pending_messages)
+idempotency_keys = IdempotencyKeys(
+    max_entries=IDEMPOTENCY_CACHE_ENTRIES,
+    ttl_seconds=IDEMPOTENCY_TTL_HOURS * 3600,
+)
+
+async def handle_disconnect(connection_id: str, user_id: str):
+    """Presence cleanup once a socket is gone, whether it closed or was reaped."""
+    # Keep the user online if they already reconnected on a new socket
+    if manager.is_connected(user_id):
+        return
+    
+    # A queued caller who left cannot take the call
+    matchmaker.cancel(user_id)
+    
+    # While draining, users are marked offline in bulk by drain_connections
+    if not manager.accepting:
+        return
+    
+    # Let the other side of an open call know, instead of waiting on dead media
+    for call in call_registry.for_user(user_id):
+        peer_id = call["callee_id"] if call["caller_id"] == user_id else call["caller_id"]
+        await notify_if_connected(peer_id, {"type": "peer_disconnected", "call_id": str(call["_id"])})
+    
+    # Update user status to offline
+    apply_user_update(await storage.users.set_status(user_id, "offline"))
+
+_drain_started = False
+
+async def drain_connections():
+    """Graceful shutdown: notify and close every socket, persist queued messages
+    and mark all local users offline in one write, bounded by SHUTDOWN_DRAIN_TIMEOUT."""
+    global _drain_started
+    if _drain_started:
+        return
+    _drain_started = True
+    
+    async def drain():
+        user_ids = await manager.close_all({"type": "server_restarting"})
+        await pending_messages.flush()
+        await storage.users.set_status_many(user_ids, "offline")
+        directory.set_status_many(user_ids, "offline")
+        matchmaker.set_unavailable_many(user_ids)
+        logger.info("Drained %d connections", len(user_ids))
+    
+    try:
+        await asyncio.wait_for(drain(), SHUTDOWN_DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.error("Connection drain exceeded %ss deadline", SHUTDOWN_DRAIN_TIMEOUT)
+    except Exception:
+        logger.exception("Connection drain failed")
+
+heartbeat = HeartbeatSweeper(
+    manager,
+    on_reap=handle_disconnect,
+    interval=WS_HEARTBEAT_INTERVAL,
+    idle_timeout=WS_IDLE_TIMEOUT,
+)
+
+PROFESSIONAL_CATEGORIES = ["Médico", "Psicólogo"]
 
 # Enums
 class UserRole(str, Enum):
     USER = "user"
     PROFESSIONAL = "professional"
+    ADMIN = "admin"  # Granted directly in the database
 
 class UserStatus(str, Enum):
     OFFLINE = "offline"
@@ -152,12 +469,23 @@ def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
 async def get_current_user(user_id: str = Depends(verify_token)):
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    user = await storage.users.get(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     user["id"] = str(user["_id"])
     return user
 
+def warmed_up():
+    # Reconciliation and the directory and registry rebuilds would overwrite
+    # what a request changes while they run, so those routes wait for warmup
+    if not readiness.warmed:
+        raise HTTPException(status_code=503, detail="Starting up, try again shortly", headers={"Retry-After": "1"})
+
+async def get_admin_user(current_user: dict = Depends(get_current_user)):
+    if current_user.get("role") != UserRole.ADMIN.value:
+        raise HTTPException(status_code=403, detail="Admin only")
+    return current_user
+
 # Helper functions
 def serialize_user(user: dict) -> dict:
     return {
@@ -174,16 +502,34 @@ def serialize_user(user: dict) -> dict:
         "profile_photo": user.get("profile_photo")
     }
 
+# Pre-serialized professionals for /api/professionals, rebuilt in lifespan
+directory = ProfessionalDirectory(serialize_user)
+
+def apply_user_update(user: Optional[dict]):
+    """Apply the post-image of a user write to the directory and matchmaking."""
+    if user:
+        directory.upsert(user)
+        matchmaker.update_user(user)
+
 # API Routes
 @app.get("/")
 async def root():
     return {"message": "Click Online API is running"}
 
-@app.post("/api/register")
+@app.get("/healthz")
+async def healthz():
+    # Liveness: the process serves requests; dependencies are /readyz's business
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    # Cached by the readiness loop; probes never reach the database
+    return JSONResponse(readiness.snapshot(), status_code=200 if readiness.ready else 503)
+
+@app.post("/api/register", dependencies=[Depends(warmed_up)])
 async def register(user_data: UserCreate):
     # Check if user exists
-    existing_user = await db.users.find_one({"email": user_data.email})
-    if existing_user:
+    if await storage.users.email_exists(user_data.email):
         raise HTTPException(
             status_code=400, 
             detail=f"Email '{user_data.email}' já está cadastrado. Faça login ou use outro email."
@@ -196,34 +542,33 @@ async def register(user_data: UserCreate):
         "password": hash_password(user_data.password),
         "role": "user",  # All users start as regular users
         "status": "offline",
-        "token_balance": 1000,  # Give 1000 tokens for MVP
+        "token_balance": SIGNUP_TOKENS,
         "professional_mode": False,  # Can be activated later in settings
         "price_per_minute": 1,  # Default 1 token per minute
         "created_at": datetime.utcnow()
     }
     
-    result = await db.users.insert_one(user_dict)
-    user_id = str(result.inserted_id)
+    user_id = await storage.users.create(user_dict)
     
     token = create_access_token({"sub": user_id})
     
     return {
         "access_token": token,
         "token_type": "bearer",
-        "user": serialize_user({**user_dict, "_id": result.inserted_id})
+        "user": serialize_user(user_dict)
     }
 
-@app.post("/api/login")
+@app.post("/api/login", dependencies=[Depends(warmed_up)])
 async def login(credentials: UserLogin):
-    user = await db.users.find_one({"email": credentials.email})
+    user = await storage.users.get_by_email(credentials.email)
     if not user or not verify_password(credentials.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     # Update status to online
-    await db.users.update_one(
-        {"_id": user["_id"]}, 
-        {"$set": {"status": "online", "last_login": datetime.utcnow()}}
-    )
+    apply_user_update(await storage.users.update_fields(
+        str(user["_id"]),
+        {"status": "online", "last_login": datetime.utcnow()}
+    ))
     
     token = create_access_token({"sub": str(user["_id"])})
     
@@ -237,7 +582,7 @@ async def login(credentials: UserLogin):
 async def get_me(current_user: dict = Depends(get_current_user)):
     return serialize_user(current_user)
 
-@app.put("/api/profile")
+@app.put("/api/profile", dependencies=[Depends(warmed_up)])
 async def update_profile(profile_data: ProfileUpdate, current_user: dict = Depends(get_current_user)):
     update_fields = {}
     
@@ -252,7 +597,7 @@ async def update_profile(profile_data: ProfileUpdate, current_user: dict = Depen
             
     if profile_data.category is not None:
         # Validate category
-        if profile_data.category not in ["Médico", "Psicólogo"]:
+        if profile_data.category not in PROFESSIONAL_CATEGORIES:
             raise HTTPException(status_code=400, detail="Categoria deve ser 'Médico' ou 'Psicólogo'")
         update_fields["category"] = profile_data.category
         
@@ -272,19 +617,44 @@ async def update_profile(profile_data: ProfileUpdate, current_user: dict = Depen
             raise HTTPException(status_code=400, detail="URL da foto deve começar com http:// ou https://")
         update_fields["profile_photo"] = profile_data.profile_photo
     
-    # Update user if there are any fields to update
+    # Update user if there are any fields to update, returning the post-image
     if update_fields:
-        await db.users.update_one(
-            {"_id": ObjectId(current_user["_id"])},
-            {"$set": update_fields}
-        )
-        
-        # Get updated user
-        updated_user = await db.users.find_one({"_id": ObjectId(current_user["_id"])})
+        updated_user = await storage.users.update_fields(current_user["id"], update_fields)
+        if not updated_user:
+            raise HTTPException(status_code=404, detail="User not found")
+        search_index.upsert(updated_user)
+        apply_user_update(updated_user)
         return serialize_user(updated_user)
     
     return serialize_user(current_user)
 
+metrics.registry.gauge_func(
+    "ws_active_connections", "Open signaling WebSockets",
+    lambda: len(manager.active_connections))
+metrics.registry.counter_func(
+    "ws_reaped_total", "Idle WebSockets closed by the heartbeat sweeper",
+    lambda: heartbeat.reaped_total)
+metrics.registry.counter_func(
+    "calls_unanswered_total", "Pending calls dropped from the call registry after CALL_RING_TIMEOUT",
+    lambda: call_registry.expired_total)
+metrics.registry.gauge_func(
+    "pending_messages_in_memory", "Messages queued in memory for offline users",
+    lambda: pending_messages.memory_count)
+metrics.registry.gauge_func(
+    "pending_messages_in_memory_bytes", "Serialized size of the messages queued in memory",
+    lambda: pending_messages.memory_bytes)
+metrics.registry.gauge_func(
+    "idempotency_keys_in_memory", "Responses cached in memory for Idempotency-Key replays",
+    lambda: len(idempotency_keys))
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/api/heartbeat/stats")
+async def heartbeat_stats():
+    return heartbeat.stats()
+
 @app.get("/api/placeholder/{width}x{height}")
 async def placeholder_image(width: int, height: int, text: str = ""):
     """Generate a simple placeholder image response"""
@@ -298,81 +668,223 @@ async def placeholder_image(width: int, height: int, text: str = ""):
         "url": f"https://via.placeholder.com/{width}x{height}/4A90E2/FFFFFF?text={text}"
     }
 
-@app.put("/api/status")
+@app.put("/api/status", dependencies=[Depends(warmed_up)])
 async def update_status(status_update: StatusUpdate, current_user: dict = Depends(get_current_user)):
-    await db.users.update_one(
-        {"_id": ObjectId(current_user["_id"])},
-        {"$set": {"status": status_update.status}}
-    )
+    updated_user = await storage.users.set_status(current_user["id"], status_update.status.value)
+    if not updated_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    apply_user_update(updated_user)
     
-    return {"message": "Status updated successfully"}
+    return {"message": "Status updated successfully", "user": serialize_user(updated_user)}
 
-@app.get("/api/professionals")
-async def get_professionals(category: Optional[str] = None):
-    filter_query = {"professional_mode": True}
-    
-    if category:
-        filter_query["category"] = category
+@app.get("/api/professionals", dependencies=[Depends(warmed_up)])
+async def get_professionals(
+    category: Optional[str] = None,
+    q: Optional[str] = None,
+    status_filter: Optional[UserStatus] = Query(None, alias="status"),
+    sort: str = "default",
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=100),
+):
+    if sort not in ORDERS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(ORDERS)}")
     
-    # Include all professionals (online, busy, offline) - removed status filter
-    professionals = await db.users.find(filter_query).to_list(100)
+    # Served from the in-process directory: no query and no serialization per request
+    if q:
+        # Relevance-ranked, so another order cannot apply
+        if sort != "default":
+            raise HTTPException(status_code=400, detail="sort cannot be combined with q")
+        where = None
+        if status_filter:
+            where = lambda user_id: directory.status_of(user_id) == status_filter.value
+        total, user_ids = search_index.search(q, category, offset, limit, where=where)
+        payloads = directory.get_many(user_ids)
+    else:
+        # Include all professionals (online, busy, offline) unless ?status= is given
+        total, payloads = directory.page(
+            category, status_filter.value if status_filter else None, sort, offset, limit)
     
-    return [serialize_user(prof) for prof in professionals]
+    return Response(json_array(payloads), media_type="application/json", headers={"X-Total-Count": str(total)})
 
-@app.post("/api/call/initiate")
-async def initiate_call(call_request: CallRequest, current_user: dict = Depends(get_current_user)):
-    # Check if professional exists and is online
-    professional = await db.users.find_one({"_id": ObjectId(call_request.professional_id)})
-    if not professional:
-        raise HTTPException(status_code=404, detail="Professional not found")
-    
-    if professional["status"] != "online":
-        raise HTTPException(status_code=400, detail="Professional is not available")
-    
+async def start_call(caller: dict, professional_id: str) -> Tuple[str, dict]:
+    """Reserve an online professional, place a pending call and ring them."""
     # Check user balance
-    if current_user.get("token_balance", 0) < 10:  # Minimum 10 tokens to start call
+    if caller.get("token_balance", 0) < 10:  # Minimum 10 tokens to start call
         raise HTTPException(status_code=400, detail="Insufficient tokens")
     
+    # Reserve in one conditional write so concurrent callers cannot both get online -> busy
+    professional = await storage.users.transition_status(professional_id, "online", "busy")
+    if not professional:
+        if not await storage.users.get(professional_id):
+            raise HTTPException(status_code=404, detail="Professional not found")
+        raise HTTPException(status_code=400, detail="Professional is not available")
+    apply_user_update(professional)
+    
     # Create call record
     call_data = {
-        "caller_id": str(current_user["_id"]),
-        "callee_id": call_request.professional_id,
+        "caller_id": str(caller["_id"]),
+        "callee_id": professional_id,
         "status": "pending",
+        # Price is fixed when the call is placed so settlement needs no extra lookup
+        "price_per_minute": professional.get("price_per_minute", DEFAULT_PRICE_PER_MINUTE),
         "created_at": datetime.utcnow()
     }
     
-    result = await db.calls.insert_one(call_data)
-    call_id = str(result.inserted_id)
-    
-    # Update professional status to busy
-    await db.users.update_one(
-        {"_id": ObjectId(call_request.professional_id)},
-        {"$set": {"status": "busy"}}
-    )
+    try:
+        call_id = await storage.calls.create(call_data)
+    except Exception:
+        # Compensate: release the reservation so the professional is not stuck busy
+        apply_user_update(await storage.users.transition_status(professional_id, "busy", "online"))
+        raise
+    call_registry.add(call_data)
     
     # Notify professional via WebSocket
-    await manager.send_to_user(call_request.professional_id, {
+    await manager.send_to_user(professional_id, {
         "type": "call_request",
         "call_id": call_id,
-        "caller": serialize_user(current_user)
+        "caller": serialize_user(caller)
     })
     
-    return {"call_id": call_id, "status": "pending"}
+    return call_id, professional
 
-@app.post("/api/call/{call_id}/accept")
-async def accept_call(call_id: str, current_user: dict = Depends(get_current_user)):
-    call = await db.calls.find_one({"_id": ObjectId(call_id)})
+async def idempotent(key: Optional[str], operation: str, payload: dict, current_user: dict,
+                     response: Response, handler) -> dict:
+    """``handler()``'s response, or the stored one when the client retries with the same key."""
+    if key is None:
+        return await handler()
+    if not 0 < len(key) <= MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+    # Scoped per user and operation so keys from different clients never collide
+    try:
+        body, replayed = await idempotency_keys.run(
+            f"{current_user['_id']}:{operation}:{key}", payload, handler)
+    except KeyReused:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return body
+
+@app.post("/api/call/initiate", dependencies=[Depends(warmed_up)])
+async def initiate_call(
+    call_request: CallRequest,
+    response: Response,
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    async def initiate():
+        call_id, _ = await start_call(current_user, call_request.professional_id)
+        return {"call_id": call_id, "status": "pending"}
+    
+    return await idempotent(idempotency_key, "call.initiate", call_request.model_dump(), current_user, response,
+                            initiate)
+
+# "Call next available professional" matchmaking
+async def match_caller(caller: WaitingCaller, professional_id: str) -> Optional[str]:
+    caller_id = str(caller.user["_id"])
+    # The balance may have changed while they waited
+    user = await storage.users.get(caller_id)
+    if not user or user.get("token_balance", 0) < 10:
+        raise MatchFailed("Insufficient tokens")
+    try:
+        call_id, professional = await start_call(user, professional_id)
+    except HTTPException:
+        return None  # Professional went offline or busy since becoming available
+    await manager.send_to_user(caller_id, {
+        "type": "call_matched",
+        "call_id": call_id,
+        "professional": serialize_user(professional)
+    })
+    return call_id
+
+async def notify_if_connected(user_id: str, message: dict):
+    # Queue updates are only useful live; do not fill the offline queue with them
+    if manager.is_connected(user_id):
+        await manager.send_to_user(user_id, message)
+
+matchmaker = Matchmaker(
+    on_match=match_caller,
+    notify=notify_if_connected,
+    position_interval=MATCH_POSITION_INTERVAL,
+    max_wait=MATCH_MAX_WAIT_SECONDS,
+)
+
+metrics.registry.gauge_func(
+    "matchmaking_waiting_callers", "Callers waiting for the next available professional",
+    lambda: matchmaker.waiting_count())
+metrics.registry.gauge_func(
+    "matchmaking_available_professionals", "Online professionals not in a call",
+    lambda: matchmaker.available_count())
+
+@app.post("/api/call/request", dependencies=[Depends(warmed_up)])
+async def request_call(category: str, current_user: dict = Depends(get_current_user)):
+    if category not in PROFESSIONAL_CATEGORIES:
+        raise HTTPException(status_code=400, detail="Categoria deve ser 'Médico' ou 'Psicólogo'")
+    if current_user.get("token_balance", 0) < 10:
+        raise HTTPException(status_code=400, detail="Insufficient tokens")
+    
+    # Matched asynchronously; the caller gets queue_position and call_matched over the WebSocket
+    position, waiting = matchmaker.enqueue(current_user, category)
+    return {"status": "queued", "category": category, "position": position, "waiting": waiting}
+
+@app.get("/api/call/request", dependencies=[Depends(warmed_up)])
+async def get_call_request(current_user: dict = Depends(get_current_user)):
+    position, waiting = matchmaker.position(current_user["id"])
+    return {"status": "queued" if position else "none", "position": position, "waiting": waiting}
+
+@app.delete("/api/call/request", dependencies=[Depends(warmed_up)])
+async def cancel_call_request(current_user: dict = Depends(get_current_user)):
+    if not matchmaker.cancel(current_user["id"]):
+        raise HTTPException(status_code=404, detail="No queued call request")
+    return {"message": "Call request cancelled"}
+
+async def load_call(call_id: str, user_id: str, participants: List[str]) -> dict:
+    """The call as seen by one of ``participants``; 404 or 403 otherwise.
+    
+    Open calls come from the registry; settled ones and calls placed through
+    another worker from storage."""
+    call = call_registry.get(call_id) or await storage.calls.get(call_id)
     if not call:
         raise HTTPException(status_code=404, detail="Call not found")
-    
-    if call["callee_id"] != str(current_user["_id"]):
+    if user_id not in [call[field] for field in participants]:
         raise HTTPException(status_code=403, detail="Unauthorized")
-    
-    # Update call status
-    await db.calls.update_one(
-        {"_id": ObjectId(call_id)},
-        {"$set": {"status": "active", "started_at": datetime.utcnow()}}
-    )
+    return call
+
+async def expire_unanswered_call(call: dict):
+    """Cancel a call nobody picked up within CALL_RING_TIMEOUT and free the professional."""
+    call_id = str(call["_id"])
+    await call_registry.flush(call_id)
+    # Conditional, so an accept that reached storage first wins
+    if not await storage.calls.cancel_pending(call_id, datetime.utcnow()):
+        return
+    apply_user_update(await storage.users.transition_status(call["callee_id"], "busy", "online"))
+    for user_id in (call["caller_id"], call["callee_id"]):
+        await manager.send_to_user(user_id, {
+            "type": "call_ended",
+            "call_id": call_id,
+            "duration": 0,
+            "cost": 0,
+            "reason": "unanswered"
+        })
+
+async def store_accept(call_id: str, callee_id: str, started_at: datetime):
+    if not await storage.calls.accept(call_id, callee_id, started_at):
+        logger.error("Call %s was accepted but is no longer pending in storage", call_id,
+                     extra={"event": "call.accept_lost", "call_id": call_id})
+
+@app.post("/api/call/{call_id}/accept", dependencies=[Depends(warmed_up)])
+async def accept_call(call_id: str, current_user: dict = Depends(get_current_user)):
+    user_id = str(current_user["_id"])
+    started_at = datetime.utcnow()
+    if call_id in call_registry:
+        # Accepted in memory; storage catches up in the background, in order with the call's writes
+        call = call_registry.accept(call_id, user_id, started_at)
+        if call:
+            call_registry.persist(call_id, lambda: store_accept(call_id, user_id, started_at))
+    else:
+        call = await storage.calls.accept(call_id, user_id, started_at)
+    if not call:
+        await load_call(call_id, user_id, ["callee_id"])
+        raise HTTPException(status_code=400, detail="Call is not pending")
     
     # Notify caller
     await manager.send_to_user(call["caller_id"], {
@@ -382,60 +894,59 @@ async def accept_call(call_id: str, current_user: dict = Depends(get_current_use
     
     return {"message": "Call accepted"}
 
-@app.post("/api/call/{call_id}/end")
-async def end_call(call_id: str, current_user: dict = Depends(get_current_user)):
-    call = await db.calls.find_one({"_id": ObjectId(call_id)})
-    if not call:
-        raise HTTPException(status_code=404, detail="Call not found")
-    
+@app.post("/api/call/{call_id}/end", dependencies=[Depends(warmed_up)])
+async def end_call(
+    call_id: str,
+    response: Response,
+    current_user: dict = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    return await idempotent(idempotency_key, "call.end", {"call_id": call_id}, current_user, response,
+                            lambda: settle_call(call_id, current_user))
+
+async def settle_call(call_id: str, current_user: dict) -> dict:
     user_id = str(current_user["_id"])
-    if user_id not in [call["caller_id"], call["callee_id"]]:
+    open_call = call_registry.get(call_id)
+    if open_call and user_id not in (open_call["caller_id"], open_call["callee_id"]):
         raise HTTPException(status_code=403, detail="Unauthorized")
     
-    # Calculate duration and cost
-    duration = 0
-    cost = 0
-    if call.get("started_at"):
-        duration = (datetime.utcnow() - call["started_at"]).total_seconds() / 60  # minutes
-        
-        # Get professional's price
-        professional = await db.users.find_one({"_id": ObjectId(call["callee_id"])})
-        price_per_minute = professional.get("price_per_minute", 5)
-        cost = max(10, int(duration * price_per_minute))  # Minimum 10 tokens
-    
-    # Update call record
-    await db.calls.update_one(
-        {"_id": ObjectId(call_id)},
-        {
-            "$set": {
-                "status": "ended",
-                "ended_at": datetime.utcnow(),
-                "duration_minutes": duration,
-                "cost_tokens": cost
-            }
+    # Settlement moves tokens, so it runs against storage once the call's queued writes have landed
+    await call_registry.flush(call_id)
+    
+    # End the call and compute duration and cost in one round-trip. The registry's
+    # accept time covers a write-behind accept that failed to persist
+    call = await storage.calls.end(call_id, user_id, datetime.utcnow(),
+                                   started_at=open_call.get("started_at") if open_call else None)
+    call_registry.remove(call_id)
+    if not call:
+        # Already settled: report the stored outcome instead of charging twice
+        call = await load_call(call_id, user_id, ["caller_id", "callee_id"])
+        return {
+            "message": "Call ended",
+            "duration": call.get("duration_minutes", 0),
+            "cost": call.get("cost_tokens", 0)
         }
-    )
+    
+    duration = call["duration_minutes"]
+    cost = call["cost_tokens"]
     
     # Transfer tokens
     if cost > 0:
         # Deduct from caller
-        await db.users.update_one(
-            {"_id": ObjectId(call["caller_id"])},
-            {"$inc": {"token_balance": -cost}}
-        )
-        
-        # Add to professional (minus platform fee)
-        professional_earning = int(cost * 0.85)  # 15% platform fee
-        await db.users.update_one(
-            {"_id": ObjectId(call["callee_id"])},
-            {"$inc": {"token_balance": professional_earning}}
-        )
+        apply_user_update(await storage.users.adjust_balance(call["caller_id"], -cost))
     
-    # Update professional status back to online
-    await db.users.update_one(
-        {"_id": ObjectId(call["callee_id"])},
-        {"$set": {"status": "online"}}
-    )
+    # Add to professional (minus platform fee) and put them back online
+    earning = professional_earning(cost)
+    apply_user_update(
+        await storage.users.adjust_balance(call["callee_id"], earning, status="online"))
+    
+    if cost > 0:
+        # Tokens have moved; a lost rollup increment must not fail the request
+        try:
+            await storage.earnings.record(
+                call["callee_id"], call["ended_at"].strftime("%Y-%m-%d"), duration, cost, earning)
+        except Exception:
+            logger.exception("Could not record earnings for call %s", call_id)
     
     # Notify both parties
     other_user_id = call["callee_id"] if user_id == call["caller_id"] else call["caller_id"]
@@ -448,15 +959,42 @@ async def end_call(call_id: str, current_user: dict = Depends(get_current_user))
     
     return {"message": "Call ended", "duration": duration, "cost": cost}
 
+@app.get("/api/call/{call_id}", dependencies=[Depends(warmed_up)])
+async def get_call(call_id: str, current_user: dict = Depends(get_current_user)):
+    call = await load_call(call_id, str(current_user["_id"]), ["caller_id", "callee_id"])
+    if call["status"] in ("pending", "active"):
+        # Metered live: what settlement would charge if the call ended now
+        usage = CallRegistry.meter(call, datetime.utcnow())
+    else:
+        usage = {"duration": call.get("duration_minutes", 0), "cost": call.get("cost_tokens", 0)}
+    call["id"] = str(call.pop("_id"))
+    return {**call, **usage}
+
+@app.get("/api/me/earnings")
+async def get_earnings(
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    current_user: dict = Depends(get_current_user),
+):
+    """Daily earnings between two UTC dates, inclusive; the last 30 days by default."""
+    to_date = to_date or datetime.utcnow().date()
+    from_date = from_date or to_date - timedelta(days=29)
+    if from_date > to_date:
+        raise HTTPException(status_code=400, detail="from must not be after to")
+    if (to_date - from_date).days >= EARNINGS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range is limited to {EARNINGS_MAX_DAYS} days")
+    
+    # One rollup document per day with calls, not one per call
+    days = await storage.earnings.list_range(current_user["id"], from_date.isoformat(), to_date.isoformat())
+    for day in days:
+        day.pop("professional_id", None)
+    totals = {field: sum(day[field] for day in days) for field in ("minutes", "calls", "gross", "net")}
+    return {"from": from_date.isoformat(), "to": to_date.isoformat(), "days": days, "totals": totals}
+
 @app.get("/api/calls")
 async def get_calls(current_user: dict = Depends(get_current_user)):
     user_id = str(current_user["_id"])
-    calls = await db.calls.find({
-        "$or": [
-            {"caller_id": user_id},
-            {"callee_id": user_id}
-        ]
-    }).sort("created_at", -1).limit(20).to_list(20)
+    calls = await storage.calls.list_for_user(user_id, limit=20)
     
     for call in calls:
         call["id"] = str(call["_id"])
@@ -464,15 +1002,53 @@ async def get_calls(current_user: dict = Depends(get_current_user)):
     
     return calls
 
+@app.get("/api/admin/exports/calls")
+async def export_calls(
+    from_date: date = Query(..., alias="from"),
+    to_date: date = Query(..., alias="to"),
+    export_format: str = Query("ndjson", alias="format"),
+    gzip: bool = False,
+    admin: dict = Depends(get_admin_user),
+):
+    """Calls created between two UTC dates, inclusive, streamed straight from the cursor."""
+    if export_format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(FORMATS)}")
+    if from_date > to_date:
+        raise HTTPException(status_code=400, detail="from must not be after to")
+    
+    start = datetime.combine(from_date, datetime.min.time())
+    end = datetime.combine(to_date + timedelta(days=1), datetime.min.time())
+    filename = f"calls-{from_date.isoformat()}-{to_date.isoformat()}.{export_format}" + (".gz" if gzip else "")
+    logger.info("Call export %s by %s", filename, admin["id"],
+                extra={"event": "export.calls", "user_id": admin["id"]})
+    return StreamingResponse(
+        stream_calls(storage.calls.iter_created_between(start, end), export_format, compress=gzip),
+        # A gzip file to download, not a transfer encoding the client would undo
+        media_type="application/gzip" if gzip else FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
 # WebSocket for signaling
 @app.websocket("/api/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
+    # Startup reconciliation would mark a socket opened before it offline
+    if not readiness.warmed:
+        await websocket.close(code=1013)  # Try again later
+        return
     connection_id = await manager.connect(websocket, user_id)
+    if connection_id is None:
+        return
     
     try:
         while True:
             data = await websocket.receive_text()
+            manager.touch(connection_id, user_id)
             message = json.loads(data)
+            metrics.ws_messages.inc("in", message_type_label(message))
+            
+            # Heartbeat replies only need to refresh last_seen
+            if message["type"] == "pong":
+                continue
             
             # Handle WebRTC signaling
             if message["type"] in ["offer", "answer", "ice-candidate"]:
@@ -506,10 +1082,8 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
                     })
                     
     except WebSocketDisconnect:
-        manager.disconnect(connection_id, user_id)
-        
-        # Update user status to offline
-        await db.users.update_one(
-            {"_id": ObjectId(user_id)},
-            {"$set": {"status": "offline"}}
-        )
\ No newline at end of file
+        pass
+    finally:
+        # Once per connection: a reaped socket was already cleaned up by the heartbeat
+        if manager.release(connection_id, user_id):
+            await handle_disconnect(connection_id, user_id)
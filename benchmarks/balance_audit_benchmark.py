@@ -0,0 +1,137 @@
+"""Speed of the vectorized balance audit against a per-call Python loop.
+
+Fills the memory engine with ``--users`` users and ``--calls`` ended calls
+settled the way end_call does, so every balance matches its history;
+``--legacy`` of them carry no price and were billed at the callee's profile
+price, like calls from before prices were stored. Then it breaks ``--errors``
+balances, and ``--errors`` calls get a wrong stored cost that was also what
+moved the tokens. It times ``balance_audit.audit`` against the obvious loop
+over the same calls. Both must find exactly the broken balances and count
+exactly the wrong costs:
+
+    python benchmarks/balance_audit_benchmark.py --users 100000 --calls 2000000
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from common import emit, use_backend_modules
+
+use_backend_modules()
+from balance_audit import audit  # noqa: E402
+from billing import DEFAULT_PRICE_PER_MINUTE, SIGNUP_TOKENS, call_cost, professional_earning  # noqa: E402
+from repositories import InMemoryStorage  # noqa: E402
+
+
+async def populate(storage, args, rng: random.Random) -> set:
+    user_ids = [ObjectId() for _ in range(args.users)]
+    professionals = [str(oid) for oid in user_ids[:max(1, args.users // 10)]]
+    profile_prices = {professional: rng.randint(1, 30) for professional in professionals}
+    balances = dict.fromkeys((str(oid) for oid in user_ids), SIGNUP_TOKENS)
+    started = datetime(2024, 1, 1)
+    calls = storage.calls._calls
+    wrong_costs = set(rng.sample(range(args.calls), args.errors))
+    for i in range(args.calls):
+        caller_id = str(rng.choice(user_ids))
+        callee_id = rng.choice(professionals)
+        duration = rng.uniform(0.1, 30)
+        legacy = rng.random() < args.legacy
+        price = profile_prices[callee_id] if legacy else rng.randint(1, 30)
+        # A wrong stored cost is what settlement charged, so balances follow it
+        cost = call_cost(duration, price) + (i in wrong_costs)
+        balances[caller_id] -= cost
+        balances[callee_id] += professional_earning(cost)
+        oid = ObjectId()
+        # Straight into the engine's dict: create() would also index by participant
+        calls[oid] = {
+            "_id": oid, "caller_id": caller_id, "callee_id": callee_id, "status": "ended",
+            "started_at": started, "ended_at": started + timedelta(minutes=duration),
+            "duration_minutes": duration, "cost_tokens": cost,
+        }
+        if not legacy:
+            calls[oid]["price_per_minute"] = price
+
+    broken_users = set(rng.sample(sorted(balances), args.errors))
+    for user_id in broken_users:
+        balances[user_id] += rng.choice([-1, 1]) * rng.randint(1, 500)
+    for oid in user_ids:
+        user = {"_id": oid, "email": str(oid), "token_balance": balances[str(oid)], "price_per_minute": 1}
+        if str(oid) in profile_prices:
+            user["price_per_minute"] = profile_prices[str(oid)]
+        await storage.users.create(user)
+    return broken_users
+
+
+async def python_loop(storage) -> dict:
+    balances = {}
+    prices = {}
+    async for batch in storage.users.iter_balance_batches():
+        for user in batch:
+            balances[str(user["_id"])] = user["token_balance"]
+            prices[str(user["_id"])] = user.get("price_per_minute")
+    debits = defaultdict(int)
+    credits = defaultdict(int)
+    cost_mismatches = 0
+    async for batch in storage.calls.iter_ended_batches():
+        for call in batch:
+            price = call.get("price_per_minute") or prices.get(call["callee_id"]) or DEFAULT_PRICE_PER_MINUTE
+            cost = call_cost(call["duration_minutes"], price) if call.get("started_at") else 0
+            cost_mismatches += cost != call["cost_tokens"]
+            debits[call["caller_id"]] += call["cost_tokens"]
+            credits[call["callee_id"]] += professional_earning(call["cost_tokens"])
+    off = {user_id for user_id, balance in balances.items()
+           if balance != SIGNUP_TOKENS - debits[user_id] + credits[user_id]}
+    return {"cost_mismatches": cost_mismatches, "users": off}
+
+
+async def main(args) -> dict:
+    storage = InMemoryStorage(latency_ms=0)
+    rng = random.Random(3)
+    started = time.perf_counter()
+    broken_users = await populate(storage, args, rng)
+    print(f"Populated {args.calls} calls in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    result = await audit(storage, args.chunk_size)
+    vectorized = time.perf_counter() - started
+    found = set(result["discrepancies"]["user_id"])
+
+    started = time.perf_counter()
+    loop = await python_loop(storage)
+    looped = time.perf_counter() - started
+
+    summary = result["summary"]
+    return {
+        "benchmark": "balance_audit",
+        "users": args.users,
+        "calls": args.calls,
+        "chunk_size": args.chunk_size,
+        "vectorized_s": round(vectorized, 2),
+        "vectorized_calls_per_s": round(args.calls / vectorized),
+        "python_loop_s": round(looped, 2),
+        "python_loop_calls_per_s": round(args.calls / looped),
+        "injected_errors": args.errors,
+        "vectorized_found_users": len(found),
+        "vectorized_exact": found == broken_users and summary["cost_mismatches"] == args.errors,
+        "vectorized_cost_mismatches": summary["cost_mismatches"],
+        "loop_found_users": len(loop["users"]),
+        "loop_exact": loop["users"] == broken_users and loop["cost_mismatches"] == args.errors,
+        "loop_cost_mismatches": loop["cost_mismatches"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--calls", type=int, default=2000000)
+    parser.add_argument("--errors", type=int, default=50)
+    parser.add_argument("--legacy", type=float, default=0.2, help="Fraction of calls without a stored price")
+    parser.add_argument("--chunk-size", type=int, default=100000)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+    emit(asyncio.run(main(args)), args.output)
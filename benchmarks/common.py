@@ -0,0 +1,41 @@
+"""Helpers shared by the benchmark scripts in this directory."""
+import json
+import os
+import sys
+from typing import Dict, List, Sequence
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+
+
+def use_backend_modules():
+    """Make backend/ importable the same way the Docker image lays it out."""
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    """Latencies in seconds -> count, throughput and p50/p95/p99 in milliseconds."""
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "throughput_per_s": round(len(values) / elapsed, 1) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+def emit(result: dict, output: str = ""):
+    text = json.dumps(result, indent=2, default=str)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    print(text)
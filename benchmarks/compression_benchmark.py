@@ -0,0 +1,182 @@
+"""CPU cost versus bytes saved for REST and WebSocket compression settings.
+
+REST payloads (a 100-entry professionals listing and a 50-entry call history)
+are compressed once per response at each gzip level and brotli quality, and
+through CompressionMiddleware with its precompressed cache hit. WebSocket
+payloads (SDP offers, ICE candidates, chat) are run through a raw-deflate
+stream with context takeover, the same way permessage-deflate compresses
+consecutive frames, at the window sizes serve.py can negotiate:
+
+    python benchmarks/compression_benchmark.py --iterations 2000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+import zlib
+
+from common import emit, use_backend_modules
+
+use_backend_modules()
+from compression import CompressionMiddleware, compress, supported_encodings  # noqa: E402
+
+CATEGORIES = ["psychologist", "life_coach"]
+STATUSES = ["online", "busy", "offline"]
+
+
+def professionals_payload(count: int) -> bytes:
+    rng = random.Random(1)
+    return json.dumps([
+        {
+            "id": uuid.UUID(int=rng.getrandbits(96)).hex[:24],
+            "name": f"Professional {i}",
+            "email": f"pro{i}@example.com",
+            "role": "professional",
+            "status": rng.choice(STATUSES),
+            "category": rng.choice(CATEGORIES),
+            "price_per_minute": rng.randint(2, 20),
+            "token_balance": rng.randint(0, 5000),
+            "professional_mode": True,
+            "description": "Licensed practitioner with %d years of experience in %s sessions."
+                           % (rng.randint(1, 30), rng.choice(CATEGORIES)),
+            "profile_photo": None,
+        }
+        for i in range(count)
+    ]).encode()
+
+
+def calls_payload(count: int) -> bytes:
+    rng = random.Random(2)
+    return json.dumps([
+        {
+            "_id": uuid.UUID(int=rng.getrandbits(96)).hex[:24],
+            "caller_id": uuid.UUID(int=rng.getrandbits(96)).hex[:24],
+            "callee_id": uuid.UUID(int=rng.getrandbits(96)).hex[:24],
+            "call_type": rng.choice(["audio", "video"]),
+            "status": "ended",
+            "created_at": "2024-05-01T12:%02d:00" % (i % 60),
+            "duration": rng.randint(30, 3600),
+            "cost": rng.randint(10, 500),
+        }
+        for i in range(count)
+    ]).encode()
+
+
+def sdp_frame(rng: random.Random) -> bytes:
+    lines = ["v=0", f"o=- {rng.getrandbits(62)} 2 IN IP4 127.0.0.1", "s=-", "t=0 0",
+             "a=group:BUNDLE 0 1", "a=msid-semantic: WMS"]
+    for media, port in (("audio", 9), ("video", 9)):
+        lines += [f"m={media} {port} UDP/TLS/RTP/SAVPF 111 63 103 104 9 0 8 106 105 13 110 112 113 126",
+                  "c=IN IP4 0.0.0.0", "a=rtcp:9 IN IP4 0.0.0.0",
+                  f"a=ice-ufrag:{uuid.UUID(int=rng.getrandbits(128)).hex[:4]}",
+                  f"a=ice-pwd:{uuid.UUID(int=rng.getrandbits(128)).hex}",
+                  "a=fingerprint:sha-256 " + ":".join("%02X" % rng.getrandbits(8) for _ in range(32)),
+                  "a=setup:actpass", "a=rtcp-mux", "a=rtpmap:111 opus/48000/2",
+                  "a=fmtp:111 minptime=10;useinbandfec=1", "a=rtcp-fb:111 transport-cc"]
+    return json.dumps({"type": "offer", "call_id": uuid.UUID(int=rng.getrandbits(96)).hex[:24],
+                       "sdp": {"type": "offer", "sdp": "\r\n".join(lines) + "\r\n"}}).encode()
+
+
+def websocket_frames(count: int) -> list:
+    rng = random.Random(3)
+    frames = []
+    for i in range(count):
+        kind = i % 10
+        if kind == 0:
+            frames.append(sdp_frame(rng))
+        elif kind < 6:
+            frames.append(json.dumps({"type": "ice_candidate", "candidate": {
+                "candidate": f"candidate:{rng.getrandbits(32)} 1 udp {rng.getrandbits(31)} "
+                             f"192.168.{rng.randint(0, 255)}.{rng.randint(0, 255)} {rng.randint(1024, 65535)} "
+                             "typ host generation 0 network-id 1",
+                "sdpMid": "0", "sdpMLineIndex": 0}}).encode())
+        else:
+            frames.append(json.dumps({"type": "chat_message", "from": "user", "text":
+                                      "Thanks, see you at the same time next week."}).encode())
+    return frames
+
+
+def time_codec(body: bytes, encoding: str, level: int, iterations: int) -> dict:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        output = compress(body, encoding, gzip_level=level, brotli_quality=level)
+    elapsed = time.perf_counter() - started
+    return {"encoding": encoding, "level": level, "bytes_in": len(body), "bytes_out": len(output),
+            "ratio": round(len(body) / len(output), 2), "us_per_op": round(elapsed / iterations * 1e6, 1)}
+
+
+async def time_middleware_cache(body: bytes, iterations: int) -> dict:
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+
+    middleware = CompressionMiddleware(app, cacheable_paths=["/api/professionals"])
+    scope = {"type": "http", "method": "GET", "path": "/api/professionals",
+             "headers": [(b"accept-encoding", b"gzip, deflate, br")]}
+
+    async def send(message):
+        pass
+
+    await middleware(scope, None, send)  # Fill the cache
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await middleware(scope, None, send)
+    elapsed = time.perf_counter() - started
+    return {"encoding": middleware.encodings[0], "level": "cached", "bytes_in": len(body),
+            "us_per_op": round(elapsed / iterations * 1e6, 1)}
+
+
+def time_permessage_deflate(frames: list, level: int, window_bits: int, rounds: int) -> dict:
+    bytes_in = bytes_out = 0
+    started = time.perf_counter()
+    for _ in range(rounds):
+        # One compressor per connection, reused across frames (context takeover)
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -window_bits, 5)
+        for frame in frames:
+            data = compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            bytes_in += len(frame)
+            bytes_out += len(data) - 4  # permessage-deflate drops the 00 00 ff ff tail
+    elapsed = time.perf_counter() - started
+    count = rounds * len(frames)
+    return {"level": level, "window_bits": window_bits, "frames": count,
+            "ratio": round(bytes_in / bytes_out, 2), "us_per_frame": round(elapsed / count * 1e6, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--professionals", type=int, default=100)
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+
+    rest = {}
+    for name, body in (("professionals", professionals_payload(args.professionals)),
+                       ("calls", calls_payload(args.calls))):
+        rows = [time_codec(body, "gzip", level, args.iterations) for level in (1, 6, 9)]
+        if "br" in supported_encodings():
+            rows += [time_codec(body, "br", quality, args.iterations) for quality in (1, 4, 11)]
+        rows.append(asyncio.run(time_middleware_cache(body, args.iterations)))
+        rest[name] = rows
+        for row in rows:
+            print(f"{name:<14} {row['encoding']:<5} {row['level']!s:<7} {row['us_per_op']:>9} us"
+                  f"  ratio {row.get('ratio', '-')}")
+
+    frames = websocket_frames(args.frames)
+    rounds = max(1, args.iterations // 100)
+    websocket = [time_permessage_deflate(frames, level, bits, rounds)
+                 for bits in (9, 12, 15) for level in (1, 6)]
+    for row in websocket:
+        print(f"ws deflate level {row['level']} window 2^{row['window_bits']:<3}"
+              f"{row['us_per_frame']:>8} us/frame  ratio {row['ratio']}")
+
+    emit({"benchmark": "compression", "encodings": list(supported_encodings()),
+          "rest": rest, "websocket": websocket}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Memory and throughput of the streaming call export.
+
+Feeds synthetic call documents through ``exports.stream_calls`` for each
+format, with and without gzip, at growing row counts. Python heap peak is
+tracked with tracemalloc; a constant peak across row counts means the export
+does not grow with its size. The ``to_list`` row shows what loading the
+calls first would cost:
+
+    python benchmarks/export_benchmark.py --rows 10000 100000 1000000
+"""
+import argparse
+import asyncio
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from common import emit, use_backend_modules
+
+use_backend_modules()
+from exports import FORMATS, stream_calls  # noqa: E402
+
+START = datetime(2024, 1, 1)
+
+
+async def synthetic_calls(count: int):
+    rng = random.Random(7)
+    callers = [str(ObjectId()) for _ in range(1000)]
+    professionals = [str(ObjectId()) for _ in range(100)]
+    for i in range(count):
+        created = START + timedelta(seconds=i * 3)
+        started = created + timedelta(seconds=rng.randint(2, 30))
+        duration = rng.uniform(0.5, 40)
+        price = rng.randint(1, 30)
+        yield {
+            "_id": ObjectId(), "caller_id": rng.choice(callers), "callee_id": rng.choice(professionals),
+            "status": "ended", "price_per_minute": price, "created_at": created, "started_at": started,
+            "ended_at": started + timedelta(minutes=duration), "duration_minutes": duration,
+            "cost_tokens": max(10, int(duration * price)),
+        }
+
+
+async def generate_only(count: int) -> float:
+    started = time.perf_counter()
+    async for _ in synthetic_calls(count):
+        pass
+    return time.perf_counter() - started
+
+
+async def run_stream(count: int, fmt: str, compress: bool, generate_seconds: float) -> dict:
+    # Timed untraced; tracemalloc slows allocation-heavy code several times over
+    written = 0
+    started = time.perf_counter()
+    async for chunk in stream_calls(synthetic_calls(count), fmt, compress):
+        written += len(chunk)
+    encode_seconds = time.perf_counter() - started - generate_seconds
+
+    tracemalloc.start()
+    async for chunk in stream_calls(synthetic_calls(count), fmt, compress):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"encode_rows_per_s": round(count / encode_seconds), "bytes": written,
+            "peak_heap_mb": round(peak / 2**20, 2)}
+
+
+async def run_to_list(count: int) -> dict:
+    tracemalloc.start()
+    calls = [call async for call in synthetic_calls(count)]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del calls
+    return {"peak_heap_mb": round(peak / 2**20, 2)}
+
+
+async def main(args) -> dict:
+    results = []
+    for count in args.rows:
+        # Generating the synthetic documents is subtracted from the encode rate
+        generate_seconds = await generate_only(count)
+        for fmt in FORMATS:
+            for compress in (False, True):
+                result = {"rows": count, "format": fmt, "gzip": compress,
+                          **await run_stream(count, fmt, compress, generate_seconds)}
+                print(f"{count:>9} {fmt:<6} gzip={compress!s:<5} {result['encode_rows_per_s']:>8} rows/s"
+                      f"  peak {result['peak_heap_mb']:>7} MB  {result['bytes']:>11} bytes")
+                results.append(result)
+        if count <= args.to_list_max:
+            result = {"rows": count, "format": "to_list", **await run_to_list(count)}
+            print(f"{count:>9} to_list                  peak {result['peak_heap_mb']:>7} MB")
+            results.append(result)
+    return {"benchmark": "export", "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--to-list-max", type=int, default=100000, help="Largest count to also load with to_list")
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+    emit(asyncio.run(main(args)), args.output)
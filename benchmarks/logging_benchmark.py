@@ -0,0 +1,108 @@
+"""Connect/disconnect throughput of ConnectionManager under each logging setup.
+
+Every connect and disconnect logs one line, so under reconnect storms the
+logging path is on the hot path. This runs the same connect/disconnect cycle
+with synchronous text logging (the old ``basicConfig``), the queue-based JSON
+logger, and the queue-based logger with connect/disconnect events sampled.
+
+``--sink-latency-us`` adds a blocking delay to every write, like stderr piped to
+a slow log collector; this is where the queue keeps the event loop moving:
+
+    python benchmarks/logging_benchmark.py --cycles 50000 --sink-latency-us 0,50
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from common import emit, use_backend_modules
+
+use_backend_modules()
+os.environ.setdefault("STORAGE_ENGINE", "memory")
+os.environ.setdefault("LOOP_MONITOR_ENABLED", "false")
+
+from logging_setup import configure_logging  # noqa: E402
+from server import ConnectionManager  # noqa: E402
+
+PROFILES = {
+    "sync_text": {"asynchronous": False, "json_format": False},
+    "queue_json": {"asynchronous": True, "json_format": True},
+    "queue_json_sampled": {"asynchronous": True, "json_format": True,
+                           "sample_rates": {"ws.connect": 0.01, "ws.disconnect": 0.01}},
+}
+
+
+class SlowStream:
+    """File wrapper whose writes block (and release the GIL) like a full pipe."""
+
+    def __init__(self, stream, latency_s: float):
+        self.stream = stream
+        self.latency_s = latency_s
+
+    def write(self, data):
+        time.sleep(self.latency_s)
+        return self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class FakeWebSocket:
+    async def accept(self):
+        pass
+
+    async def send_text(self, data):
+        pass
+
+
+async def run_cycles(cycles: int) -> float:
+    manager = ConnectionManager()
+    websocket = FakeWebSocket()
+    started = time.perf_counter()
+    for i in range(cycles):
+        user_id = f"{i % 1000:024x}"
+        connection_id = await manager.connect(websocket, user_id)
+        manager.disconnect(connection_id, user_id)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cycles", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--log-file", default="", help="Where log lines go; defaults to a temp file")
+    parser.add_argument("--profiles", default=",".join(PROFILES))
+    parser.add_argument("--sink-latency-us", default="0,50", help="Comma separated write delays to test")
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+
+    log_path = args.log_file or os.path.join(tempfile.mkdtemp(), "bench.log")
+    results = []
+    for latency_us in (float(value) for value in args.sink_latency_us.split(",")):
+        for name in args.profiles.split(","):
+            with open(log_path, "w") as file:
+                stream = SlowStream(file, latency_us / 1e6) if latency_us else file
+                listener = configure_logging(stream=stream, **PROFILES[name])
+                best = min(asyncio.run(run_cycles(args.cycles)) for _ in range(args.repeat))
+                handler = logging.getLogger().handlers[0]
+                if listener is not None:
+                    listener.stop()
+            result = {
+                "profile": name,
+                "sink_latency_us": latency_us,
+                "connects_per_s": round(args.cycles / best, 1),
+                "us_per_cycle": round(best / args.cycles * 1e6, 2),
+                "log_bytes": os.path.getsize(log_path),
+                "dropped_records": getattr(handler, "dropped", 0),
+            }
+            results.append(result)
+            print(f"sink={latency_us:>5}us {name:<20} {result['connects_per_s']:>12} connects/s")
+
+    logging.shutdown()
+    emit({"benchmark": "logging", "cycles": args.cycles, "profiles": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
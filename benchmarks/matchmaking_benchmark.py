@@ -0,0 +1,91 @@
+"""Matchmaking cost with thousands of waiting callers.
+
+Drives the Matchmaker directly with in-memory callbacks: queues ``--callers``
+callers, then lets ``--professionals`` professionals take calls that last
+``--call-ms`` each until the queue is empty. Reports enqueue cost, the time of
+one position-update tick over the whole queue, and match throughput:
+
+    python benchmarks/matchmaking_benchmark.py --callers 10000 --professionals 200
+"""
+import argparse
+import asyncio
+import time
+
+from bson import ObjectId
+
+from common import emit, summarize, use_backend_modules
+
+use_backend_modules()
+from matchmaking import Matchmaker  # noqa: E402
+
+CATEGORY = "Psicólogo"
+
+
+async def run(args) -> dict:
+    notifications = 0
+    matches = []
+
+    async def notify(user_id, message):
+        nonlocal notifications
+        notifications += 1
+
+    async def on_match(caller, professional_id):
+        matches.append(time.monotonic() - caller.enqueued_at)
+
+        async def finish_call():
+            await asyncio.sleep(args.call_ms / 1000)
+            matchmaker.set_available(professional_id, CATEGORY, True)
+
+        asyncio.get_running_loop().create_task(finish_call())
+        return str(ObjectId())
+
+    matchmaker = Matchmaker(on_match=on_match, notify=notify, position_interval=3600, max_wait=3600)
+
+    callers = [{"_id": ObjectId()} for _ in range(args.callers)]
+    started = time.perf_counter()
+    for caller in callers:
+        matchmaker.enqueue(caller, CATEGORY)
+    enqueue_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    await matchmaker.tick()
+    first_tick = time.perf_counter() - started
+    sent_first = notifications
+
+    started = time.monotonic()
+    for _ in range(args.professionals):
+        matchmaker.set_available(str(ObjectId()), CATEGORY, True)
+    tick_latencies = []
+    while matchmaker.waiting_count():
+        await asyncio.sleep(0.05)
+        tick_started = time.perf_counter()
+        await matchmaker.tick()
+        tick_latencies.append(time.perf_counter() - tick_started)
+    elapsed = time.monotonic() - started
+
+    return {
+        "callers": args.callers,
+        "professionals": args.professionals,
+        "call_ms": args.call_ms,
+        "enqueue_us": round(enqueue_seconds / args.callers * 1e6, 2),
+        "first_tick_ms": round(first_tick * 1000, 2),
+        "first_tick_notifications": sent_first,
+        "tick": summarize(tick_latencies, sum(tick_latencies)),
+        "matches_per_s": round(len(matches) / elapsed, 1),
+        "notifications": notifications,
+        "wait": summarize(matches, elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--callers", type=int, default=10000)
+    parser.add_argument("--professionals", type=int, default=200)
+    parser.add_argument("--call-ms", type=float, default=50)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+    emit({"benchmark": "matchmaking", **asyncio.run(run(args))}, args.output)
+
+
+if __name__ == "__main__":
+    main()
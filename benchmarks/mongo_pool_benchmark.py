@@ -0,0 +1,88 @@
+"""Effect of the Motor connection pool size on tail latency.
+
+Runs the same mix of indexed reads and writes against a live MongoDB at a fixed
+concurrency for every pool size, and reports p50/p95/p99 per configuration:
+
+    python benchmarks/mongo_pool_benchmark.py --pool-sizes 1,5,10,50,100 --concurrency 200
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from common import emit, summarize, use_backend_modules
+
+use_backend_modules()
+from database import DATABASE_URL, create_client  # noqa: E402
+
+
+async def run_configuration(args, pool_size: int, compressors: str) -> dict:
+    overrides = {"maxPoolSize": pool_size, "minPoolSize": min(pool_size, args.min_pool_size)}
+    if compressors:
+        overrides["compressors"] = compressors
+    client = create_client(args.url, **overrides)
+    collection = client[args.database].pool_benchmark
+    await collection.drop()
+    await collection.insert_many(
+        [{"_id": i, "name": f"user-{i}", "status": "offline", "token_balance": 1000, "bio": "x" * 256}
+         for i in range(args.documents)]
+    )
+
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + args.duration
+
+    async def worker():
+        nonlocal errors
+        while time.monotonic() < deadline:
+            key = random.randrange(args.documents)
+            started = time.perf_counter()
+            try:
+                if random.random() < args.write_ratio:
+                    await collection.update_one({"_id": key}, {"$inc": {"token_balance": 1}})
+                else:
+                    await collection.find_one({"_id": key})
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.monotonic() - started
+
+    await collection.drop()
+    client.close()
+    return {"pool_size": pool_size, "compressors": compressors or "none", "errors": errors,
+            **summarize(latencies, elapsed)}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=DATABASE_URL)
+    parser.add_argument("--database", default="click_online_bench")
+    parser.add_argument("--pool-sizes", default="1,5,10,25,50,100")
+    parser.add_argument("--min-pool-size", type=int, default=0)
+    parser.add_argument("--compressors", default="", help="Comma separated list, e.g. 'none,zstd,zlib'")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--documents", type=int, default=10000)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+
+    compressor_sets = [c for c in args.compressors.split(",") if c] or [""]
+    results = []
+    for compressors in compressor_sets:
+        for pool_size in (int(p) for p in args.pool_sizes.split(",")):
+            result = await run_configuration(args, pool_size, "" if compressors == "none" else compressors)
+            results.append(result)
+            print(f"pool={pool_size:<4} compressors={result['compressors']:<6} "
+                  f"p50={result['p50_ms']}ms p99={result['p99_ms']}ms ops/s={result['throughput_per_s']}")
+
+    emit({"benchmark": "mongo_pool", "concurrency": args.concurrency, "duration_s": args.duration,
+          "results": results}, args.output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,134 @@
+"""Double-booking under contention: 1,000 callers racing for 10 professionals.
+
+Every caller tries to place a call to one of the professionals at the same
+time. Two strategies run against the same storage engine:
+
+* ``read_then_write``: the previous initiate_call, which read the professional,
+  checked ``status == "online"`` in Python and then set ``busy``
+* ``atomic``: ``server.start_call``, which reserves with one conditional
+  ``online -> busy`` write and compensates if the call insert fails
+
+A professional booked by more than one caller is a double booking. The memory
+engine gets a simulated round trip per operation (``--latency-ms``) so requests
+interleave; ``--storage mongo`` runs against MONGO_URL instead:
+
+    python benchmarks/reservation_benchmark.py --callers 1000 --professionals 10 --latency-ms 1
+"""
+import argparse
+import asyncio
+import os
+import time
+from collections import Counter
+from datetime import datetime
+
+from common import emit, summarize, use_backend_modules
+
+use_backend_modules()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--callers", type=int, default=1000)
+    parser.add_argument("--professionals", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--storage", default="memory")
+    parser.add_argument("--latency-ms", type=float, default=1.0)
+    parser.add_argument("--output", default="")
+    return parser.parse_args()
+
+
+args = parse_args()
+os.environ["STORAGE_ENGINE"] = args.storage
+os.environ["MEMORY_STORAGE_LATENCY_MS"] = str(args.latency_ms)
+os.environ.setdefault("LOOP_MONITOR_ENABLED", "false")
+os.environ.setdefault("RECONCILE_ON_STARTUP", "false")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import server  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+
+
+async def read_then_write(caller: dict, professional_id: str) -> str:
+    storage = server.storage
+    professional = await storage.users.get(professional_id)
+    if not professional:
+        raise HTTPException(status_code=404, detail="Professional not found")
+    if professional["status"] != "online":
+        raise HTTPException(status_code=400, detail="Professional is not available")
+    call_id = await storage.calls.create({
+        "caller_id": str(caller["_id"]),
+        "callee_id": professional_id,
+        "status": "pending",
+        "price_per_minute": professional.get("price_per_minute", 5),
+        "created_at": datetime.utcnow(),
+    })
+    await storage.users.set_status(professional_id, "busy")
+    return call_id
+
+
+async def atomic(caller: dict, professional_id: str) -> str:
+    call_id, _ = await server.start_call(caller, professional_id)
+    return call_id
+
+
+STRATEGIES = {"read_then_write": read_then_write, "atomic": atomic}
+
+
+async def run_round(strategy, callers, professional_ids) -> dict:
+    await server.storage.users.set_status_many(professional_ids, "online")
+    booked = Counter()
+    latencies = []
+
+    async def attempt(index: int, caller: dict):
+        professional_id = professional_ids[index % len(professional_ids)]
+        started = time.perf_counter()
+        try:
+            await strategy(caller, professional_id)
+            booked[professional_id] += 1
+        except HTTPException:
+            pass
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(attempt(i, caller) for i, caller in enumerate(callers)))
+    elapsed = time.perf_counter() - started
+    return {
+        "bookings": sum(booked.values()),
+        "double_bookings": sum(count - 1 for count in booked.values() if count > 1),
+        "professionals_booked": len(booked),
+        **summarize(latencies, elapsed),
+    }
+
+
+async def main():
+    results = {}
+    async with server.app.router.lifespan_context(server.app):
+        users = server.storage.users
+        professional_ids = []
+        for i in range(args.professionals):
+            professional_ids.append(await users.create({
+                "name": f"Professional {i}", "email": f"bench-pro-{i}-{time.time_ns()}@example.com",
+                "password": "", "role": "user", "status": "online", "token_balance": 0,
+                "professional_mode": True, "category": "Psicólogo", "price_per_minute": 5,
+            }))
+        callers = []
+        for i in range(args.callers):
+            caller = {"name": f"Caller {i}", "email": f"bench-caller-{i}-{time.time_ns()}@example.com",
+                      "password": "", "role": "user", "status": "online", "token_balance": 1000,
+                      "professional_mode": False}
+            await users.create(caller)
+            callers.append(caller)
+
+        for name, strategy in STRATEGIES.items():
+            rounds = [await run_round(strategy, callers, professional_ids) for _ in range(args.rounds)]
+            results[name] = rounds
+            for result in rounds:
+                print(f"{name:<16} bookings {result['bookings']:>5}  double {result['double_bookings']:>5}"
+                      f"  {result['throughput_per_s']:>9} attempts/s  p99 {result['p99_ms']}ms")
+
+    emit({"benchmark": "reservation", "storage": args.storage, "latency_ms": args.latency_ms,
+          "callers": args.callers, "professionals": args.professionals, "results": results}, args.output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,213 @@
+"""REST load generator for the Click Online API.
+
+Runs a weighted mix of register, login, /api/me, /api/professionals polling and
+the initiate/accept/end call lifecycle at a fixed concurrency, then prints
+throughput and p50/p95/p99 per endpoint as JSON.
+
+By default the real app is run in-process on the in-memory storage engine, so
+nothing else needs to be running:
+
+    python benchmarks/rest_load_benchmark.py --concurrency 100 --duration 30
+
+Point it at a running server instead with ``--url http://localhost:8000``.
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+import httpx
+
+from common import emit, summarize
+
+DEFAULT_MIX = "register=1,login=2,me=30,professionals=50,call=5"
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    async def request(self, client: httpx.AsyncClient, name: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as exc:
+            self.statuses[name][type(exc).__name__] += 1
+            return None
+        self.latencies[name].append(time.perf_counter() - started)
+        self.statuses[name][str(response.status_code)] += 1
+        return response
+
+
+class VirtualUser:
+    """Owns two professional accounts that take turns calling each other, so the
+    call lifecycle never contends with other virtual users and balances last."""
+
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, run_id: str, index: int):
+        self.client = client
+        self.recorder = recorder
+        self.prefix = f"load-{run_id}-{index}"
+        self.accounts = []
+        self.turn = 0
+
+    def auth(self, account: dict) -> dict:
+        return {"Authorization": f"Bearer {account['token']}"}
+
+    async def register(self, name: str):
+        email = f"{self.prefix}-{name}-{uuid.uuid4().hex[:8]}@load.test"
+        response = await self.recorder.request(self.client, "POST /api/register", "POST", "/api/register",
+                                               json={"name": name, "email": email, "password": "load-test"})
+        if response is None or response.status_code != 200:
+            return None
+        data = response.json()
+        return {"email": email, "token": data["access_token"], "id": data["user"]["id"]}
+
+    async def setup(self):
+        for name in ("a", "b"):
+            account = await self.register(name)
+            if account is None:
+                raise RuntimeError("Could not register load test accounts")
+            await self.client.put("/api/profile", json={"professional_mode": True, "price_per_minute": 1},
+                                  headers=self.auth(account))
+            await self.client.put("/api/status", json={"status": "online"}, headers=self.auth(account))
+            self.accounts.append(account)
+
+    async def op_register(self):
+        await self.register("extra")
+
+    async def op_login(self):
+        account = random.choice(self.accounts)
+        await self.recorder.request(self.client, "POST /api/login", "POST", "/api/login",
+                                    json={"email": account["email"], "password": "load-test"})
+
+    async def op_me(self):
+        await self.recorder.request(self.client, "GET /api/me", "GET", "/api/me",
+                                    headers=self.auth(random.choice(self.accounts)))
+
+    async def op_professionals(self):
+        params = random.choice([{}, {"category": "Médico"}, {"category": "Psicólogo"}])
+        await self.recorder.request(self.client, "GET /api/professionals", "GET", "/api/professionals",
+                                    params=params)
+
+    async def op_call(self):
+        caller, callee = self.accounts[self.turn % 2], self.accounts[(self.turn + 1) % 2]
+        self.turn += 1
+        response = await self.recorder.request(
+            self.client, "POST /api/call/initiate", "POST", "/api/call/initiate",
+            json={"professional_id": callee["id"]}, headers=self.auth(caller))
+        if response is None or response.status_code != 200:
+            return
+        call_id = response.json()["call_id"]
+        await self.recorder.request(self.client, "POST /api/call/{id}/accept", "POST",
+                                    f"/api/call/{call_id}/accept", headers=self.auth(callee))
+        await self.recorder.request(self.client, "POST /api/call/{id}/end", "POST",
+                                    f"/api/call/{call_id}/end", headers=self.auth(caller))
+
+    async def run(self, operations, weights, deadline: float):
+        while time.monotonic() < deadline:
+            await random.choices(operations, weights)[0]()
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float):
+    # Until warmup is done the server answers 503 to registration and call control
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/readyz")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.05)
+    raise RuntimeError("Server did not become ready")
+
+
+@asynccontextmanager
+async def open_client(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+            await wait_until_ready(client, args.timeout)
+            yield client
+        return
+
+    # In-process: import the app on the chosen storage engine and run its lifespan
+    os.environ.setdefault("STORAGE_ENGINE", args.storage)
+    from common import use_backend_modules
+
+    use_backend_modules()
+    import logging
+
+    logging.disable(logging.INFO)
+    from server import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits,
+                                     timeout=args.timeout) as client:
+            await wait_until_ready(client, args.timeout)
+            yield client
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="", help="Base URL of a running server; omit to run in-process")
+    parser.add_argument("--storage", default="memory", help="STORAGE_ENGINE for in-process runs")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    weights = parse_mix(args.mix)
+    recorder = Recorder()
+    run_id = uuid.uuid4().hex[:8]
+
+    async with open_client(args) as client:
+        users = [VirtualUser(client, recorder, run_id, i) for i in range(args.concurrency)]
+        await asyncio.gather(*(user.setup() for user in users))
+        # Setup traffic is not part of the measurement
+        recorder.latencies.clear()
+        recorder.statuses.clear()
+
+        started = time.monotonic()
+        deadline = started + args.duration
+        await asyncio.gather(*(
+            user.run([getattr(user, f"op_{name}") for name in weights], list(weights.values()), deadline)
+            for user in users
+        ))
+        elapsed = time.monotonic() - started
+
+    endpoints = {
+        name: {**summarize(latencies, elapsed), "statuses": dict(recorder.statuses[name])}
+        for name, latencies in sorted(recorder.latencies.items())
+    }
+    all_latencies = [value for latencies in recorder.latencies.values() for value in latencies]
+    emit({
+        "benchmark": "rest_load",
+        "target": args.url or f"in-process ({os.environ.get('STORAGE_ENGINE')})",
+        "concurrency": args.concurrency,
+        "duration_s": round(elapsed, 3),
+        "mix": weights,
+        "total": summarize(all_latencies, elapsed),
+        "endpoints": endpoints,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,125 @@
+"""Default vs tuned runtime profile on the REST and WebSocket workloads.
+
+Starts ``backend/serve.py`` once per profile (memory storage engine), runs
+``rest_load_benchmark.py`` and ``websocket_scale_benchmark.py`` against it as
+separate processes and collects their results:
+
+    python benchmarks/runtime_profile_benchmark.py --duration 20 --steps 1000,2500
+
+Run the load generators on another machine for absolute numbers; on one host
+they compete with the server for CPU. The server's own CPU time per request
+and per relayed message (from /proc, Linux only) is reported as well, since
+it does not depend on how much CPU the load generators take.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from common import BACKEND_DIR, emit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROFILES = ("default", "tuned")
+
+
+def start_server(profile: str, port: int, workers: str) -> subprocess.Popen:
+    env = {**os.environ, "STORAGE_ENGINE": "memory", "HOST": "127.0.0.1", "PORT": str(port),
+           "RUNTIME_PROFILE": profile, "WEB_CONCURRENCY": workers, "RECONCILE_ON_STARTUP": "false",
+           "LOG_LEVEL": "WARNING"}
+    return subprocess.Popen([sys.executable, "serve.py"], cwd=BACKEND_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_until_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            # Ready, not just listening: warmup runs after the port is bound
+            if httpx.get(f"{url}/readyz", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not become ready")
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime and stime, in clock ticks
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def run_benchmark(script: str, arguments: list) -> dict:
+    with tempfile.NamedTemporaryFile(suffix=".json") as output:
+        subprocess.run([sys.executable, os.path.join(HERE, script), *arguments, "--output", output.name],
+                       check=True, stdout=subprocess.DEVNULL)
+        with open(output.name) as f:
+            return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--profiles", default=",".join(PROFILES), help="Profiles to run, in order")
+    parser.add_argument("--workers", default="1", help="WEB_CONCURRENCY for both profiles")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20)
+    # Without register/login: bcrypt would dominate and hide the HTTP stack
+    parser.add_argument("--mix", default="me=30,professionals=50,call=5")
+    parser.add_argument("--steps", default="1000,2500", help="WebSocket session counts")
+    parser.add_argument("--settle", type=float, default=15)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+
+    results = {}
+    for profile in args.profiles.split(","):
+        url = f"http://127.0.0.1:{args.port}"
+        server = start_server(profile, args.port, args.workers)
+        try:
+            wait_until_ready(url)
+            rest_arguments = ["--url", url, "--concurrency", str(args.concurrency), "--mix", args.mix]
+            # Setup registers accounts (bcrypt); a zero-length run measures that to subtract it
+            cpu_before = cpu_seconds(server.pid)
+            run_benchmark("rest_load_benchmark.py", [*rest_arguments, "--duration", "0"])
+            cpu_setup = cpu_seconds(server.pid) - cpu_before
+            cpu_before = cpu_seconds(server.pid)
+            rest = run_benchmark("rest_load_benchmark.py", [*rest_arguments, "--duration", str(args.duration)])
+            cpu_rest = max(0.0, cpu_seconds(server.pid) - cpu_before - cpu_setup)
+            websocket = run_benchmark("websocket_scale_benchmark.py", [
+                "--url", url, "--server-pid", str(server.pid), "--steps", args.steps,
+                "--settle", str(args.settle)])
+            cpu_websocket = cpu_seconds(server.pid) - cpu_before - cpu_setup - cpu_rest
+        finally:
+            server.terminate()
+            server.wait(30)
+        # WebSocket CPU includes the connects
+        requests = sum(endpoint["count"] for endpoint in rest["endpoints"].values())
+        messages = sum(step["messages_received"] for step in websocket["steps"])
+        server_cpu = {
+            "rest_cpu_s": round(cpu_rest, 2),
+            "rest_cpu_ms_per_request": round(cpu_rest * 1000 / max(requests, 1), 3),
+            "websocket_cpu_s": round(cpu_websocket, 2),
+            "websocket_cpu_us_per_message": round(cpu_websocket * 1e6 / max(messages, 1), 1),
+        }
+        results[profile] = {"rest": rest, "websocket": websocket, "server_cpu": server_cpu}
+        total = rest["total"]
+        print(f"{profile:<8} REST {total['throughput_per_s']:>8} req/s  p50 {total['p50_ms']}ms  p99 {total['p99_ms']}ms"
+              f"  server {server_cpu['rest_cpu_ms_per_request']} CPU ms/request", file=sys.stderr)
+        for step in websocket["steps"]:
+            print(f"{profile:<8} WS {step['connections']:>6} conns  {step['connects_per_s']} connects/s"
+                  f"  {step['messages_per_s']} msg/s  p99 {step['relay_latency']['p99_ms']}ms",
+                  file=sys.stderr)
+        print(f"{profile:<8} WS server {server_cpu['websocket_cpu_us_per_message']} CPU us/message", file=sys.stderr)
+        args.port += 1  # Skip TIME_WAIT leftovers from the previous server
+
+    emit({"benchmark": "runtime_profile", "workers": args.workers, "mix": args.mix, "results": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
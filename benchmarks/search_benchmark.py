@@ -0,0 +1,109 @@
+"""Latency of professional search at catalog scale.
+
+Builds the in-process index over synthetic professionals, then times a mix of
+queries (single words, multi-word, prefixes, with and without a category
+filter) and profile updates. Each query is timed cold (result cache cleared, so
+every intersection runs) and warm (a repeat, as with typeahead or page 2):
+
+    python benchmarks/search_benchmark.py --professionals 100000
+"""
+import argparse
+import random
+import time
+
+from bson import ObjectId
+
+from common import emit, summarize, use_backend_modules
+
+use_backend_modules()
+from search import ProfessionalSearchIndex  # noqa: E402
+
+CATEGORIES = ["Médico", "Psicólogo"]
+FIRST_NAMES = ["Ana", "Bruno", "Carla", "Diego", "Eduarda", "Felipe", "Gabriela", "Henrique", "Isabela",
+               "João", "Larissa", "Marcos", "Natália", "Otávio", "Paula", "Rafael", "Sofia", "Thiago"]
+LAST_NAMES = ["Silva", "Souza", "Oliveira", "Santos", "Pereira", "Lima", "Carvalho", "Ferreira", "Rodrigues",
+              "Almeida", "Costa", "Gomes", "Martins", "Araújo", "Ribeiro", "Barbosa", "Rocha", "Dias"]
+SPECIALTIES = ["cardiologia", "pediatria", "dermatologia", "ansiedade", "depressão", "terapia cognitiva",
+               "casais", "nutrição", "ortopedia", "clínica geral", "psicanálise", "luto", "sono", "estresse"]
+FILLER = ["atendimento", "humanizado", "experiência", "anos", "consultas", "online", "adultos", "crianças",
+          "adolescentes", "acolhimento", "especialista", "formada", "pela", "universidade", "com", "foco", "em"]
+
+QUERIES = ["ana", "silva", "ansiedade", "terapia cognitiva", "pediatria crianças", "psica", "card",
+           "gabriela costa", "sono estresse", "clínica geral online", "zzz"]
+
+
+def synthetic_professional(rng: random.Random) -> dict:
+    words = rng.sample(FILLER, 8) + rng.sample(SPECIALTIES, 2)
+    rng.shuffle(words)
+    return {
+        "_id": ObjectId(),
+        "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}",
+        "description": " ".join(words).capitalize() + ".",
+        "category": rng.choice(CATEGORIES),
+        "professional_mode": True,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--professionals", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    users = [synthetic_professional(rng) for _ in range(args.professionals)]
+    index = ProfessionalSearchIndex()
+    started = time.perf_counter()
+    index.rebuild(users)
+    build_seconds = time.perf_counter() - started
+
+    per_query = {}
+    cold_latencies = []
+    warm_latencies = []
+    for i in range(args.queries):
+        query = QUERIES[i % len(QUERIES)]
+        category = CATEGORIES[i % 2] if i % 3 == 0 else None
+        index._results.clear()
+        started = time.perf_counter()
+        total, _ = index.search(query, category, offset=0, limit=args.page_size)
+        cold = time.perf_counter() - started
+        started = time.perf_counter()
+        index.search(query, category, offset=args.page_size, limit=args.page_size)
+        warm = time.perf_counter() - started
+        cold_latencies.append(cold)
+        warm_latencies.append(warm)
+        entry = per_query.setdefault(query, {"matches": total, "cold": [], "warm": []})
+        entry["cold"].append(cold)
+        entry["warm"].append(warm)
+
+    update_latencies = []
+    for user in rng.sample(users, min(1000, len(users))):
+        user["description"] = " ".join(rng.sample(FILLER + SPECIALTIES, 10))
+        started = time.perf_counter()
+        index.upsert(user)
+        update_latencies.append(time.perf_counter() - started)
+
+    queries = {}
+    for query, entry in per_query.items():
+        cold = summarize(entry["cold"], sum(entry["cold"]))
+        warm = summarize(entry["warm"], sum(entry["warm"]))
+        queries[query] = {"matches": entry["matches"], "cold_p50_ms": cold["p50_ms"], "cold_p99_ms": cold["p99_ms"],
+                          "warm_p50_ms": warm["p50_ms"], "warm_p99_ms": warm["p99_ms"]}
+        print(f"{query!r:<24} {entry['matches']:>7} matches  cold p50 {cold['p50_ms']:.3f}ms"
+              f" p99 {cold['p99_ms']:.3f}ms  warm p50 {warm['p50_ms']:.3f}ms")
+
+    emit({
+        "benchmark": "search",
+        "professionals": args.professionals,
+        "build_seconds": round(build_seconds, 2),
+        "search_cold": summarize(cold_latencies, sum(cold_latencies)),
+        "search_warm": summarize(warm_latencies, sum(warm_latencies)),
+        "update": summarize(update_latencies, sum(update_latencies)),
+        "queries": queries,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Time to first request and time to ready, with and without background warmup.
+
+Starts ``backend/serve.py`` repeatedly with ``WARMUP_IN_BACKGROUND`` on and
+off, and measures from spawn until ``/healthz`` first answers and until
+``/readyz`` first returns 200:
+
+    python benchmarks/startup_benchmark.py --storage mongo --runs 5
+
+Extra server settings can be passed as ``--env NAME=VALUE``, e.g. a
+``MONGO_URL`` for a slow or remote database.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from common import BACKEND_DIR, emit
+
+MODES = {"background": "true", "blocking": "false"}
+
+
+def start_server(port: int, storage: str, background: str, extra_env: dict) -> subprocess.Popen:
+    env = {**os.environ, "STORAGE_ENGINE": storage, "HOST": "127.0.0.1", "PORT": str(port),
+           "WARMUP_IN_BACKGROUND": background, "LOG_LEVEL": "WARNING", **extra_env}
+    return subprocess.Popen([sys.executable, "serve.py"], cwd=BACKEND_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def measure(url: str, spawned: float, timeout: float) -> dict:
+    first_request = ready = None
+    deadline = spawned + timeout
+    with httpx.Client(timeout=1) as client:
+        while ready is None and time.monotonic() < deadline:
+            try:
+                if first_request is None:
+                    client.get(f"{url}/healthz")
+                    first_request = time.monotonic() - spawned
+                if client.get(f"{url}/readyz").status_code == 200:
+                    ready = time.monotonic() - spawned
+                    break
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.01)
+    return {"first_request_s": first_request, "ready_s": ready}
+
+
+def summarize_runs(runs: list, key: str):
+    values = [run[key] for run in runs if run[key] is not None]
+    if not values:
+        return None
+    return {"median": round(statistics.median(values), 3), "min": round(min(values), 3),
+            "max": round(max(values), 3), "missing": len(runs) - len(values)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8810)
+    parser.add_argument("--storage", default="memory", choices=["memory", "mongo"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60, help="Give up on a run after this many seconds")
+    parser.add_argument("--env", action="append", default=[], help="NAME=VALUE passed to the server")
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+    extra_env = dict(item.split("=", 1) for item in args.env)
+
+    results = {}
+    for mode, background in MODES.items():
+        runs = []
+        for _ in range(args.runs):
+            url = f"http://127.0.0.1:{args.port}"
+            spawned = time.monotonic()
+            server = start_server(args.port, args.storage, background, extra_env)
+            try:
+                runs.append(measure(url, spawned, args.timeout))
+            finally:
+                server.terminate()
+                server.wait(30)
+            args.port += 1  # Skip TIME_WAIT leftovers from the previous server
+        results[mode] = {"first_request_s": summarize_runs(runs, "first_request_s"),
+                         "ready_s": summarize_runs(runs, "ready_s"), "runs": runs}
+        print(f"{mode:<10} first request {results[mode]['first_request_s']}  ready {results[mode]['ready_s']}",
+              file=sys.stderr)
+
+    emit({"benchmark": "startup", "storage": args.storage, "env": extra_env, "results": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
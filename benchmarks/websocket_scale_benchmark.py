@@ -0,0 +1,220 @@
+"""Scale harness for the /api/ws signaling endpoint.
+
+Ramps up to thousands of concurrent sessions against a local server, pairs them
+and has each pair exchange offer/answer/ICE bursts and chat messages. For every
+step it reports connect rate, relay latency percentiles, relayed messages/sec
+and server RSS per connection:
+
+    python benchmarks/websocket_scale_benchmark.py --spawn --steps 1000,5000,10000
+
+``--spawn`` starts ``backend/serve.py`` on the in-memory storage engine so RSS can
+be read from /proc; otherwise pass ``--url`` (and ``--server-pid`` for RSS).
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+import httpx
+import websockets
+
+from common import BACKEND_DIR, emit, summarize
+
+
+def rss_bytes(pid: Optional[int]) -> Optional[int]:
+    if not pid:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+class Session:
+    def __init__(self, index: int):
+        # Looks like an ObjectId so presence updates take the normal path
+        self.user_id = f"{index:024x}"
+        self.ws = None
+        self.peer: Optional["Session"] = None
+        self.latencies: List[float] = []
+        self.received = 0
+        self.reader: Optional[asyncio.Task] = None
+
+    async def open(self, ws_url: str):
+        self.ws = await websockets.connect(f"{ws_url}/api/ws/{self.user_id}", max_size=None,
+                                           ping_interval=None, compression=None)
+        self.reader = asyncio.create_task(self.read())
+
+    async def read(self):
+        try:
+            async for raw in self.ws:
+                message = json.loads(raw)
+                kind = message.get("type")
+                if kind == "ping":
+                    await self.ws.send('{"type": "pong"}')
+                    continue
+                sent_at = message.get("sent_at")
+                if sent_at is None and kind == "chat_message":
+                    sent_at = json.loads(message["message"]).get("sent_at")
+                if sent_at is not None:
+                    self.latencies.append(time.perf_counter() - sent_at)
+                self.received += 1
+        except websockets.ConnectionClosed:
+            pass
+
+    async def burst(self, ice_candidates: int, chats: int):
+        target = self.peer.user_id
+        frames = [{"type": "offer", "sdp": {"type": "offer", "sdp": "v=0\r\n" + "a=x\r\n" * 60}}]
+        frames.append({"type": "answer", "sdp": {"type": "answer", "sdp": "v=0\r\n" + "a=y\r\n" * 60}})
+        frames += [{"type": "ice-candidate", "candidate": {"candidate": f"candidate:{i} 1 udp 1 10.0.0.1 {5000 + i} typ host"}}
+                   for i in range(ice_candidates)]
+        for frame in frames:
+            await self.ws.send(json.dumps({**frame, "target": target, "sent_at": time.perf_counter()}))
+        for _ in range(chats):
+            payload = json.dumps({"text": "olá, tudo bem?", "sent_at": time.perf_counter()})
+            await self.ws.send(json.dumps({"type": "chat_message", "target": target, "message": payload}))
+        return len(frames) + chats
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self.reader is not None:
+            await self.reader
+
+
+async def open_sessions(sessions: List[Session], ws_url: str, parallel: int) -> float:
+    semaphore = asyncio.Semaphore(parallel)
+
+    async def open_one(session: Session):
+        async with semaphore:
+            await session.open(ws_url)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(open_one(session) for session in sessions))
+    return time.perf_counter() - started
+
+
+async def relay_round(sessions: List[Session], rounds: int, ice_candidates: int, chats: int, settle: float):
+    for session in sessions:
+        session.latencies.clear()
+        session.received = 0
+    started = time.perf_counter()
+    sent = 0
+    for _ in range(rounds):
+        sent += sum(await asyncio.gather(*(session.burst(ice_candidates, chats) for session in sessions)))
+    # Wait until everything sent has arrived (or give up after `settle` seconds)
+    deadline = time.perf_counter() + settle
+    while sum(session.received for session in sessions) < sent and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    received = sum(session.received for session in sessions)
+    latencies = [value for session in sessions for value in session.latencies]
+    return sent, received, elapsed, latencies
+
+
+def spawn_server(port: int) -> subprocess.Popen:
+    env = {**os.environ, "STORAGE_ENGINE": "memory", "PORT": str(port), "HOST": "127.0.0.1",
+           "RECONCILE_ON_STARTUP": "false"}
+    return subprocess.Popen([sys.executable, "serve.py"], cwd=BACKEND_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_until_ready(url: str, timeout: float = 20):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                # Ready, not just listening: sockets are refused until warmup is done
+                if (await client.get(f"{url}/readyz")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not become ready")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument("--spawn", action="store_true", help="Start backend/serve.py on --url's port")
+    parser.add_argument("--server-pid", type=int, default=None)
+    parser.add_argument("--steps", default="1000,2500,5000,10000", help="Cumulative session counts")
+    parser.add_argument("--parallel-connects", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--ice-candidates", type=int, default=8)
+    parser.add_argument("--chats", type=int, default=4)
+    parser.add_argument("--settle", type=float, default=30)
+    parser.add_argument("--output", default="")
+    args = parser.parse_args()
+
+    fd_limit = raise_fd_limit()
+    steps = [int(step) for step in args.steps.split(",")]
+    if steps[-1] + 64 > fd_limit:
+        print(f"warning: open file limit {fd_limit} is below the largest step", file=sys.stderr)
+
+    server = None
+    server_pid = args.server_pid
+    if args.spawn:
+        server = spawn_server(int(args.url.rsplit(":", 1)[1]))
+        server_pid = server.pid
+    ws_url = args.url.replace("http://", "ws://").replace("https://", "wss://")
+
+    sessions: List[Session] = []
+    results = []
+    try:
+        await wait_until_ready(args.url)
+        baseline_rss = rss_bytes(server_pid)
+        for target in steps:
+            new_sessions = [Session(i) for i in range(len(sessions), target)]
+            connect_seconds = await open_sessions(new_sessions, ws_url, args.parallel_connects)
+            sessions += new_sessions
+            # Pair neighbours: (0, 1), (2, 3), ...
+            for a, b in zip(sessions[0::2], sessions[1::2]):
+                a.peer, b.peer = b, a
+            paired = [session for session in sessions if session.peer is not None]
+
+            rss = rss_bytes(server_pid)
+            sent, received, elapsed, latencies = await relay_round(
+                paired, args.rounds, args.ice_candidates, args.chats, args.settle)
+            step = {
+                "connections": len(sessions),
+                "connects_per_s": round(len(new_sessions) / connect_seconds, 1) if connect_seconds else None,
+                "messages_sent": sent,
+                "messages_received": received,
+                "messages_per_s": round(received / elapsed, 1) if elapsed else 0,
+                "relay_latency": summarize(latencies, elapsed),
+                "server_rss_mb": round(rss / 2**20, 1) if rss else None,
+                "rss_per_connection_kb": (round((rss - baseline_rss) / len(sessions) / 1024, 2)
+                                          if rss and baseline_rss else None),
+            }
+            results.append(step)
+            print(f"{step['connections']:>6} conns  {step['connects_per_s']} conn/s  "
+                  f"{step['messages_per_s']} msg/s  p99={step['relay_latency']['p99_ms']}ms  "
+                  f"rss/conn={step['rss_per_connection_kb']}KB", file=sys.stderr)
+    finally:
+        await asyncio.gather(*(session.close() for session in sessions), return_exceptions=True)
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    emit({"benchmark": "websocket_scale", "target": args.url, "steps": results}, args.output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
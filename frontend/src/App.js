@@ -79,6 +79,10 @@ function App() {
         const message = JSON.parse(event.data);
         
         switch (message.type) {
+          case 'ping':
+            websocketRef.current?.send(JSON.stringify({ type: 'pong' }));
+            break;
+
           case 'call_request':
             setIncomingCall(message);
             break;
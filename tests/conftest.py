@@ -0,0 +1,53 @@
+import os
+import sys
+import time
+import uuid
+
+import pytest
+
+# The server reads its settings at import
+os.environ["STORAGE_ENGINE"] = "memory"
+# A round trip per storage call, so concurrent requests interleave as they would against Mongo
+os.environ.setdefault("MEMORY_STORAGE_LATENCY_MS", "2")
+os.environ.setdefault("LOG_ASYNC", "false")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+import server  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    # One lifespan for the session: the directory, registry and matchmaker are module state
+    with TestClient(server.app) as client:
+        deadline = time.monotonic() + 10
+        while not server.readiness.warmed:
+            assert time.monotonic() < deadline, "warmup did not finish"
+            time.sleep(0.01)
+        yield client
+
+
+@pytest.fixture
+def make_user(client):
+    """Register a user and return ``(headers, user)``; ``pro=True`` makes them an
+    online professional. Professionals go offline again after the test so they
+    are not matched or listed in the next one."""
+    professionals = []
+
+    def make(pro=False, category="Médico", price=10, **profile):
+        email = f"{uuid.uuid4().hex}@example.com"
+        response = client.post("/api/register", json={"name": email, "email": email, "password": "secret123"})
+        assert response.status_code == 200, response.text
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        if pro:
+            response = client.put("/api/profile", headers=headers, json={
+                "professional_mode": True, "category": category, "price_per_minute": price, **profile})
+            assert response.status_code == 200, response.text
+            assert client.put("/api/status", headers=headers, json={"status": "online"}).status_code == 200
+            professionals.append(headers)
+        return headers, client.get("/api/me", headers=headers).json()
+
+    yield make
+    for headers in professionals:
+        client.put("/api/status", headers=headers, json={"status": "offline"})
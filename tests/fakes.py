@@ -0,0 +1,16 @@
+class FakeWebSocket:
+    """Records what the server sends; enough of a Starlette WebSocket for the manager."""
+
+    def __init__(self):
+        self.accepted = False
+        self.sent = []
+        self.closed_with = None
+
+    async def accept(self):
+        self.accepted = True
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+    async def close(self, code=1000):
+        self.closed_with = code
@@ -0,0 +1,70 @@
+import asyncio
+from datetime import datetime
+
+from bson import ObjectId
+
+from balance_audit import audit
+from billing import SIGNUP_TOKENS, professional_earning
+from repositories import InMemoryStorage
+
+STARTED = datetime(2024, 3, 1, 12, 0)
+
+
+def ended_call(caller_id, callee_id, duration, cost, price=None, started=True):
+    call = {"caller_id": caller_id, "callee_id": callee_id, "status": "ended", "created_at": STARTED,
+            "started_at": STARTED if started else None, "duration_minutes": duration, "cost_tokens": cost}
+    if price is not None:
+        call["price_per_minute"] = price
+    return call
+
+
+def run_audit(chunk_size, extra_calls=()):
+    async def scenario():
+        storage = InMemoryStorage(latency_ms=0)
+        caller, pro, other = (str(ObjectId()) for _ in range(3))
+        calls = [
+            ended_call(caller, pro, 0.5, 10, price=10),   # minimum cost
+            ended_call(caller, pro, 4.3, 30),             # legacy: the callee's profile price, 7
+            ended_call(caller, pro, 1.0, 12, price=10),   # stored cost is wrong, but is what moved
+            ended_call(caller, pro, 0, 0, price=10, started=False),
+            *extra_calls,
+        ]
+        charged = sum(call["cost_tokens"] for call in calls[:4])
+        credited = sum(professional_earning(call["cost_tokens"]) for call in calls[:4])
+        await storage.users.create({"_id": ObjectId(caller), "email": "caller",
+                                    "token_balance": SIGNUP_TOKENS - charged})
+        await storage.users.create({"_id": ObjectId(pro), "email": "pro", "price_per_minute": 7,
+                                    "token_balance": SIGNUP_TOKENS + credited})
+        await storage.users.create({"_id": ObjectId(other), "email": "other", "token_balance": SIGNUP_TOKENS + 5})
+        call_ids = [await storage.calls.create(call) for call in calls]
+        return other, call_ids, await audit(storage, chunk_size=chunk_size)
+
+    return asyncio.run(scenario())
+
+
+def test_audit_reports_balances_and_costs_separately():
+    other, call_ids, result = run_audit(chunk_size=100)
+    summary = result["summary"]
+    assert summary["calls"] == 4 and summary["users"] == 3
+    assert summary["cost_mismatches"] == 1
+    assert summary["mismatched_calls"] == [call_ids[2]]
+    assert summary["users_with_discrepancy"] == 1 and summary["net_difference"] == 5
+    assert summary["unknown_participants"] == 0
+    discrepancy = result["discrepancies"].iloc[0]
+    assert discrepancy["user_id"] == other and discrepancy["difference"] == 5
+
+
+def test_audit_is_the_same_in_small_chunks():
+    _, _, whole = run_audit(chunk_size=100)
+    _, _, chunked = run_audit(chunk_size=1)
+    # Each run creates its own ids; everything else must match
+    for summary in (whole["summary"], chunked["summary"]):
+        summary.pop("mismatched_calls")
+    assert chunked["summary"] == whole["summary"]
+    assert chunked["discrepancies"].drop(columns="user_id").equals(whole["discrepancies"].drop(columns="user_id"))
+
+
+def test_calls_of_unknown_users_are_counted():
+    _, _, result = run_audit(chunk_size=100, extra_calls=[ended_call("gone", "also-gone", 1.0, 10, price=10)])
+    assert result["summary"]["unknown_participants"] == 2
+    assert result["summary"]["users_with_discrepancy"] == 1
@@ -0,0 +1,122 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import server
+from billing import MINIMUM_CALL_COST, SIGNUP_TOKENS
+from call_registry import CallRegistry
+
+
+def call(number, status="pending", placed_seconds_ago=120):
+    return {"_id": f"call-{number}", "caller_id": f"caller-{number}", "callee_id": f"callee-{number}",
+            "status": status, "created_at": datetime.utcnow() - timedelta(seconds=placed_seconds_ago)}
+
+
+def test_expire_drops_only_old_pending_calls():
+    registry = CallRegistry()
+    registry.rebuild([call(1), call(2, placed_seconds_ago=5), call(3, status="active")])
+    expired = []
+
+    async def on_expire(expired_call):
+        expired.append(expired_call["_id"])
+
+    asyncio.run(registry.expire(datetime.utcnow() - timedelta(seconds=60), on_expire))
+    assert expired == ["call-1"]
+    assert registry.expired_total == 1
+    assert "call-1" not in registry and "call-2" in registry and "call-3" in registry
+    assert registry.for_user("caller-1") == []
+
+
+def test_call_accepted_during_an_expiry_pass_is_kept():
+    registry = CallRegistry()
+    registry.rebuild([call(1), call(2)])
+    expired = []
+
+    async def on_expire(expired_call):
+        expired.append(expired_call["_id"])
+        # The callee of the other call picks up while this one is being cancelled
+        await asyncio.sleep(0)
+        registry.accept("call-2", "callee-2", datetime.utcnow())
+
+    asyncio.run(registry.expire(datetime.utcnow(), on_expire))
+    assert expired == ["call-1"]
+    assert registry.get("call-2")["status"] == "active"
+    assert registry.expired_total == 1
+
+
+def test_writes_for_a_call_land_in_order():
+    registry = CallRegistry()
+    landed = []
+
+    async def write(name, delay):
+        await asyncio.sleep(delay)
+        landed.append(name)
+
+    async def scenario():
+        registry.persist("call-1", lambda: write("accept", 0.02))
+        registry.persist("call-1", lambda: write("end", 0))
+        assert registry.pending_writes() == 1
+        await registry.flush("call-1")
+
+    asyncio.run(scenario())
+    assert landed == ["accept", "end"]
+    assert registry.pending_writes() == 0
+
+
+def place_call(client, caller, professional):
+    response = client.post("/api/call/initiate", headers=caller, json={"professional_id": professional["id"]})
+    assert response.status_code == 200, response.text
+    return response.json()["call_id"]
+
+
+def expire_all(client, on_expire=None):
+    client.portal.call(server.call_registry.expire, datetime.utcnow() + timedelta(seconds=1),
+                       on_expire or server.expire_unanswered_call)
+
+
+def test_unanswered_call_is_cancelled_and_frees_the_professional(client, make_user):
+    caller, caller_user = make_user()
+    pro, professional = make_user(pro=True)
+    call_id = place_call(client, caller, professional)
+
+    expire_all(client)
+    assert client.get(f"/api/call/{call_id}", headers=caller).json()["status"] == "cancelled"
+    assert client.get("/api/me", headers=pro).json()["status"] == "online"
+    assert client.post(f"/api/call/{call_id}/accept", headers=pro).status_code == 400
+    # The caller is not connected, so the hang-up waits in their queue
+    assert server.pending_messages.pending_count(caller_user["id"]) >= 1
+
+
+def test_accept_racing_the_expiry_pass_wins(client, make_user):
+    caller, _ = make_user()
+    first_pro, first = make_user(pro=True)
+    second_pro, second = make_user(pro=True)
+    first_call = place_call(client, caller, first)
+    second_call = place_call(client, make_user()[0], second)
+
+    async def expire_and_accept(expired_call):
+        await server.expire_unanswered_call(expired_call)
+        if str(expired_call["_id"]) == first_call:
+            # The accept handler runs while the pass is still going
+            callee = await server.storage.users.get(second["id"])
+            await server.accept_call(second_call, current_user=callee)
+
+    expire_all(client, expire_and_accept)
+    assert second_call in server.call_registry
+    assert client.get(f"/api/call/{first_call}", headers=caller).json()["status"] == "cancelled"
+    assert client.get(f"/api/call/{second_call}", headers=second_pro).json()["status"] == "active"
+    assert client.get("/api/me", headers=second_pro).json()["status"] == "busy"
+    client.post(f"/api/call/{second_call}/end", headers=second_pro)
+
+
+def test_accept_that_did_not_persist_is_still_billed(client, make_user, monkeypatch):
+    caller, _ = make_user()
+    pro, professional = make_user(pro=True)
+    call_id = place_call(client, caller, professional)
+
+    async def lost_accept(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(server.storage.calls, "accept", lost_accept)
+    assert client.post(f"/api/call/{call_id}/accept", headers=pro).status_code == 200
+    assert client.post(f"/api/call/{call_id}/end", headers=caller).json()["cost"] == MINIMUM_CALL_COST
+    assert client.get("/api/me", headers=caller).json()["token_balance"] == SIGNUP_TOKENS - MINIMUM_CALL_COST
@@ -0,0 +1,86 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from billing import MINIMUM_CALL_COST, SIGNUP_TOKENS, professional_earning
+
+
+def balance(client, headers):
+    return client.get("/api/me", headers=headers).json()["token_balance"]
+
+
+def status(client, headers):
+    return client.get("/api/me", headers=headers).json()["status"]
+
+
+def place_call(client, caller, professional):
+    response = client.post("/api/call/initiate", headers=caller, json={"professional_id": professional["id"]})
+    assert response.status_code == 200, response.text
+    return response.json()["call_id"]
+
+
+def test_accepted_call_is_billed_once(client, make_user):
+    caller, _ = make_user()
+    pro, professional = make_user(pro=True)
+
+    call_id = place_call(client, caller, professional)
+    assert status(client, pro) == "busy"
+    assert client.post(f"/api/call/{call_id}/accept", headers=pro).status_code == 200
+    assert client.get(f"/api/call/{call_id}", headers=caller).json()["status"] == "active"
+
+    ended = client.post(f"/api/call/{call_id}/end", headers=caller).json()
+    assert ended["cost"] == MINIMUM_CALL_COST
+    assert balance(client, caller) == SIGNUP_TOKENS - MINIMUM_CALL_COST
+    assert balance(client, pro) == SIGNUP_TOKENS + professional_earning(MINIMUM_CALL_COST)
+    assert status(client, pro) == "online"
+
+    # Ending again, from either side, reports the settled call and moves nothing
+    for headers in (caller, pro):
+        again = client.post(f"/api/call/{call_id}/end", headers=headers)
+        assert again.status_code == 200
+        assert again.json()["cost"] == ended["cost"]
+    assert balance(client, caller) == SIGNUP_TOKENS - MINIMUM_CALL_COST
+    assert balance(client, pro) == SIGNUP_TOKENS + professional_earning(MINIMUM_CALL_COST)
+
+
+def test_call_ended_before_accept_is_free(client, make_user):
+    caller, _ = make_user()
+    pro, professional = make_user(pro=True)
+
+    call_id = place_call(client, caller, professional)
+    assert client.post(f"/api/call/{call_id}/end", headers=caller).json()["cost"] == 0
+    assert balance(client, caller) == SIGNUP_TOKENS
+    assert balance(client, pro) == SIGNUP_TOKENS
+    assert status(client, pro) == "online"
+    assert client.post(f"/api/call/{call_id}/accept", headers=pro).status_code == 400
+
+
+def test_only_participants_control_a_call(client, make_user):
+    caller, _ = make_user()
+    stranger, _ = make_user()
+    pro, professional = make_user(pro=True)
+
+    call_id = place_call(client, caller, professional)
+    assert client.post(f"/api/call/{call_id}/accept", headers=caller).status_code == 403
+    assert client.post(f"/api/call/{call_id}/end", headers=stranger).status_code == 403
+    assert client.get(f"/api/call/{call_id}", headers=stranger).status_code == 403
+    client.post(f"/api/call/{call_id}/end", headers=caller)
+
+
+def test_concurrent_callers_reserve_a_professional_once(client, make_user):
+    callers = [make_user()[0] for _ in range(8)]
+    pro, professional = make_user(pro=True)
+
+    def initiate(headers):
+        return client.post("/api/call/initiate", headers=headers, json={"professional_id": professional["id"]})
+
+    with ThreadPoolExecutor(len(callers)) as pool:
+        responses = list(pool.map(initiate, callers))
+
+    placed = [response for response in responses if response.status_code == 200]
+    assert len(placed) == 1
+    assert all(response.status_code == 400 for response in responses if response not in placed)
+    assert status(client, pro) == "busy"
+
+    call_id = placed[0].json()["call_id"]
+    winner = callers[responses.index(placed[0])]
+    client.post(f"/api/call/{call_id}/end", headers=winner)
+    assert status(client, pro) == "online"
@@ -0,0 +1,65 @@
+import json
+
+from directory import ProfessionalDirectory
+from server import serialize_user
+
+
+def listed(client, **params):
+    response = client.get("/api/professionals", params={"limit": 100, **params})
+    assert response.status_code == 200
+    return {professional["id"]: professional for professional in response.json()}
+
+
+def test_profile_changes_reach_directory(client, make_user):
+    pro, professional = make_user(pro=True, category="Médico", price=10)
+    assert listed(client, category="Médico")[professional["id"]]["price_per_minute"] == 10
+
+    response = client.put("/api/profile", headers=pro, json={"category": "Psicólogo", "price_per_minute": 25})
+    assert response.status_code == 200
+    assert professional["id"] not in listed(client, category="Médico")
+    assert listed(client, category="Psicólogo")[professional["id"]]["price_per_minute"] == 25
+
+
+def test_status_changes_reach_directory(client, make_user):
+    pro, professional = make_user(pro=True)
+    assert listed(client, status="online")[professional["id"]]["status"] == "online"
+
+    client.put("/api/status", headers=pro, json={"status": "offline"})
+    assert professional["id"] not in listed(client, status="online")
+    assert listed(client, status="offline")[professional["id"]]["status"] == "offline"
+
+
+def test_leaving_professional_mode_removes_from_directory(client, make_user):
+    pro, professional = make_user(pro=True)
+    client.put("/api/profile", headers=pro, json={"professional_mode": False})
+    assert professional["id"] not in listed(client)
+
+
+def test_unknown_sort_is_rejected(client):
+    assert client.get("/api/professionals", params={"sort": "rating"}).status_code == 400
+
+
+def user(number, price, status="online", category="Médico"):
+    return {"_id": f"{number:024x}", "name": f"Nome {number}", "email": f"{number}@example.com",
+            "category": category, "price_per_minute": price, "status": status, "professional_mode": True}
+
+
+def ids(page):
+    return [json.loads(payload)["id"] for payload in page[1]]
+
+
+def test_views_stay_sorted_through_updates():
+    directory = ProfessionalDirectory(serialize_user)
+    directory.rebuild([user(1, 30), user(2, 10), user(3, 20, status="offline")])
+    assert ids(directory.page(order="price_asc")) == [f"{2:024x}", f"{3:024x}", f"{1:024x}"]
+    assert ids(directory.page(status="online", order="price_desc")) == [f"{1:024x}", f"{2:024x}"]
+
+    directory.upsert(user(1, 5))
+    directory.set_status_many([f"{3:024x}"], "online")
+    assert ids(directory.page(status="online", order="price_asc")) == [f"{1:024x}", f"{2:024x}", f"{3:024x}"]
+    assert directory.page(status="offline")[0] == 0
+    assert ids(directory.page(offset=1, limit=1)) == [f"{2:024x}"]
+
+    directory.remove(f"{2:024x}")
+    assert len(directory) == 2
+    assert directory.get_many([f"{2:024x}"]) == []
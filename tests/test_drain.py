@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+import uvicorn
+
+import serve
+import server
+from tests.fakes import FakeWebSocket
+
+
+def test_close_all_says_goodbye_and_refuses_new_sockets():
+    manager = server.ConnectionManager()
+    sockets = {user_id: FakeWebSocket() for user_id in ("a", "b")}
+
+    async def scenario():
+        for user_id, websocket in sockets.items():
+            await manager.connect(websocket, user_id)
+        user_ids = await manager.close_all({"type": "server_restarting"})
+        late = FakeWebSocket()
+        return user_ids, late, await manager.connect(late, "c")
+
+    user_ids, late, connection_id = asyncio.run(scenario())
+    assert sorted(user_ids) == ["a", "b"]
+    for websocket in sockets.values():
+        assert [json.loads(text) for text in websocket.sent] == [{"type": "server_restarting"}]
+        assert websocket.closed_with == 1012
+    assert connection_id is None and not late.accepted and late.closed_with == 1012
+    assert manager.active_connections == {} and manager.last_seen == {}
+
+
+def test_drain_marks_connected_users_offline_in_one_pass(client, make_user, monkeypatch):
+    professionals = [make_user(pro=True) for _ in range(2)]
+    manager = server.ConnectionManager(server.pending_messages)
+    monkeypatch.setattr(server, "manager", manager)
+    monkeypatch.setattr(server, "_drain_started", False)
+    for _, professional in professionals:
+        client.portal.call(manager.connect, FakeWebSocket(), professional["id"])
+
+    client.portal.call(server.drain_connections)
+    # Runs once; the lifespan's own call at shutdown is a no-op
+    client.portal.call(server.drain_connections)
+
+    listed = {professional["id"]: professional
+              for professional in client.get("/api/professionals", params={"limit": 100}).json()}
+    for headers, professional in professionals:
+        assert client.get("/api/me", headers=headers).json()["status"] == "offline"
+        assert listed[professional["id"]]["status"] == "offline"
+    assert not manager.accepting
+
+
+def test_draining_server_drains_before_uvicorn_closes_sockets(monkeypatch):
+    order = []
+
+    async def drain_connections():
+        order.append("drain")
+
+    async def shutdown(self, sockets=None):
+        order.append("close")
+
+    monkeypatch.setattr(server, "drain_connections", drain_connections)
+    monkeypatch.setattr(uvicorn.Server, "shutdown", shutdown)
+    asyncio.run(serve.DrainingServer(uvicorn.Config("server:app")).shutdown())
+    assert order == ["drain", "close"]
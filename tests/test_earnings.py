@@ -0,0 +1,62 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from billing import MINIMUM_CALL_COST, professional_earning
+from repositories import InMemoryEarningsRepository
+
+
+def test_rollups_accumulate_per_professional_and_day():
+    earnings = InMemoryEarningsRepository()
+
+    async def scenario():
+        await earnings.record("pro", "2024-03-01", 2.5, 25, 21)
+        await earnings.record("pro", "2024-03-01", 1.0, 10, 8)
+        await earnings.record("pro", "2024-03-03", 4.0, 40, 34)
+        await earnings.record("other", "2024-03-01", 1.0, 10, 8)
+        return await earnings.list_range("pro", "2024-03-01", "2024-03-02")
+
+    assert asyncio.run(scenario()) == [
+        {"professional_id": "pro", "day": "2024-03-01", "minutes": 3.5, "calls": 2, "gross": 35, "net": 29}]
+
+
+def settle_call(client, caller, pro, professional, accept=True):
+    response = client.post("/api/call/initiate", headers=caller, json={"professional_id": professional["id"]})
+    call_id = response.json()["call_id"]
+    if accept:
+        client.post(f"/api/call/{call_id}/accept", headers=pro)
+    client.post(f"/api/call/{call_id}/end", headers=caller)
+    return call_id
+
+
+def test_settled_calls_roll_up_into_today(client, make_user):
+    caller, _ = make_user()
+    pro, professional = make_user(pro=True)
+    first = settle_call(client, caller, pro, professional)
+    settle_call(client, caller, pro, professional)
+    settle_call(client, caller, pro, professional, accept=False)
+    # Ending again settles nothing
+    client.post(f"/api/call/{first}/end", headers=pro)
+
+    earnings = client.get("/api/me/earnings", headers=pro).json()
+    today = datetime.utcnow().date().isoformat()
+    assert earnings["to"] == today
+    assert [day["day"] for day in earnings["days"]] == [today]
+    assert earnings["totals"]["calls"] == 2
+    assert earnings["totals"]["gross"] == 2 * MINIMUM_CALL_COST
+    assert earnings["totals"]["net"] == 2 * professional_earning(MINIMUM_CALL_COST)
+    assert "professional_id" not in earnings["days"][0]
+
+
+def test_earnings_range(client, make_user):
+    pro, professional = make_user(pro=True)
+    settle_call(client, make_user()[0], pro, professional)
+    today = datetime.utcnow().date()
+
+    before = client.get("/api/me/earnings", headers=pro, params={
+        "from": (today - timedelta(days=10)).isoformat(), "to": (today - timedelta(days=1)).isoformat()})
+    assert before.json()["days"] == [] and before.json()["totals"]["calls"] == 0
+
+    backwards = {"from": today.isoformat(), "to": (today - timedelta(days=1)).isoformat()}
+    assert client.get("/api/me/earnings", headers=pro, params=backwards).status_code == 400
+    too_long = {"from": (today - timedelta(days=400)).isoformat(), "to": today.isoformat()}
+    assert client.get("/api/me/earnings", headers=pro, params=too_long).status_code == 400
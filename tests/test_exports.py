@@ -0,0 +1,101 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import server
+from billing import MINIMUM_CALL_COST, professional_earning
+from exports import EXPORT_FIELDS, stream_calls, to_record
+
+STARTED = datetime(2024, 3, 1, 12, 0)
+
+
+def calls(count):
+    for number in range(count):
+        yield {"_id": f"{number:024x}", "caller_id": "caller", "callee_id": "callee", "status": "ended",
+               "price_per_minute": 10, "created_at": STARTED, "started_at": STARTED,
+               "ended_at": STARTED + timedelta(minutes=3), "duration_minutes": 3.0, "cost_tokens": 30}
+
+
+async def cursor(count):
+    for call in calls(count):
+        yield call
+
+
+def export(count, fmt, compress=False, chunk_size=1024):
+    async def collect():
+        return [chunk async for chunk in stream_calls(cursor(count), fmt, compress, chunk_size=chunk_size)]
+
+    return asyncio.run(collect())
+
+
+def test_ndjson_rows_match_records():
+    chunks = export(1000, "ndjson")
+    assert len(chunks) > 10  # Streamed in pieces, not built whole
+    rows = [json.loads(line) for line in b"".join(chunks).decode().splitlines()]
+    assert rows == [to_record(call) for call in calls(1000)]
+    assert rows[0]["started_at"] == "2024-03-01T12:00:00"
+    # Not stored by end_call; exported as what it credited
+    assert rows[0]["professional_earning"] == professional_earning(30)
+
+
+def test_csv_has_header_and_one_row_per_call():
+    reader = csv.DictReader(io.StringIO(b"".join(export(300, "csv")).decode()))
+    assert tuple(reader.fieldnames) == EXPORT_FIELDS
+    rows = list(reader)
+    assert len(rows) == 300 and rows[-1]["id"] == f"{299:024x}" and rows[0]["cost_tokens"] == "30"
+
+
+def test_gzip_output_is_the_same_export():
+    assert gzip.decompress(b"".join(export(500, "csv", compress=True))) == b"".join(export(500, "csv"))
+
+
+def test_empty_export_and_unknown_format():
+    assert export(0, "ndjson") == []
+    assert b"".join(export(0, "csv")).decode().strip() == ",".join(EXPORT_FIELDS)
+    with pytest.raises(ValueError):
+        export(1, "xml")
+
+
+def make_admin(client, make_user):
+    headers, user = make_user()
+    client.portal.call(server.storage.users.update_fields, user["id"], {"role": "admin"})
+    return headers
+
+
+def test_admin_exports_todays_calls(client, make_user):
+    caller, _ = make_user()
+    pro, professional = make_user(pro=True)
+    call_id = client.post("/api/call/initiate", headers=caller,
+                          json={"professional_id": professional["id"]}).json()["call_id"]
+    client.post(f"/api/call/{call_id}/accept", headers=pro)
+    client.post(f"/api/call/{call_id}/end", headers=caller)
+    admin = make_admin(client, make_user)
+    today = datetime.utcnow().date().isoformat()
+    params = {"from": today, "to": today}
+
+    assert client.get("/api/admin/exports/calls", headers=caller, params=params).status_code == 403
+
+    response = client.get("/api/admin/exports/calls", headers=admin, params=params)
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert f"calls-{today}-{today}.ndjson" in response.headers["content-disposition"]
+    rows = {row["id"]: row for row in map(json.loads, response.text.splitlines())}
+    assert rows[call_id]["cost_tokens"] == MINIMUM_CALL_COST and rows[call_id]["status"] == "ended"
+
+    response = client.get("/api/admin/exports/calls", headers=admin,
+                          params={**params, "format": "csv", "gzip": True})
+    assert response.headers["content-type"] == "application/gzip"
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.content).decode())))
+    assert call_id in {row["id"] for row in rows}
+
+
+def test_export_parameters_are_checked(client, make_user):
+    admin = make_admin(client, make_user)
+    assert client.get("/api/admin/exports/calls", headers=admin,
+                      params={"from": "2024-03-02", "to": "2024-03-01"}).status_code == 400
+    assert client.get("/api/admin/exports/calls", headers=admin,
+                      params={"from": "2024-03-01", "to": "2024-03-01", "format": "xml"}).status_code == 400
@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+import server
+from heartbeat import PING_FRAME, HeartbeatSweeper
+from tests.fakes import FakeWebSocket
+
+
+def connect(manager, user_id, quiet_for):
+    websocket = FakeWebSocket()
+    connection_id = f"conn-{user_id}"
+    manager.active_connections[connection_id] = websocket
+    manager.user_connections[user_id] = connection_id
+    manager.last_seen[connection_id] = (user_id, time.monotonic() - quiet_for)
+    return connection_id, websocket
+
+
+def sweeper(manager, reaped):
+    async def on_reap(connection_id, user_id):
+        reaped.append((connection_id, user_id))
+
+    return HeartbeatSweeper(manager, on_reap, interval=20, idle_timeout=60)
+
+
+def test_sweep_pings_quiet_sockets_and_reaps_dead_ones():
+    manager = server.ConnectionManager()
+    _, fresh = connect(manager, "fresh", quiet_for=1)
+    _, quiet = connect(manager, "quiet", quiet_for=30)
+    dead_id, dead = connect(manager, "dead", quiet_for=90)
+    reaped = []
+    heartbeat = sweeper(manager, reaped)
+
+    asyncio.run(heartbeat.sweep())
+
+    assert fresh.sent == []
+    assert quiet.sent == [PING_FRAME]
+    assert dead.closed_with == 1001
+    assert reaped == [(dead_id, "dead")]
+    assert heartbeat.reaped_total == 1 and heartbeat.pings_sent == 1
+    assert not manager.is_connected("dead") and manager.is_connected("quiet")
+
+
+def test_connection_gone_before_reap_is_not_counted():
+    manager = server.ConnectionManager()
+    dead_id, _ = connect(manager, "dead", quiet_for=90)
+    reaped = []
+    heartbeat = sweeper(manager, reaped)
+
+    manager.disconnect(dead_id, "dead")
+    asyncio.run(heartbeat.sweep())
+    assert reaped == [] and heartbeat.reaped_total == 0
+
+
+def test_handler_exit_after_reap_does_not_clean_up_again():
+    manager = server.ConnectionManager()
+    dead_id, _ = connect(manager, "dead", quiet_for=90)
+    asyncio.run(sweeper(manager, []).sweep())
+    # The reaper already ran presence cleanup for this connection
+    assert manager.release(dead_id, "dead") is False
+
+
+def test_reaped_user_goes_offline(client, make_user):
+    pro, professional = make_user(pro=True)
+    reaped_before = server.heartbeat.reaped_total
+
+    with client.websocket_connect(f"/api/ws/{professional['id']}"):
+        deadline = time.monotonic() + 2
+        while not server.manager.is_connected(professional["id"]):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        connection_id = server.manager.user_connections[professional["id"]]
+        server.manager.last_seen[connection_id] = (professional["id"], time.monotonic() - 3600)
+        client.portal.call(server.heartbeat.sweep)
+
+        assert not server.manager.is_connected(professional["id"])
+        assert client.get("/api/me", headers=pro).json()["status"] == "offline"
+        assert server.heartbeat.reaped_total == reaped_before + 1
+        assert f"ws_reaped_total {reaped_before + 1}" in client.get("/metrics").text
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from billing import MINIMUM_CALL_COST, SIGNUP_TOKENS
+from idempotency import IdempotencyKeys, KeyReused
+from tests.test_calls import balance, place_call, status
+
+
+def test_replays_the_stored_response():
+    keys = IdempotencyKeys()
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        return {"call_id": "call-1"}
+
+    async def scenario():
+        first = await keys.run("key", {"professional_id": "p"}, handler)
+        retry = await keys.run("key", {"professional_id": "p"}, handler)
+        with pytest.raises(KeyReused):
+            await keys.run("key", {"professional_id": "other"}, handler)
+        return first, retry
+
+    first, retry = asyncio.run(scenario())
+    assert first == ({"call_id": "call-1"}, False)
+    assert retry == ({"call_id": "call-1"}, True)
+    assert calls == [1]
+
+
+def test_failed_handler_is_not_stored():
+    keys = IdempotencyKeys()
+
+    async def failing():
+        raise RuntimeError("boom")
+
+    async def succeeding():
+        return {"ok": True}
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await keys.run("key", {}, failing)
+        return await keys.run("key", {}, succeeding)
+
+    assert asyncio.run(scenario()) == ({"ok": True}, False)
+
+
+def test_initiate_with_idempotency_key_replays(client, make_user):
+    caller, _ = make_user()
+    pro, professional = make_user(pro=True)
+    headers = {**caller, "Idempotency-Key": "initiate-1"}
+    body = {"professional_id": professional["id"]}
+
+    first = client.post("/api/call/initiate", headers=headers, json=body)
+    retry = client.post("/api/call/initiate", headers=headers, json=body)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+
+    other_pro, other = make_user(pro=True)
+    conflict = client.post("/api/call/initiate", headers=headers, json={"professional_id": other["id"]})
+    assert conflict.status_code == 422
+    assert status(client, other_pro) == "online"
+
+    client.post(f"/api/call/{first.json()['call_id']}/end", headers=caller)
+
+
+def test_end_with_idempotency_key_replays(client, make_user):
+    caller, _ = make_user()
+    pro, professional = make_user(pro=True)
+    call_id = place_call(client, caller, professional)
+    client.post(f"/api/call/{call_id}/accept", headers=pro)
+
+    headers = {**caller, "Idempotency-Key": "end-1"}
+    first = client.post(f"/api/call/{call_id}/end", headers=headers)
+    retry = client.post(f"/api/call/{call_id}/end", headers=headers)
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert balance(client, caller) == SIGNUP_TOKENS - MINIMUM_CALL_COST
+
+    # The key is scoped to the call it ended
+    other_call = place_call(client, caller, professional)
+    assert client.post(f"/api/call/{other_call}/end", headers=headers).status_code == 422
+    client.post(f"/api/call/{other_call}/end", headers=caller)
+
+
+def test_idempotency_key_length_is_checked(client, make_user):
+    caller, _ = make_user()
+    response = client.post("/api/call/initiate", headers={**caller, "Idempotency-Key": "k" * 256},
+                           json={"professional_id": "000000000000000000000000"})
+    assert response.status_code == 400
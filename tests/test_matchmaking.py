@@ -0,0 +1,77 @@
+import time
+
+import server
+
+CATEGORY = "Psicólogo"
+
+
+def wait_for(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def queue_status(client, headers):
+    return client.get("/api/call/request", headers=headers).json()
+
+
+def test_waiting_caller_is_matched_with_available_professional(client, make_user):
+    caller, caller_user = make_user()
+    response = client.post("/api/call/request", headers=caller, params={"category": CATEGORY})
+    assert response.status_code == 200
+    assert response.json()["status"] == "queued"
+    assert queue_status(client, caller)["position"] == 1
+
+    pro, professional = make_user(pro=True, category=CATEGORY)
+    wait_for(lambda: queue_status(client, caller)["status"] == "none")
+    wait_for(lambda: client.get("/api/me", headers=pro).json()["status"] == "busy")
+
+    calls = client.get("/api/calls", headers=caller).json()
+    call = next(call for call in calls if call["callee_id"] == professional["id"])
+    assert call["caller_id"] == caller_user["id"]
+    client.post(f"/api/call/{call['id']}/end", headers=caller)
+
+
+def test_callers_are_matched_in_order(client, make_user):
+    first, _ = make_user()
+    second, _ = make_user()
+    for headers in (first, second):
+        client.post("/api/call/request", headers=headers, params={"category": CATEGORY})
+    assert queue_status(client, second)["position"] == 2
+
+    pro, professional = make_user(pro=True, category=CATEGORY)
+    wait_for(lambda: queue_status(client, first)["status"] == "none")
+    assert queue_status(client, second)["position"] == 1
+
+    call = next(call for call in client.get("/api/calls", headers=first).json()
+                if call["callee_id"] == professional["id"])
+    client.post(f"/api/call/{call['id']}/end", headers=first)
+    # Back online, the professional takes the next caller
+    wait_for(lambda: queue_status(client, second)["status"] == "none")
+    call = next(call for call in client.get("/api/calls", headers=second).json()
+                if call["callee_id"] == professional["id"])
+    client.post(f"/api/call/{call['id']}/end", headers=second)
+
+
+def test_cancel_leaves_the_queue(client, make_user):
+    caller, _ = make_user()
+    client.post("/api/call/request", headers=caller, params={"category": CATEGORY})
+    assert client.delete("/api/call/request", headers=caller).status_code == 200
+    assert queue_status(client, caller) == {"status": "none", "position": 0, "waiting": 0}
+    assert client.delete("/api/call/request", headers=caller).status_code == 404
+
+
+def test_request_is_validated(client, make_user):
+    caller, _ = make_user()
+    assert client.post("/api/call/request", headers=caller, params={"category": "Mecânico"}).status_code == 400
+
+
+def test_waiting_too_long_expires(client, make_user, monkeypatch):
+    caller, _ = make_user()
+    client.post("/api/call/request", headers=caller, params={"category": CATEGORY})
+    assert queue_status(client, caller)["status"] == "queued"
+
+    monkeypatch.setattr(server.matchmaker, "max_wait", 0)
+    client.portal.call(server.matchmaker.tick)
+    assert queue_status(client, caller)["status"] == "none"
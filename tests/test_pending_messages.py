@@ -0,0 +1,126 @@
+import asyncio
+import json
+
+from pending_messages import PendingMessageQueue
+
+
+def chat(i, text=""):
+    return {"type": "chat_message", "n": i, "text": text}
+
+
+def size(message):
+    return len(json.dumps(message))
+
+
+class FakeCollection:
+    """Enough of a Motor collection for spilling and draining."""
+
+    def __init__(self):
+        self.docs = []
+
+    async def insert_many(self, docs, ordered=True):
+        self.docs.extend(docs)
+
+    def find(self, query, projection=None):
+        docs = sorted((doc for doc in self.docs if doc["user_id"] == query["user_id"]),
+                      key=lambda doc: doc["seq"], reverse=True)
+        return FakeCursor(docs)
+
+    async def delete_many(self, query):
+        self.docs = [doc for doc in self.docs
+                     if doc["user_id"] != query["user_id"] or doc["seq"] > query["seq"]["$lte"]]
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, *args):
+        return self
+
+    async def to_list(self, length):
+        return self.docs[:length]
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_only_durable_messages_are_queued():
+    queue = PendingMessageQueue()
+    assert not run(queue.enqueue("u", {"type": "offer", "sdp": "x"}))
+    assert not run(queue.enqueue("u", {"type": "ice-candidate"}))
+    assert run(queue.enqueue("u", {"type": "call_request", "call_id": "c"}))
+    assert queue.memory_count == 1
+    assert run(queue.drain("u")) == [{"type": "call_request", "call_id": "c"}]
+
+
+def test_oversized_message_is_not_queued():
+    queue = PendingMessageQueue(max_message_bytes=100)
+    assert not run(queue.enqueue("u", {"type": "file_message", "data": "x" * 200}))
+    assert run(queue.enqueue("u", {"type": "file_message", "data": "x" * 10}))
+    assert queue.pending_count("u") == 1
+
+
+def test_user_backlog_drops_oldest_by_count():
+    queue = PendingMessageQueue(max_per_user=3)
+    for i in range(5):
+        run(queue.enqueue("u", chat(i)))
+    assert queue.memory_count == 3
+    assert [message["n"] for message in run(queue.drain("u"))] == [2, 3, 4]
+    assert queue.memory_count == queue.memory_bytes == 0
+
+
+def test_user_backlog_drops_oldest_by_bytes():
+    message_bytes = size(chat(0, "x" * 100))
+    queue = PendingMessageQueue(max_user_bytes=3 * message_bytes)
+    for i in range(5):
+        run(queue.enqueue("u", chat(i, "x" * 100)))
+    assert queue.memory_bytes <= 3 * message_bytes
+    assert [message["n"] for message in run(queue.drain("u"))] == [2, 3, 4]
+
+
+def test_global_budget_spills_least_recent_user():
+    collection = FakeCollection()
+    message_bytes = size(chat(0, "x" * 100))
+    queue = PendingMessageQueue(collection, max_memory_bytes=4 * message_bytes)
+    for i in range(3):
+        run(queue.enqueue("old", chat(i, "x" * 100)))
+    for i in range(3):
+        run(queue.enqueue("new", chat(i, "x" * 100)))
+
+    assert queue.pending_count("old") == 0
+    assert queue.pending_count("new") == 3
+    assert queue.memory_bytes <= 4 * message_bytes
+    assert len(collection.docs) == 3
+    # Spilled messages come back in order when the user reconnects
+    assert [message["n"] for message in run(queue.drain("old"))] == [0, 1, 2]
+    assert collection.docs == []
+
+
+def test_global_message_budget_drops_without_collection():
+    queue = PendingMessageQueue(max_memory_messages=2)
+    run(queue.enqueue("a", chat(0)))
+    run(queue.enqueue("b", chat(0)))
+    run(queue.enqueue("c", chat(0)))
+    assert queue.memory_count == 2
+    assert run(queue.drain("a")) == []
+
+
+def test_expired_messages_are_not_delivered():
+    queue = PendingMessageQueue(max_age_seconds=0)
+    run(queue.enqueue("u", chat(0)))
+    assert run(queue.drain("u")) == []
+
+
+def test_offline_user_receives_backlog_on_connect(client, make_user):
+    caller, _ = make_user()
+    pro, professional = make_user(pro=True)
+    response = client.post("/api/call/initiate", headers=caller, json={"professional_id": professional["id"]})
+    call_id = response.json()["call_id"]
+
+    with client.websocket_connect(f"/api/ws/{professional['id']}") as websocket:
+        message = websocket.receive_json()
+        assert message["type"] == "call_request"
+        assert message["call_id"] == call_id
+    client.post(f"/api/call/{call_id}/end", headers=caller)
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+import server
+from readiness import Readiness
+
+
+def test_warmup_runs_every_step_and_records_failures():
+    ran = []
+
+    async def step(name, fail=False):
+        ran.append(name)
+        if fail:
+            raise RuntimeError(name)
+
+    async def check():
+        pass
+
+    readiness = Readiness(check)
+    steps = [("indexes", lambda: step("indexes")),
+             ("reconciliation", lambda: step("reconciliation", fail=True)),
+             ("directory", lambda: step("directory"))]
+    asyncio.run(readiness.warm_up(steps))
+
+    assert ran == ["indexes", "reconciliation", "directory"]
+    assert {name: step["status"] for name, step in readiness.steps.items()} == {
+        "indexes": "ok", "reconciliation": "failed", "directory": "ok"}
+    assert readiness.ready and readiness.snapshot()["status"] == "ready"
+
+
+def test_not_ready_while_the_database_check_fails():
+    async def check():
+        raise ConnectionError("no database")
+
+    readiness = Readiness(check, timeout=0.1)
+    asyncio.run(readiness.warm_up([]))
+    snapshot = readiness.snapshot()
+    assert readiness.warmed and not readiness.ready
+    assert snapshot["status"] == "unavailable"
+    assert "no database" in snapshot["database"]["error"]
+
+
+def test_ready_once_warmed(client):
+    assert client.get("/healthz").json() == {"status": "ok"}
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    assert set(response.json()["steps"]) == {name for name, _ in server.WARMUP_STEPS}
+
+
+def test_state_changing_routes_wait_for_warmup(client, make_user, monkeypatch):
+    pro, professional = make_user(pro=True)
+    monkeypatch.setattr(server.readiness, "warmed", False)
+
+    response = client.post("/api/register",
+                           json={"name": "x", "email": "warming@example.com", "password": "secret123"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert client.put("/api/status", headers=pro, json={"status": "offline"}).status_code == 503
+    assert client.get("/api/professionals").status_code == 503
+    initiate = client.post("/api/call/initiate", headers=pro, json={"professional_id": professional["id"]})
+    assert initiate.status_code == 503
+    assert client.get("/readyz").json()["status"] == "warming_up"
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with client.websocket_connect(f"/api/ws/{professional['id']}") as websocket:
+            websocket.receive_json()
+    assert closed.value.code == 1013
+
+    # Liveness and reads that warmup does not rebuild still answer
+    assert client.get("/healthz").status_code == 200
+    assert client.get("/api/me", headers=pro).status_code == 200
@@ -0,0 +1,147 @@
+"""Startup reconciliation against a real MongoDB.
+
+The settlement pipelines ($facet, $merge) only run on mongod, so these tests
+need one at ``MONGO_URL`` (default ``mongodb://localhost:27017``) and are
+skipped otherwise. Each test works in a throwaway database.
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from billing import DEFAULT_PRICE_PER_MINUTE, MINIMUM_CALL_COST, PROFESSIONAL_SHARE, professional_earning
+from reconciliation import reconcile_state
+
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+
+
+async def _mongo_available() -> bool:
+    client = AsyncIOMotorClient(MONGO_URL, serverSelectionTimeoutMS=500)
+    try:
+        await client.admin.command("ping")
+        return True
+    except Exception:
+        return False
+    finally:
+        client.close()
+
+
+pytestmark = pytest.mark.skipif(not asyncio.run(_mongo_available()), reason=f"no MongoDB at {MONGO_URL}")
+
+
+def with_database(scenario):
+    async def run():
+        client = AsyncIOMotorClient(MONGO_URL)
+        name = f"reconciliation_test_{uuid.uuid4().hex[:12]}"
+        db = client[name]
+        await db.earnings_daily.create_index([("professional_id", 1), ("day", 1)], unique=True)
+        try:
+            await scenario(db)
+        finally:
+            await client.drop_database(name)
+            client.close()
+
+    asyncio.run(run())
+
+
+def reconcile(db, **kwargs):
+    return reconcile_state(
+        db, minimum_cost=MINIMUM_CALL_COST, professional_share=PROFESSIONAL_SHARE,
+        default_price=DEFAULT_PRICE_PER_MINUTE, max_call_minutes=60, **kwargs)
+
+
+async def add_user(db, status="offline", balance=1000, **fields) -> str:
+    result = await db.users.insert_one({"status": status, "token_balance": balance, **fields})
+    return str(result.inserted_id)
+
+
+async def balance(db, user_id) -> int:
+    return (await db.users.find_one({"_id": ObjectId(user_id)}))["token_balance"]
+
+
+def test_claims_settles_and_rerun_is_a_no_op():
+    async def scenario(db):
+        caller = await add_user(db, status="online")
+        callee = await add_user(db, status="busy", price_per_minute=7)
+        started = datetime.utcnow() - timedelta(hours=2)
+        await db.calls.insert_many([
+            {"caller_id": caller, "callee_id": callee, "status": "pending"},
+            {"caller_id": caller, "callee_id": callee, "status": "active", "started_at": None},
+            # Capped at 60 minutes; one at the agreed price, one legacy call at the profile price
+            {"caller_id": caller, "callee_id": callee, "status": "active", "started_at": started,
+             "price_per_minute": 10},
+            {"caller_id": caller, "callee_id": callee, "status": "active", "started_at": started},
+        ])
+
+        report = await reconcile(db, settle_calls=True)
+        cost = 60 * 10 + 60 * 7
+        earning = professional_earning(600) + professional_earning(420)
+        assert report["users_reset"] == 2
+        assert report["calls_cancelled"] == 2
+        assert report["calls_settled"] == 2
+        assert report["tokens_debited"] == cost
+        assert report["tokens_credited"] == earning
+        assert await balance(db, caller) == 1000 - cost
+        assert await balance(db, callee) == 1000 + earning
+
+        settled = await db.calls.find({"status": "ended"}).sort("cost_tokens", -1).to_list(None)
+        assert [call["cost_tokens"] for call in settled] == [600, 420]
+        assert all(call["duration_minutes"] == 60 and "settling" not in call for call in settled)
+        day = await db.earnings_daily.find_one({"professional_id": callee})
+        assert (day["calls"], day["gross"], day["net"], day["minutes"]) == (2, cost, earning, 120)
+        assert not day.get("settlement_runs")
+        assert await db.users.count_documents({"settlement_runs": {"$nin": [None, []]}}) == 0
+
+        again = await reconcile(db, settle_calls=True)
+        assert again["calls_settled"] == again["tokens_debited"] == again["tokens_credited"] == 0
+        assert await balance(db, caller) == 1000 - cost
+        assert await balance(db, callee) == 1000 + earning
+        assert (await db.earnings_daily.find_one({"professional_id": callee}))["gross"] == cost
+
+    with_database(scenario)
+
+
+def test_resumes_an_interrupted_run_without_charging_twice():
+    async def scenario(db):
+        # The crashed run charged the caller but had not credited the callee or rolled up
+        caller = await add_user(db, balance=900, settlement_runs=["run-1"])
+        callee = await add_user(db)
+        ended = datetime.utcnow()
+        await db.calls.insert_one({
+            "caller_id": caller, "callee_id": callee, "status": "settling", "settling": "run-1",
+            "started_at": ended - timedelta(minutes=10), "ended_at": ended,
+            "duration_minutes": 10, "cost_tokens": 100, "professional_earning": 85,
+        })
+
+        report = await reconcile(db, settle_calls=True)
+        assert report["calls_settled"] == 1
+        assert await balance(db, caller) == 900
+        assert await balance(db, callee) == 1085
+        call = await db.calls.find_one({})
+        assert call["status"] == "ended" and "settling" not in call
+        assert (await db.earnings_daily.find_one({"professional_id": callee}))["gross"] == 100
+
+    with_database(scenario)
+
+
+def test_settlement_is_off_by_default():
+    async def scenario(db):
+        caller = await add_user(db, status="online")
+        callee = await add_user(db, status="busy")
+        await db.calls.insert_one({
+            "caller_id": caller, "callee_id": callee, "status": "active",
+            "started_at": datetime.utcnow() - timedelta(minutes=5), "price_per_minute": 10,
+        })
+
+        report = await reconcile(db)
+        assert report["users_reset"] == 2
+        assert report["calls_settled"] == 0
+        assert report["calls_awaiting_settlement"] == 1
+        assert (await db.calls.find_one({}))["status"] == "active"
+        assert await balance(db, caller) == await balance(db, callee) == 1000
+
+    with_database(scenario)
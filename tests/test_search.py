@@ -0,0 +1,98 @@
+import uuid
+
+from search import BITMAP_DENSITY, ProfessionalSearchIndex
+
+
+def professional(number, name, description="", category="Médico"):
+    return {"_id": f"{number:024x}", "name": name, "description": description,
+            "category": category, "professional_mode": True}
+
+
+def test_name_matches_rank_above_description_matches():
+    index = ProfessionalSearchIndex()
+    index.rebuild([
+        professional(1, "Ana", "cardiologia"),
+        professional(2, "Cardoso", "clinica geral"),
+    ])
+    assert index.search("cardoso") == (1, [f"{2:024x}"])
+    assert index.search("card")[1] == [f"{2:024x}", f"{1:024x}"]
+
+
+def test_terms_are_anded_across_bitmap_and_set_tiers():
+    # Enough documents that the common term's tier is a bitmap and the rare one a set
+    users = [professional(number, f"Pessoa {number}", "terapia", "Psicólogo")
+             for number in range(2 * BITMAP_DENSITY)]
+    users.append(professional(9999, "Pessoa rara", "terapia familiar", "Psicólogo"))
+    index = ProfessionalSearchIndex()
+    index.rebuild(users)
+
+    assert index.search("terapia familiar") == (1, [f"{9999:024x}"])
+    assert index.search("terapia", category="Médico") == (0, [])
+    total, page = index.search("terapia pessoa", offset=10, limit=5)
+    assert total == len(users) and len(page) == 5
+
+
+def test_where_filters_before_paging():
+    index = ProfessionalSearchIndex()
+    index.rebuild([professional(number, f"Nome {number}") for number in range(10)])
+    odd = lambda user_id: int(user_id, 16) % 2 == 1
+    total, page = index.search("nome", offset=2, limit=2, where=odd)
+    assert total == 5
+    assert all(odd(user_id) for user_id in page) and len(page) == 2
+
+
+def test_upsert_and_remove_update_results():
+    index = ProfessionalSearchIndex()
+    index.rebuild([professional(1, "Ana", "pediatria")])
+    index.upsert(professional(1, "Ana", "neurologia"))
+    assert index.search("pediatria") == (0, [])
+    assert index.search("neurologia")[0] == 1
+    index.upsert({**professional(1, "Ana"), "professional_mode": False})
+    assert index.search("ana") == (0, [])
+
+
+def word():
+    return f"word{uuid.uuid4().hex[:12]}"
+
+
+def found(client, **params):
+    response = client.get("/api/professionals", params={"limit": 100, **params})
+    assert response.status_code == 200
+    return [professional["id"] for professional in response.json()]
+
+
+def test_search_pages_with_total_count(client, make_user):
+    term = word()
+    first = make_user(pro=True, description=f"{term} one")[1]
+    second = make_user(pro=True, description=f"{term} two")[1]
+
+    response = client.get("/api/professionals", params={"q": term, "limit": 1})
+    assert response.headers["X-Total-Count"] == "2"
+    assert len(response.json()) == 1
+    assert set(found(client, q=term)) == {first["id"], second["id"]}
+
+
+def test_search_filters_by_status(client, make_user):
+    term = word()
+    online = make_user(pro=True, description=term)[1]
+    away, offline = make_user(pro=True, description=term)
+    client.put("/api/status", headers=away, json={"status": "offline"})
+
+    assert found(client, q=term, status="online") == [online["id"]]
+    assert found(client, q=term, status="offline") == [offline["id"]]
+    response = client.get("/api/professionals", params={"q": term, "status": "online"})
+    assert response.headers["X-Total-Count"] == "1"
+
+
+def test_search_rejects_sort(client):
+    response = client.get("/api/professionals", params={"q": "ana", "sort": "price_asc"})
+    assert response.status_code == 400
+
+
+def test_description_change_reaches_search(client, make_user):
+    old, new = word(), word()
+    pro, professional = make_user(pro=True, description=old)
+    client.put("/api/profile", headers=pro, json={"description": new})
+    assert found(client, q=old) == []
+    assert found(client, q=new) == [professional["id"]]
+    assert found(client, q=new, category="Psicólogo") == []